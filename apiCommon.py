@@ -0,0 +1,1329 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP helpers for the ShipStation and SureDone clients
+
+@owner: Patrick Mahoney
+@version: 0.0.1
+
+Both scripts make their api calls through one long-lived pooled session so that
+connections are kept alive and reused instead of doing a new TCP+TLS handshake
+on every request.
+Requests to the same account are paced by a shared RateLimiter that follows the
+X-Rate-Limit-* headers sent back by the APIs, and failed requests are retried
+according to a shared RetryPolicy.
+Every call is also recorded in METRICS, which summarizes latency percentiles,
+retries and throttling per endpoint into a run report.
+runRequest (and runRequestAsync) tie these together, the clients only send the calls.
+The queued Logger both scripts log with is defined here as well.
+Responses that rarely change can be kept in a ResponseCache on disk, so they are
+only requested again once they expire and then revalidated with their ETag.
+"""
+import time
+import random
+import threading
+import sys
+import os
+from os.path import expanduser
+from datetime import datetime
+# requests, asyncio, email.utils, json, hashlib and sqlite3 are imported where they are used to keep the scripts' start-up fast
+
+""" Logging """
+class Logger(object):
+    """
+    The logger class that will handle all outputs, may it be console or log file.
+    Messages are put on a queue and a background thread formats and writes them in batches,
+    so logging on the request path costs little more than a queue put.
+    Each script creates its own, named after the script (see prefix).
+    """
+    # Severities in increasing order. Messages below the logger's level are dropped before they are formatted.
+    LEVELS = {'normal': 0, 'warning': 1, 'error': 2, 'code-breaker': 3}
+    INDICATORS = {'normal': '[N]', 'warning': '[W]', 'error': '[X]', 'code-breaker': '[!]'}
+    # Most messages the writer thread takes off the queue for one write
+    BATCH_SIZE = 512
+
+    def __init__(self, prefix, verbose=False, level='normal'):
+        """
+        Parameters
+        ----------
+            - prefix : str
+                Start of the log file name, e.g. 'shipstation' for shipstation_<time>.log
+            - verbose : bool
+                Show the messages in the terminal as well
+            - level : str
+                Least severity that is logged, one of LEVELS
+        """
+        self.terminal = sys.stdout
+        self.logFile = None
+        self.lock = threading.Lock()
+        self.verbose = verbose
+        self.level = Logger.LEVELS[level]
+        self.queue = None
+        self.writer = None
+        self.prefix = prefix
+
+    @property
+    def log(self):
+        """ The log file. It is only created once something is logged, so importing the module stays free of side effects. """
+        if self.logFile is None:
+            with self.lock:
+                if self.logFile is None:
+                    logFile = open(self.getLogPath(), "a")
+                    # Write the header row
+                    logFile.write(' Ind. |LineNo.| Time stamp  : Message')
+                    logFile.write('\n=====================================\n')
+                    self.logFile = logFile
+        return self.logFile
+
+    def getLogPath(self):
+        """
+        Function that will determine the default log file path based on the operating system being used.
+        Will also create appropriate directories they aren't present.
+
+        Returns
+        -------
+            - logFile : fileIO
+                File IO for the whole script to log to.
+        """
+        # Define the file name for logging
+        temp = datetime.now().strftime('%Y_%m_%d-%H-%M-%S')
+        logFileName = self.prefix + "_" + temp + ".log"
+
+        # If the platform is windows, set the log file path to the current user's Downloads/log folder
+        if sys.platform == 'win32' or sys.platform == 'win64': # Windows
+            logFilePath = os.path.expandvars(r'%USERPROFILE%')
+            logFilePath = os.path.join(logFilePath, 'Downloads')
+            logFilePath = os.path.join(logFilePath, 'log')
+            if os.path.exists(logFilePath):
+                return os.path.join(logFilePath, logFileName)
+            else:   # Create the log directory
+                os.mkdir(logFilePath)
+                return os.path.join(logFilePath, logFileName)
+
+        # If Linux, set the download path to the $HOME/downloads folder
+        elif sys.platform == 'linux' or sys.platform == 'linux2': # Linux
+            logFilePath = expanduser('~')
+            logFilePath = os.path.join(logFilePath, 'log')
+            if os.path.exists(logFilePath):
+                return os.path.join(logFilePath, logFileName)
+            else:   # Create the log directory
+                os.mkdir(logFilePath)
+                return os.path.join(logFilePath, logFileName)
+
+    def enqueue(self, item):
+        """
+        Function that hands a message to the writer thread, starting the thread with the first message.
+
+        Parameters
+        ----------
+            - item : tuple
+                (severity, message, lineNumber, time, data, verbose), severity is None for raw writes
+        """
+        if self.writer is None:
+            with self.lock:
+                if self.writer is None:
+                    import queue
+                    import atexit
+                    self.queue = queue.Queue()
+                    writer = threading.Thread(target=self.writeQueued, name='logger', daemon=True)
+                    writer.start()
+                    # Whatever is still queued when the script exits is written out
+                    atexit.register(self.close)
+                    self.writer = writer
+        self.queue.put(item)
+
+    def writeQueued(self):
+        """
+        Function that runs on the writer thread. Takes the queued messages in batches, formats them
+        and writes every batch with a single write and flush per output.
+        """
+        import queue
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < Logger.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            logLines = []
+            terminalLines = []
+            try:
+                for item in batch:
+                    if item is None:
+                        stop = True
+                        continue
+                    severity, message, lineNumber, timestamp, data, verbose = item
+                    if severity is None:
+                        logLines.append(message)
+                        if verbose:
+                            terminalLines.append(message)
+                    else:
+                        logLines.append(self.formatMessage(severity, message, lineNumber, timestamp, data) + '\n')
+                        if verbose:
+                            terminalLines.append(message + '\n')
+                if logLines:
+                    self.log.write(''.join(logLines))
+                    self.log.flush()
+                if terminalLines:
+                    self.terminal.write(''.join(terminalLines))
+                    self.terminal.flush()
+            finally:
+                for item in batch:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def formatMessage(self, severity, message, lineNumber, timestamp, data):
+        """
+        Function that formats a log file line, done on the writer thread.
+
+        Parameters
+        ----------
+            - severity : str
+            - message : str
+            - lineNumber : int
+            - timestamp : float
+                time.time() of the writeLog call
+            - data : dict
+                See writeLog
+        Returns
+        -------
+            - line : str
+                The formatted line, without the line break
+        """
+        timestamp = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f")[:-3]
+        toWrite = ' ' + Logger.INDICATORS[severity] + '  |  ' + str(lineNumber) + '  | ' + timestamp + ': ' + message
+        if severity == 'code-breaker' and data:
+            if data.get('code') == 2 and 'response' in data: # Response recieved but unsuccessful
+                toWrite = toWrite + '\n[ErrorDetailsStart]\n' + str(data['response']) + '\n[ErrorDetailsEnd]'
+            elif data.get('code') == 3 and 'error' in data: # YAML loading error
+                toWrite = toWrite + '\n[ErrorDetailsStart]\n' + str(data['error']) + '\n[ErrorDetailsEnd]'
+        return toWrite
+
+    def write(self, message):
+        self.enqueue((None, message, None, None, None, self.verbose))
+    
+    def writeLog(self, message, lineNumber=None, severity='normal', data=None, stackDepth=1):
+        """
+        Function that writes out to the log file and console based on verbose.
+        The function will change behavior slightly based on severity of the message.
+        The message is only queued here, formatting and writing happen on the writer thread.
+
+        Parameters
+        ----------
+            - message : str
+                Message to write
+            - lineNumber : int
+                Line the message is logged from. Taken from the caller's frame if not given,
+                and only after the message passed the level filter.
+            - severity : str
+                Defines what the message is related to. Is the message:
+                    - [N] : A 'normal' notification
+                    - [W] : A 'warning'
+                    - [E] : An 'error'
+                    - [!] : A 'code-breaker error' (errors that are followed by the script exitting)
+            - data : dict
+                A dictionary that will contain additional information when a code-breaker error occurs
+                Attributes:
+                    - code : error code
+                        1 : Generic error, only print the message.
+                        2 : An API call was not successful. Response object attached.
+                        3 : YAML loading error. Error object attached
+                    - response : str
+                        JSON-like str - the response recieved from the request in conern at the point of error.
+                    - error : str
+                        String produced by exception if an exception occured
+            - stackDepth : int
+                Frames above writeLog the line number is taken from, for helpers that log on behalf of their caller
+        """
+        if Logger.LEVELS[severity] < self.level:
+            return
+        if lineNumber is None:
+            try:
+                lineNumber = sys._getframe(stackDepth).f_lineno
+            except ValueError:
+                lineNumber = sys._getframe(1).f_lineno
+        self.enqueue((severity, message, lineNumber, time.time(), data, self.verbose))
+
+    def getCurrentTimestamp(self):
+        """
+        Simple function that calculates the current time stamp and simply formats it as a string and returns.
+        Mainly aimed for logging.
+
+        Returns
+        -------
+            - timestamp : str
+                A formatted string of current time
+        """
+        return datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+    def exceptionLogger(self, exctype, value, traceBack):
+        """
+        A simple printing function that will take place of the sys.excepthook function and print the results to the log instead of the console.
+
+        Parameters
+        ----------
+            - exctype : object
+                Exception type and details
+            - Value : str
+                The error passed while the exception was raised
+            - traceBack : traceback object
+                Contains information about the stack trace.
+        """
+        import traceback
+        self.write('Exception Occured! Details follow below.\n')
+        self.write('Type:{}\n'.format(exctype))
+        self.write('Value:{}\n'.format(value))
+        self.write('Traceback:\n')
+        for i in traceback.format_list(traceback.extract_tb(traceBack)):
+            self.write(i)
+
+    def flush(self):
+        # This flush method is needed for python 3 compatibility.
+        # sys.stdout is replaced by the logger, so a flush waits until everything queued so far is written.
+        if self.writer is not None and self.writer.is_alive() and threading.current_thread() is not self.writer:
+            self.queue.join()
+
+    def close(self):
+        """ Writes out everything still queued and stops the writer thread. Registered to run at exit. """
+        if self.writer is not None and self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+# Session defaults
+POOL_SIZE = 10
+KEEP_ALIVE = True
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def createSession(poolSize=POOL_SIZE, keepAlive=KEEP_ALIVE):
+    """
+    Function that creates a pooled requests session.
+
+    Parameters
+    ----------
+        - poolSize : int
+            Maximum number of connections kept open per host
+        - keepAlive : bool
+            If False, every request asks the server to close the connection after the response
+    Returns
+    -------
+        - session : requests.Session
+            A session with connection pools mounted for http and https
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    # Retries are handled by the clients themselves
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keepAlive:
+        session.headers['Connection'] = 'close'
+    return session
+
+def getSession():
+    """
+    Function that returns the session shared by all clients of this process.
+    The session is created the first time it is needed.
+
+    Returns
+    -------
+        - session : requests.Session
+            The shared pooled session
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = createSession()
+        return _SESSION
+
+def setSession(session):
+    """
+    Function that replaces the shared session, e.g. to inject a fake session in tests.
+    Passing None drops the current session so a fresh default one is created on next use.
+
+    Parameters
+    ----------
+        - session : requests.Session
+            The session every client created afterwards will use by default
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        _SESSION = session
+
+def configureSession(poolSize=POOL_SIZE, keepAlive=KEEP_ALIVE):
+    """
+    Function that replaces the shared session with a new one built from the given pool settings.
+
+    Parameters
+    ----------
+        - poolSize : int
+            Maximum number of connections kept open per host
+        - keepAlive : bool
+            Keep connections open between requests
+    Returns
+    -------
+        - session : requests.Session
+            The new shared session
+    """
+    session = createSession(poolSize=poolSize, keepAlive=keepAlive)
+    setSession(session)
+    return session
+
+""" Rate limiting """
+class RateLimiter(object):
+    """
+    Token bucket shared by every thread that calls the same API account.
+
+    The bucket starts with `limit` tokens. Each request takes a token and each response
+    re-syncs the bucket with the X-Rate-Limit-Limit/Remaining/Reset headers, so that
+    requests go out as long as the server has budget left and callers sleep exactly
+    until the window resets once it is used up. Without headers the bucket refills
+    continuously at limit/window.
+    """
+    def __init__(self, limit=None, window=60.0):
+        """
+        Parameters
+        ----------
+            - limit : int
+                Requests allowed per window. None means unknown until the first response headers arrive.
+            - window : float
+                Length of the rate limit window in seconds
+        """
+        self.limit = limit
+        self.window = float(window)
+        self.tokens = float(limit) if limit else None
+        self.resetAt = None
+        # Set by a 429 while the limit is unknown: no request goes out before then, but no limit is assumed either
+        self.blockedUntil = None
+        self.inFlight = 0
+        self.throttledTime = 0.0
+        self.updatedAt = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if not self.limit:
+            pass
+        # A known server window has passed, the whole budget is available again
+        elif self.resetAt is not None:
+            if now >= self.resetAt:
+                self.tokens = float(self.limit - self.inFlight)
+                while self.resetAt <= now:
+                    self.resetAt += self.window
+        else:
+            self.tokens = min(float(self.limit), self.tokens + (now - self.updatedAt) * self.limit / self.window)
+        self.updatedAt = now
+
+    def reserve(self):
+        """
+        Function that takes a token if one is available.
+
+        Returns
+        -------
+            - wait : float
+                0 if a token was taken and the request can be sent right away,
+                otherwise the seconds to wait before trying again
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.blockedUntil is not None:
+                if now < self.blockedUntil:
+                    return max(self.blockedUntil - now, 0.001)
+                self.blockedUntil = None
+            self._refill(now)
+            if self.tokens is None or self.tokens >= 1:
+                if self.tokens is not None:
+                    self.tokens -= 1
+                self.inFlight += 1
+                return 0.0
+            if self.resetAt is not None:
+                return max(self.resetAt - now, 0.001)
+            return max((1 - self.tokens) * self.window / self.limit, 0.001)
+
+    def acquire(self):
+        """
+        Function that blocks until a request may be sent.
+
+        Returns
+        -------
+            - waited : float
+                Seconds spent waiting for a token
+        """
+        waited = 0.0
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            with self.lock:
+                self.throttledTime += waited
+        return waited
+
+    async def acquireAsync(self):
+        """
+        asyncio counterpart of acquire. Waits without blocking the event loop.
+
+        Returns
+        -------
+            - waited : float
+                Seconds spent waiting for a token
+        """
+        import asyncio
+        waited = 0.0
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited:
+            with self.lock:
+                self.throttledTime += waited
+        return waited
+
+    def update(self, headers=None):
+        """
+        Function that releases the request's slot and re-syncs the bucket with the rate limit headers of its response.
+
+        Parameters
+        ----------
+            - headers : dict
+                Response headers. None if the request failed before a response arrived.
+        """
+        limit, remaining, reset = parseRateLimitHeaders(headers)
+        with self.lock:
+            now = time.monotonic()
+            self.inFlight = max(self.inFlight - 1, 0)
+            if limit:
+                self.limit = limit
+                if self.tokens is None:
+                    self.tokens = float(limit)
+            if reset is not None:
+                self.resetAt = now + reset
+            if remaining is not None and self.tokens is not None:
+                # Requests still in flight are not counted by the server yet
+                self.tokens = float(remaining - self.inFlight)
+            self._refill(now)
+
+    def penalize(self, headers=None):
+        """
+        Function that empties the bucket after the server answered with 429 Too Many Requests.
+        The bucket stays empty until Retry-After/X-Rate-Limit-Reset, or a whole window if neither is sent.
+        If the limit is still unknown the callers are only held back until then, without assuming a limit.
+
+        Parameters
+        ----------
+            - headers : dict
+                Headers of the 429 response
+        """
+        limit, remaining, reset = parseRateLimitHeaders(headers)
+        retryAfter = parseRetryAfter(headers.get('Retry-After') if headers else None)
+        wait = retryAfter if retryAfter is not None else reset
+        with self.lock:
+            now = time.monotonic()
+            self.inFlight = max(self.inFlight - 1, 0)
+            if limit:
+                self.limit = limit
+            if not self.limit:
+                self.blockedUntil = now + (wait if wait is not None else self.window)
+                return
+            self.tokens = float(-self.inFlight)
+            self.resetAt = now + (wait if wait is not None else self.window)
+            self.updatedAt = now
+
+""" Retries """
+# What to do for each status code:
+#   - retry    : try again after an exponential backoff, only if the call is idempotent
+#   - throttle : the server did not process the request, try again whatever the method is.
+#                The rate limiter holds the caller back until the window resets.
+RETRY_RULES = {408: 'retry', 429: 'throttle', 500: 'retry', 502: 'retry', 503: 'retry', 504: 'retry'}
+IDEMPOTENT_METHODS = ('get', 'head', 'options', 'put', 'delete')
+
+class RetryPolicy(object):
+    """
+    Decides if a failed api call is sent again and how long to wait before it.
+    Delays grow exponentially with full jitter, Retry-After is honoured when sent,
+    and no call is retried past its attempt limit or total deadline.
+    """
+    def __init__(self, maxAttempts=5, baseDelay=0.5, maxDelay=30.0, deadline=120.0, rules=None):
+        """
+        Parameters
+        ----------
+            - maxAttempts : int
+                Number of times a call is sent at most, the first attempt included
+            - baseDelay : float
+                Upper bound in seconds of the delay before the first retry. Doubles with every retry.
+            - maxDelay : float
+                Upper bound in seconds of any backoff delay
+            - deadline : float
+                Seconds after which a call is not retried anymore, counted from its first attempt
+            - rules : dict
+                Status code to rule ('retry' or 'throttle'). Defaults to RETRY_RULES.
+                Network errors always follow the 'retry' rule.
+        """
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.deadline = deadline
+        self.rules = RETRY_RULES if rules is None else rules
+
+    def begin(self, typ, idempotent=None):
+        """
+        Function that starts tracking the attempts of a single call.
+
+        Parameters
+        ----------
+            - typ : str
+                Method of the call (get, put, post, delete)
+            - idempotent : bool
+                Whether sending the call twice is safe. Decided from the method if not given.
+        Returns
+        -------
+            - retryState : RetryState
+        """
+        if idempotent is None:
+            idempotent = typ.lower() in IDEMPOTENT_METHODS
+        return RetryState(self, idempotent)
+
+    def getBackoff(self, attempt):
+        """
+        Function that picks the delay before the given retry, with full jitter.
+
+        Parameters
+        ----------
+            - attempt : int
+                Number of attempts made so far
+        Returns
+        -------
+            - delay : float
+                Seconds to wait
+        """
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1)))
+
+class RetryState(object):
+    """ Attempts of a single call, see RetryPolicy.begin """
+    def __init__(self, policy, idempotent):
+        self.policy = policy
+        self.idempotent = idempotent
+        self.attempts = 0
+        self.retries = 0
+        self.started = time.monotonic()
+
+    def nextDelay(self, status=None, headers=None, error=None):
+        """
+        Function that is called after a failed attempt.
+
+        Parameters
+        ----------
+            - status : int
+                Status code of the response
+            - headers : dict
+                Headers of the response
+            - error : Exception
+                The network error if no response was received, or any other reason
+                the attempt failed that has no status code. Follows the 'retry' rule.
+        Returns
+        -------
+            - delay : float
+                Seconds to wait before sending the call again, None if it should not be retried
+        """
+        self.attempts += 1
+        rule = 'retry' if error is not None else self.policy.rules.get(status)
+        if rule is None or (rule == 'retry' and not self.idempotent):
+            return None
+        if self.attempts >= self.policy.maxAttempts:
+            return None
+
+        retryAfter = parseRetryAfter(headers.get('Retry-After')) if headers else None
+        if rule == 'throttle':
+            delay = 0.0
+        elif retryAfter is not None:
+            delay = retryAfter
+        else:
+            delay = self.policy.getBackoff(self.attempts)
+        if time.monotonic() - self.started + delay > self.policy.deadline:
+            return None
+        self.retries += 1
+        return delay
+
+RETRY_POLICY = RetryPolicy()
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+def getRateLimiter(key, limit=None, window=60.0):
+    """
+    Function that returns the rate limiter shared by everything calling the same account.
+
+    Parameters
+    ----------
+        - key : str
+            Identifies the API account the budget belongs to
+        - limit : int
+            Requests allowed per window, used when the limiter is created
+        - window : float
+            Length of the window in seconds, used when the limiter is created
+    Returns
+    -------
+        - rateLimiter : RateLimiter
+    """
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            _RATE_LIMITERS[key] = RateLimiter(limit=limit, window=window)
+        return _RATE_LIMITERS[key]
+
+def parseRateLimitHeaders(headers):
+    """
+    Function that reads the rate limit headers of a response.
+    Understands both ShipStation's X-Rate-Limit-Reset (seconds) and SureDone's X-Rate-Limit-Time-Reset-Ms.
+
+    Parameters
+    ----------
+        - headers : dict
+            Response headers (case-insensitive dict from requests)
+    Returns
+    -------
+        - limit : int
+            Requests allowed per window, None if not sent
+        - remaining : int
+            Requests left in the current window, None if not sent
+        - reset : float
+            Seconds until the window resets, None if not sent
+    """
+    if not headers:
+        return None, None, None
+    limit = toNumber(headers.get('X-Rate-Limit-Limit'), int)
+    remaining = toNumber(headers.get('X-Rate-Limit-Remaining'), int)
+    reset = toNumber(headers.get('X-Rate-Limit-Reset'), float)
+    if reset is None:
+        resetMs = toNumber(headers.get('X-Rate-Limit-Time-Reset-Ms'), float)
+        if resetMs is not None:
+            reset = resetMs / 1000
+    return limit, remaining, reset
+
+def parseRetryAfter(value):
+    """
+    Function that converts a Retry-After header (seconds or an HTTP date) to seconds.
+
+    Parameters
+    ----------
+        - value : str
+            Value of the Retry-After header
+    Returns
+    -------
+        - seconds : float
+            Seconds to wait, None if the header was not sent or not understood
+    """
+    if value is None:
+        return None
+    seconds = toNumber(value, float)
+    if seconds is not None:
+        return max(seconds, 0.0)
+    from email.utils import parsedate_to_datetime
+    try:
+        retryAt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retryAt.timestamp() - time.time(), 0.0)
+
+def toNumber(value, cast):
+    """ Casts a header value to a number, None if it is missing or malformed """
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+class LatencyHistogram(object):
+    """
+    Latencies in milliseconds, kept as counts per logarithmic bucket (each bucket 10% wider than the last)
+    so that memory stays the same however many requests a process makes. Percentiles are accurate to a bucket.
+    """
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, milliseconds):
+        import math
+        bucket = int(math.log(milliseconds, LatencyHistogram.GROWTH)) + 1 if milliseconds > 1 else 0
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def getPercentile(self, percent):
+        """
+        Function that returns the latency below which the given percent of the samples fall.
+
+        Parameters
+        ----------
+            - percent : float
+                Between 0 and 100
+        Returns
+        -------
+            - milliseconds : float
+                Upper bound of the bucket the percentile falls in, 0 without samples
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(percent / 100.0 * self.count + 0.4999)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(LatencyHistogram.GROWTH ** bucket, self.max)
+        return self.max
+
+class RequestMetrics(object):
+    """
+    Collects one sample per api call: endpoint, status, bytes, retries, time spent waiting for
+    the rate limiter and latency. Thread safe, shared by every client of the process (see METRICS).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Drops all samples and restarts the clock the requests per minute are measured against """
+        with self.lock:
+            self.endpoints = {}
+            self.started = time.time()
+            self.startedMonotonic = time.monotonic()
+
+    def record(self, endpoint, status, latency, size=0, retries=0, queueWait=0.0):
+        """
+        Function that adds the sample of one api call.
+
+        Parameters
+        ----------
+            - endpoint : str
+                Name of the endpoint, see getEndpointName
+            - status : int
+                Status code of the final response, None if no response was received
+            - latency : float
+                Seconds the call took, not counting queueWait
+            - size : int
+                Bytes received
+            - retries : int
+                Times the call was sent again
+            - queueWait : float
+                Seconds the call waited for the rate limiter
+        """
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {'requests': 0, 'errors': 0, 'statuses': {}, 'bytes': 0, 'retries': 0, 'queueWait': 0.0, 'latency': LatencyHistogram()}
+            stats['requests'] += 1
+            if status is None or status >= 400:
+                stats['errors'] += 1
+            key = str(status)
+            stats['statuses'][key] = stats['statuses'].get(key, 0) + 1
+            stats['bytes'] += size
+            stats['retries'] += retries
+            stats['queueWait'] += queueWait
+            stats['latency'].add(latency * 1000)
+
+    def getReport(self):
+        """
+        Function that summarizes the samples.
+
+        Returns
+        -------
+            - report : dict
+                Machine readable run report:
+                    - started : unix time the samples start from
+                    - duration : seconds since then
+                    - requests : total api calls
+                    - requestsPerMinute : api calls per minute over the duration
+                    - throttled : seconds calls waited for the rate limiters
+                    - endpoints : per endpoint requests, errors, statuses, bytes, retries, queueWait
+                      and latency in milliseconds (p50, p95, p99, max, mean)
+        """
+        with self.lock:
+            duration = time.monotonic() - self.startedMonotonic
+            endpoints = {}
+            for endpoint, stats in self.endpoints.items():
+                histogram = stats['latency']
+                endpoints[endpoint] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'statuses': dict(stats['statuses']),
+                    'bytes': stats['bytes'],
+                    'retries': stats['retries'],
+                    'queueWait': round(stats['queueWait'], 3),
+                    'latency': {
+                        'p50': round(histogram.getPercentile(50), 1),
+                        'p95': round(histogram.getPercentile(95), 1),
+                        'p99': round(histogram.getPercentile(99), 1),
+                        'max': round(histogram.max, 1),
+                        'mean': round(histogram.total / histogram.count, 1),
+                    },
+                }
+            requests = sum(stats['requests'] for stats in self.endpoints.values())
+            return {
+                'started': self.started,
+                'duration': round(duration, 3),
+                'requests': requests,
+                'requestsPerMinute': round(requests / duration * 60, 1) if duration > 0 else 0.0,
+                'throttled': round(sum(stats['queueWait'] for stats in self.endpoints.values()), 3),
+                'endpoints': endpoints,
+            }
+
+    def writeReport(self, path):
+        """
+        Function that writes the report as json.
+
+        Parameters
+        ----------
+            - path : str
+                Path of the report file
+        Returns
+        -------
+            - report : dict
+                The report that was written
+        """
+        import json
+        report = self.getReport()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=3)
+        return report
+
+# Samples of every api call the process makes
+METRICS = RequestMetrics()
+
+def getMetrics():
+    """
+    Function that returns the process-wide request metrics.
+
+    Returns
+    -------
+        - metrics : RequestMetrics
+    """
+    return METRICS
+
+def getEndpointName(typ, url):
+    """
+    Function that names the endpoint of a call for the metrics: the method and the path,
+    without host and query string and with numeric ids replaced by {id}.
+
+    Parameters
+    ----------
+        - typ : str
+            Type of the request (get, post...)
+        - url : str
+            Full url or path of the call
+    Returns
+    -------
+        - endpoint : str
+            For example 'GET /orders/{id}'
+    """
+    segments = ['{id}' if segment.isdigit() else segment for segment in getPath(url).split('/')]
+    return typ.upper() + ' ' + '/'.join(segments)
+
+def getPath(url):
+    """
+    Function that returns the path of a url, without host and query string.
+
+    Parameters
+    ----------
+        - url : str
+            Full url or path
+    Returns
+    -------
+        - path : str
+            For example '/carriers/listservices'
+    """
+    path = url.split('?', 1)[0]
+    if '://' in path:
+        path = '/' + path.split('://', 1)[1].partition('/')[2]
+    return path
+
+""" Requests """
+# Frames between Logger.writeLog and the code that called a client's apicall, see RequestAttempts.log
+REQUEST_LOG_DEPTH = 5
+
+class RequestAttempts(object):
+    """
+    The attempts of a single api call. Shared by the clients so that they only have to send the call:
+    the rate limiter is kept in sync with every response, the retry policy decides which failures are
+    sent again, and the call is recorded in METRICS once it ends. See runRequest and runRequestAsync.
+    """
+    def __init__(self, typ, url, rateLimiter, retryPolicy, idempotent=None, label=None, logger=None):
+        """
+        Parameters
+        ----------
+            - typ : str
+                Method of the call (get, put, post, delete)
+            - url : str
+                Full url of the call
+            - rateLimiter : RateLimiter
+                Limiter of the account
+            - retryPolicy : RetryPolicy
+                Decides which failed attempts are sent again
+            - idempotent : bool
+                Whether sending the call twice is safe. Decided from the method if not given.
+            - label : str
+                Name of the endpoint in the metrics if the url doesn't name it well, see getEndpointName
+            - logger : object
+                The script's logger, failed attempts are logged with its writeLog
+        """
+        self.typ = typ
+        self.url = url
+        self.rateLimiter = rateLimiter
+        self.retry = retryPolicy.begin(typ, idempotent)
+        self.endpoint = getEndpointName(typ, label or url)
+        self.logger = logger
+        self.started = time.monotonic()
+        self.queueWait = 0.0
+
+    def failed(self, error):
+        """
+        Function that is called when an attempt got no response.
+
+        Returns
+        -------
+            - delay : float
+                Seconds to wait before the next attempt, None if the call is given up
+        """
+        self.rateLimiter.update(None)
+        delay = self.retry.nextDelay(error=error)
+        self.log("HTTP Error {} {}: {}. Attempt {}.".format(self.typ, self.url, error, self.retry.attempts), 'error')
+        return delay
+
+    def answered(self, status, headers):
+        """
+        Function that is called with the response of an attempt.
+
+        Returns
+        -------
+            - delay : float
+                Seconds to wait before the next attempt, None if the response is the final one
+                (successful, or a failure that is not retried)
+        """
+        # Too many requests, the limiter holds every caller back until the window resets
+        if status == 429:
+            self.rateLimiter.penalize(headers)
+        else:
+            self.rateLimiter.update(headers)
+        if status < 400:
+            return None
+
+        # Statuses the retry policy knows to be temporary are tried again, anything else fails right away
+        delay = self.retry.nextDelay(status=status, headers=headers)
+        if delay is not None:
+            self.log("Status {} from {}, trying again. Attempt {}.".format(status, self.url, self.retry.attempts), 'warning')
+        return delay
+
+    def record(self, status, size):
+        """ Function that records the call in METRICS, with the status and size of its final response """
+        METRICS.record(self.endpoint, status, time.monotonic() - self.started - self.queueWait,
+                       size=size, retries=self.retry.retries, queueWait=self.queueWait)
+
+    def log(self, message, severity):
+        # The line logged is the one that made the api call:
+        # log <- failed/answered <- runRequest <- the client's apicall <- its caller
+        if self.logger is not None:
+            self.logger.writeLog(message, severity=severity, stackDepth=REQUEST_LOG_DEPTH)
+
+def runRequest(send, typ, url, rateLimiter, retryPolicy, idempotent=None, label=None, logger=None, errors=None, getSize=None):
+    """
+    Function that makes an api call with the rate limiting, retries and metrics every client shares.
+
+    Parameters
+    ----------
+        - send : callable
+            Sends the call once and returns its requests.Response
+        - typ, url, rateLimiter, retryPolicy, idempotent, label, logger
+            See RequestAttempts
+        - errors : tuple
+            Exceptions of send that mean no response was received. Those of requests if not given.
+        - getSize : callable
+            Returns the bytes received for a response, the length of its content if not given
+    Returns
+    -------
+        - response : requests.Response
+            The final response, successful or not. None if no response was received.
+    """
+    if errors is None:
+        import requests
+        errors = requests.exceptions.RequestException
+    attempts = RequestAttempts(typ, url, rateLimiter, retryPolicy, idempotent=idempotent, label=label, logger=logger)
+    response = None
+    # Every call is recorded in the run metrics, however it ends
+    try:
+        while True:
+            # Wait for the rate limiter to hand out a slot before sending
+            attempts.queueWait += rateLimiter.acquire()
+            response = None
+            try:
+                response = send()
+            except errors as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    return None
+                time.sleep(delay)
+                continue
+            delay = attempts.answered(response.status_code, response.headers)
+            if delay is None:
+                return response
+            response.close()
+            time.sleep(delay)
+    finally:
+        size = 0
+        if response is not None:
+            size = getSize(response) if getSize is not None else len(response.content)
+        attempts.record(response.status_code if response is not None else None, size)
+
+async def runRequestAsync(send, typ, url, rateLimiter, retryPolicy, idempotent=None, label=None, logger=None, errors=()):
+    """
+    asyncio counterpart of runRequest. Waits without blocking the event loop.
+
+    Parameters
+    ----------
+        - send : coroutine function
+            Sends the call once and returns an object with the status_code, headers and content of the response
+        - typ, url, rateLimiter, retryPolicy, idempotent, label, logger
+            See RequestAttempts
+        - errors : tuple
+            Exceptions of send that mean no response was received
+    Returns
+    -------
+        - response : object
+            What send returned for the final response. None if no response was received.
+    """
+    import asyncio
+    attempts = RequestAttempts(typ, url, rateLimiter, retryPolicy, idempotent=idempotent, label=label, logger=logger)
+    response = None
+    try:
+        while True:
+            attempts.queueWait += await rateLimiter.acquireAsync()
+            response = None
+            try:
+                response = await send()
+            except errors as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+                continue
+            delay = attempts.answered(response.status_code, response.headers)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+    finally:
+        attempts.record(response.status_code if response is not None else None, len(response.content) if response is not None else 0)
+
+# Response cache defaults
+CACHE_MAX_SIZE = 32 * 1024 * 1024
+CACHE_TIMEOUT = 30
+
+class ResponseCache(object):
+    """
+    Persistent cache of api responses, kept in a sqlite file so it outlives the process and is shared
+    by all processes using the same file.
+    Every entry is served for its ttl, then revalidated with the ETag/Last-Modified the server sent.
+    The file is bounded to maxSize bytes of responses, the least recently used ones are evicted first.
+    The cache never fails a call: if the file can't be used, lookups miss and responses aren't stored.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            etag TEXT,
+            lastModified TEXT,
+            expires REAL NOT NULL,
+            used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_used ON responses (used);
+        CREATE INDEX IF NOT EXISTS idx_responses_path ON responses (path);
+    """
+
+    def __init__(self, path, maxSize=CACHE_MAX_SIZE):
+        """
+        Constructor function. The file is only opened once the cache is used.
+
+        Parameters
+        ----------
+            - path : str
+                Path of the sqlite file
+            - maxSize : int
+                Most bytes of responses kept
+        """
+        self.path = path
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        """ Opens the file on first use, must be called with the lock held """
+        if self.connection is None:
+            import sqlite3
+            connection = sqlite3.connect(self.path, timeout=CACHE_TIMEOUT, check_same_thread=False, isolation_level=None)
+            connection.executescript(self.SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    @staticmethod
+    def getKey(account, url, params=None):
+        """
+        Function that returns the key of a response. The account is hashed into it, so responses of different
+        accounts are kept apart without the credentials being stored.
+
+        Parameters
+        ----------
+            - account : str
+                Identifies the account the response belongs to, for example its authentication string
+            - url : str
+                Full url of the call
+            - params : dict
+                Query string of the call
+        Returns
+        -------
+            - key : str
+        """
+        import json
+        import hashlib
+        return hashlib.sha256(json.dumps([account, url, sorted((params or {}).items())], default=str).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Function that looks up a response.
+
+        Parameters
+        ----------
+            - key : str
+                See getKey
+        Returns
+        -------
+            - entry : dict
+                body (bytes), etag, lastModified and fresh (False once the ttl ran out), None if the response is not cached
+        """
+        import sqlite3
+        now = time.time()
+        try:
+            with self.lock:
+                connection = self.connect()
+                row = connection.execute("SELECT body, etag, lastModified, expires FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            return None
+        return {'body': bytes(row[0]), 'etag': row[1], 'lastModified': row[2], 'fresh': row[3] > now}
+
+    def put(self, key, url, body, ttl, etag=None, lastModified=None):
+        """
+        Function that stores a response and evicts the least recently used ones past maxSize.
+
+        Parameters
+        ----------
+            - key : str
+                See getKey
+            - url : str
+                Url of the call, its path is what invalidate matches
+            - body : bytes
+                The response body
+            - ttl : float
+                Seconds the response is served without asking the server
+            - etag : str
+                ETag header of the response
+            - lastModified : str
+                Last-Modified header of the response
+        """
+        import sqlite3
+        if len(body) > self.maxSize:
+            return
+        now = time.time()
+        try:
+            with self.lock:
+                connection = self.connect()
+                connection.execute("INSERT OR REPLACE INTO responses (key, path, body, size, etag, lastModified, expires, used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (key, getPath(url), sqlite3.Binary(body), len(body), etag, lastModified, now + ttl, now))
+                self.evict(connection)
+        except sqlite3.Error:
+            pass
+
+    def refresh(self, key, ttl):
+        """ Function that serves a revalidated response (304 Not Modified) for another ttl seconds """
+        import sqlite3
+        now = time.time()
+        try:
+            with self.lock:
+                self.connect().execute("UPDATE responses SET expires = ?, used = ? WHERE key = ?", (now + ttl, now, key))
+        except sqlite3.Error:
+            pass
+
+    def evict(self, connection):
+        """ Deletes the least recently used responses until the rest fit in maxSize, must be called with the lock held """
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.maxSize:
+            return
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.maxSize:
+                break
+
+    def invalidate(self, path=None):
+        """
+        Function that drops cached responses, so they are requested again on next use.
+
+        Parameters
+        ----------
+            - path : str
+                Endpoint to drop, with everything below it ('/carriers' also drops '/carriers/listservices').
+                Everything is dropped if not given.
+        Returns
+        -------
+            - count : int
+                Number of responses dropped
+        """
+        with self.lock:
+            connection = self.connect()
+            if path is None:
+                return connection.execute("DELETE FROM responses").rowcount
+            path = '/' + path.strip('/')
+            return connection.execute("DELETE FROM responses WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(path) + 1, path + '/')).rowcount
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+_RESPONSE_CACHES = {}
+_RESPONSE_CACHES_LOCK = threading.Lock()
+
+def getResponseCache(path, maxSize=CACHE_MAX_SIZE):
+    """
+    Function that returns the response cache shared by everything in the process using the same file.
+
+    Parameters
+    ----------
+        - path : str
+            Path of the sqlite file
+        - maxSize : int
+            Most bytes of responses kept, used when the cache is created
+    Returns
+    -------
+        - cache : ResponseCache
+    """
+    with _RESPONSE_CACHES_LOCK:
+        if path not in _RESPONSE_CACHES:
+            _RESPONSE_CACHES[path] = ResponseCache(path, maxSize=maxSize)
+        return _RESPONSE_CACHES[path]
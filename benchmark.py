@@ -0,0 +1,577 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of the ShipStation and SureDone clients
+
+@owner: Patrick Mahoney
+@version: 0.0.1
+
+Starts a local stand-in for the APIs and runs the clients against it, so that
+performance can be measured without touching the production accounts.
+The mock server serves:
+    - GET /orders : paginated orders with X-Rate-Limit-* headers, 429s once the
+      limit is used up (or at random) and injected latency.
+      The number of orders of the account is taken from its api key, 'bench-<orders>'
+    - GET /orders/<id> : a single order
+    - GET /v1/bulk/exports : starts a SureDone export of 'rows' rows
+    - GET /v1/bulk/exports/<file> : not ready for the first polls, then the download url
+    - GET /files/<file> : the exported csv, supports byte ranges
+
+The clients' real hosts are redirected to the mock server by the session's adapter,
+so the scenarios run the same code paths as production:
+    - listOrders : shipStation.listOrders
+    - main : shipStation.main, writing the json output
+    - download : a SureDone export through reference.downloadExportedFile
+
+Every scenario runs in its own process so its peak RSS can be measured.
+Results are compared with the saved baseline, and the script exits with 1 if
+any scenario got slower or bigger than the tolerance allows.
+"""
+import sys
+import os
+import getopt
+import json
+import time
+import base64
+import random
+import threading
+import subprocess
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCENARIOS = ('listOrders', 'main', 'download')
+SIZES = (1000, 10000, 100000)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# A scenario regresses when its throughput drops, or its peak RSS grows, by more than this fraction
+TOLERANCE = 0.2
+
+HELP_MESSAGE = """
+Usage:
+    python benchmark.py [options]
+
+    -h, --help              Print this message and exit
+    -s, --sizes             Comma separated numbers of orders/rows to run with. Default: 1000,10000,100000
+    -c, --scenarios         Comma separated scenarios to run ({}). Default: all
+    -b, --baseline          Path of the baseline file. Default: benchmark_baseline.json next to this script
+    -u, --update-baseline   Save the results as the new baseline
+    -t, --tolerance         Allowed regression as a fraction. Default: {}
+    --latency               Milliseconds the mock server waits before every response. Default: 0
+    --throttle-rate         Fraction of /orders requests answered with a 429. Default: 0
+    --rate-limit            Requests per minute the mock server allows per account. Default: 6000
+    --export-polls          Polls a SureDone export takes to become ready. Default: 0
+""".format(', '.join(SCENARIOS), TOLERANCE)
+
+def main(argv):
+    sizes, scenarios, baselinePath, updateBaseline, tolerance, serverOptions = parseArgs(argv)
+
+    server = startMockServer(**serverOptions)
+    baseURL = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    print("Mock server listening on {}".format(baseURL))
+
+    results = []
+    try:
+        for scenario in scenarios:
+            for size in sizes:
+                result = runInProcess(scenario, size, baseURL)
+                results.append(result)
+                printResult(result)
+    finally:
+        server.shutdown()
+
+    baseline = loadBaseline(baselinePath)
+    regressions = compareWithBaseline(results, baseline, tolerance)
+    for message in regressions:
+        print("REGRESSION: " + message)
+
+    if updateBaseline:
+        for result in results:
+            baseline[resultKey(result)] = result
+        with open(baselinePath, 'w') as f:
+            json.dump(baseline, f, indent=3, sort_keys=True)
+        print("Baseline saved to {}".format(baselinePath))
+    elif not baseline:
+        print("No baseline at {}, run with --update-baseline to save one.".format(baselinePath))
+
+    return 1 if regressions else 0
+
+def parseArgs(argv):
+    """
+    Function that parses the arguments sent from the command line.
+
+    Parameters
+    ----------
+        - argv : list
+            Arguments sent through the command line
+    Returns
+    -------
+        - sizes : list
+        - scenarios : list
+        - baselinePath : str
+        - updateBaseline : bool
+        - tolerance : float
+        - serverOptions : dict
+            Keyword arguments for startMockServer
+    """
+    options = "hs:c:b:ut:"
+    long_options = ['help', 'sizes=', 'scenarios=', 'baseline=', 'update-baseline', 'tolerance=', 'latency=', 'throttle-rate=', 'rate-limit=', 'export-polls=']
+
+    sizes = list(SIZES)
+    scenarios = list(SCENARIOS)
+    baselinePath = BASELINE_PATH
+    updateBaseline = False
+    tolerance = TOLERANCE
+    serverOptions = {}
+
+    try:
+        opts, args = getopt.getopt(argv, options, long_options)
+        for option, value in opts:
+            if option in ('-h', '--help'):
+                print(HELP_MESSAGE)
+                sys.exit()
+            elif option in ('-s', '--sizes'):
+                sizes = [int(size) for size in value.split(',')]
+            elif option in ('-c', '--scenarios'):
+                scenarios = value.split(',')
+                for scenario in scenarios:
+                    if scenario not in SCENARIOS:
+                        raise ValueError("Unknown scenario " + scenario)
+            elif option in ('-b', '--baseline'):
+                baselinePath = value
+            elif option in ('-u', '--update-baseline'):
+                updateBaseline = True
+            elif option in ('-t', '--tolerance'):
+                tolerance = float(value)
+            elif option == '--latency':
+                serverOptions['latency'] = float(value) / 1000
+            elif option == '--throttle-rate':
+                serverOptions['throttleRate'] = float(value)
+            elif option == '--rate-limit':
+                serverOptions['rateLimit'] = int(value)
+            elif option == '--export-polls':
+                serverOptions['exportPolls'] = int(value)
+    except (getopt.GetoptError, ValueError) as e:
+        print("Error in arguments! {}".format(e))
+        print(HELP_MESSAGE)
+        sys.exit(2)
+
+    return sizes, scenarios, baselinePath, updateBaseline, tolerance, serverOptions
+
+class MockServer(ThreadingHTTPServer):
+    """ Local stand-in for the ShipStation and SureDone APIs, see the module docstring """
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, throttleRate=0.0, rateLimit=6000, exportPolls=0):
+        ThreadingHTTPServer.__init__(self, address, MockAPIHandler)
+        self.latency = latency
+        self.throttleRate = throttleRate
+        self.rateLimit = rateLimit
+        self.exportPolls = exportPolls
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+        # Requests of each account in the current rate limit window: {account: (windowStart, count)}
+        self.windows = {}
+        self.pages = {}
+        self.exports = {}
+        self.files = {}
+
+    def takeRateLimit(self, account):
+        """
+        Function that counts a request against the account's rate limit.
+
+        Returns
+        -------
+            - allowed : bool
+            - headers : dict
+                X-Rate-Limit-* headers for the response
+        """
+        with self.lock:
+            now = time.monotonic()
+            windowStart, count = self.windows.get(account, (now, 0))
+            if now - windowStart >= 60:
+                windowStart, count = now, 0
+            allowed = count < self.rateLimit and self.random.random() >= self.throttleRate
+            if allowed:
+                count += 1
+            self.windows[account] = (windowStart, count)
+        reset = max(1, int(round(60 - (now - windowStart))))
+        # Injected 429s only hold the client back for a second
+        if count < self.rateLimit and not allowed:
+            reset = 1
+        headers = {'X-Rate-Limit-Limit': str(self.rateLimit), 'X-Rate-Limit-Remaining': str(self.rateLimit - count), 'X-Rate-Limit-Reset': str(reset)}
+        return allowed, headers
+
+    def getPage(self, total, page, pageSize):
+        """ Function that returns an encoded page of orders, built once per page """
+        key = (total, page, pageSize)
+        body = self.pages.get(key)
+        if body is None:
+            first = (page - 1) * pageSize
+            orders = [makeOrder(orderId) for orderId in range(first + 1, min(first + pageSize, total) + 1)]
+            pages = max(1, (total + pageSize - 1) // pageSize)
+            body = json.dumps({'orders': orders, 'total': total, 'page': page, 'pages': pages}).encode('utf-8')
+            self.pages[key] = body
+        return body
+
+    def getFile(self, rows):
+        """ Function that returns the csv of an export of the given number of rows, built once per size """
+        body = self.files.get(rows)
+        if body is None:
+            body = makeExportFile(rows)
+            self.files[rows] = body
+        return body
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    """ Request handler of the MockServer """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Keep the benchmark's output readable
+        pass
+
+    def do_GET(self):
+        from urllib.parse import urlsplit, parse_qs
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        segments = [segment for segment in parts.path.split('/') if segment]
+
+        if segments[:1] == ['orders']:
+            self.handleOrders(segments, query)
+        elif segments[:3] == ['v1', 'bulk', 'exports']:
+            self.handleExports(segments, query)
+        elif segments[:1] == ['files'] and len(segments) == 2:
+            self.handleFile(segments[1])
+        else:
+            self.sendJSON(404, {'message': 'Not found'})
+
+    def handleOrders(self, segments, query):
+        account = self.headers.get('Authorization', '')
+        allowed, headers = self.server.takeRateLimit(account)
+        if not allowed:
+            self.sendJSON(429, {'message': 'Too Many Requests'}, headers)
+            return
+        total = getOrderCount(account)
+        if len(segments) == 2 and segments[1].isdigit() and 0 < int(segments[1]) <= total:
+            self.sendJSON(200, makeOrder(int(segments[1])), headers)
+        elif len(segments) == 1:
+            page = int(query.get('page', 1))
+            pageSize = min(int(query.get('pageSize', 100)), 500)
+            self.sendBody(200, self.server.getPage(total, page, pageSize), 'application/json', headers)
+        else:
+            self.sendJSON(404, {'message': 'Not found'}, headers)
+
+    def handleExports(self, segments, query):
+        server = self.server
+        if len(segments) == 3:
+            with server.lock:
+                fileName = 'bench-{}-{}.csv'.format(query.get('rows', 1000), len(server.exports) + 1)
+                server.exports[fileName] = {'rows': int(query.get('rows', 1000)), 'polls': 0}
+            self.sendJSON(200, {'result': 'success', 'export_file': fileName})
+            return
+        export = server.exports.get(segments[3])
+        if export is None:
+            self.sendJSON(404, {'result': 'failure', 'message': 'Unknown export'})
+            return
+        with server.lock:
+            export['polls'] += 1
+            ready = export['polls'] > server.exportPolls
+        if ready:
+            url = 'http://{}:{}/files/{}'.format(server.server_address[0], server.server_address[1], segments[3])
+            self.sendJSON(200, {'result': 'success', 'url': url})
+        else:
+            self.sendJSON(200, {'result': 'failure', 'message': 'Export is not ready yet'})
+
+    def handleFile(self, fileName):
+        export = self.server.exports.get(fileName)
+        if export is None:
+            self.sendJSON(404, {'message': 'Not found'})
+            return
+        body = self.server.getFile(export['rows'])
+        rangeHeader = self.headers.get('Range')
+        if rangeHeader and rangeHeader.startswith('bytes='):
+            start, _, end = rangeHeader[len('bytes='):].partition('-')
+            start = int(start)
+            end = min(int(end), len(body) - 1) if end else len(body) - 1
+            headers = {'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(body)), 'Accept-Ranges': 'bytes'}
+            self.sendBody(206, body[start:end + 1], 'text/csv', headers)
+        else:
+            self.sendBody(200, body, 'text/csv', {'Accept-Ranges': 'bytes'})
+
+    def sendJSON(self, status, data, headers=None):
+        self.sendBody(status, json.dumps(data).encode('utf-8'), 'application/json', headers)
+
+    def sendBody(self, status, body, contentType, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+def startMockServer(latency=0.0, throttleRate=0.0, rateLimit=6000, exportPolls=0):
+    """
+    Function that starts the mock server on a free local port, in a background thread.
+
+    Returns
+    -------
+        - server : MockServer
+            The running server, stop it with shutdown()
+    """
+    server = MockServer(('127.0.0.1', 0), latency=latency, throttleRate=throttleRate, rateLimit=rateLimit, exportPolls=exportPolls)
+    thread = threading.Thread(target=server.serve_forever, name='mock-server', daemon=True)
+    thread.start()
+    return server
+
+def getAuthString(orders):
+    """ Function that builds the Authorization header of a benchmark account with the given number of orders """
+    return 'Basic ' + base64.b64encode('bench-{}:secret'.format(orders).encode('utf-8')).decode('utf-8')
+
+def getOrderCount(authString):
+    """ Function that reads the number of orders back from the Authorization header, 1000 if it can't be read """
+    try:
+        apiKey = base64.b64decode(authString.split(' ', 1)[1]).decode('utf-8').split(':', 1)[0]
+        return int(apiKey.split('-', 1)[1])
+    except (IndexError, ValueError):
+        return 1000
+
+def makeOrder(orderId):
+    """ Function that returns a synthetic order shaped like ShipStation's, the same for the same id """
+    items = [{'orderItemId': orderId * 10 + index, 'lineItemKey': None, 'sku': 'SKU-{:05d}'.format((orderId * 7 + index) % 20000),
+              'name': 'Benchmark product {}'.format((orderId + index) % 500), 'imageUrl': None, 'weight': {'value': 12.5, 'units': 'ounces'},
+              'quantity': 1 + (orderId + index) % 3, 'unitPrice': round(5 + (orderId % 9000) / 100.0, 2), 'options': []}
+             for index in range(1 + orderId % 3)]
+    day = 1 + orderId % 28
+    return {
+        'orderId': orderId,
+        'orderNumber': 'BENCH-{}'.format(orderId),
+        'orderKey': 'bench-key-{}'.format(orderId),
+        'orderDate': '2024-01-{:02d}T10:00:00.0000000'.format(day),
+        'modifyDate': '2024-01-{:02d}T12:00:00.0000000'.format(day),
+        'orderStatus': 'awaiting_shipment',
+        'customerEmail': 'customer{}@example.com'.format(orderId % 997),
+        'billTo': {'name': 'Customer {}'.format(orderId % 997)},
+        'shipTo': {'name': 'Customer {}'.format(orderId % 997), 'street1': '{} Main St'.format(orderId % 1000), 'city': 'Springfield',
+                   'state': 'IL', 'postalCode': '62701', 'country': 'US', 'phone': None, 'residential': True},
+        'items': items,
+        'orderTotal': round(sum(item['unitPrice'] * item['quantity'] for item in items), 2),
+        'amountPaid': round(sum(item['unitPrice'] * item['quantity'] for item in items), 2),
+        'advancedOptions': {'storeId': 1000 + orderId % 5, 'warehouseId': 1},
+    }
+
+def makeExportFile(rows):
+    """ Function that returns a synthetic SureDone export csv of the given number of rows, with a BOM and quoted fields """
+    lines = ['\ufeffguid,stock,price,msrp,cost,title,longdescription,condition,brand,upc,weight,id']
+    for row in range(1, rows + 1):
+        lines.append('SKU-{0:06d},{1},{2:.2f},{3:.2f},{4:.2f},"Benchmark product {0}, size {5}","Line one of {0}\r\nline two, with ""quotes""\nline three",New,Brand {6},{7:012d},{8:.1f},{0}'.format(
+            row, row % 50, 5 + row % 90, 9 + row % 90, 3 + row % 40, row % 12, row % 30, 100000000000 + row, 0.5 + row % 10))
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+def runInProcess(scenario, size, baseURL):
+    """
+    Function that runs one scenario in a new python process, whose home directory is a temporary
+    directory so the log files and state of the scripts don't end up in the user's home.
+
+    Returns
+    -------
+        - result : dict
+            See runScenario
+    """
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as workDir:
+        env = dict(os.environ)
+        env['HOME'] = workDir
+        env['USERPROFILE'] = workDir
+        command = [sys.executable, os.path.abspath(__file__), '--run', scenario, str(size), baseURL, workDir]
+        process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0 or not process.stdout.strip():
+            raise RuntimeError("Scenario {} with {} failed:\n{}".format(scenario, size, process.stderr))
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+def runScenario(scenario, size, baseURL, workDir):
+    """
+    Function that runs one scenario in this process and prints its result as a json line.
+
+    Parameters
+    ----------
+        - scenario : str
+            One of SCENARIOS
+        - size : int
+            Number of orders or rows
+        - baseURL : str
+            Url of the mock server
+        - workDir : str
+            Directory the scenario can write to
+    Returns
+    -------
+        - result : dict
+            scenario, size, count (orders or rows received), seconds, perSecond, peakRSS in MB,
+            requests, retries, throttled seconds and statuses, taken from apiCommon.METRICS
+    """
+    import apiCommon
+    apiCommon.setSession(createRedirectSession(baseURL))
+
+    start = time.perf_counter()
+    if scenario == 'listOrders':
+        import shipStation
+        count = len(shipStation.listOrders(getAuthString(size))['orders'])
+        seconds = time.perf_counter() - start
+    elif scenario == 'main':
+        import shipStation
+        configPath = os.path.join(workDir, 'shipstation.yaml')
+        with open(configPath, 'w') as f:
+            f.write('api-key: bench-{}\napi-secret: secret\n'.format(size))
+        start = time.perf_counter()
+        shipStation.main(['-f', configPath, '-o', workDir])
+        seconds = time.perf_counter() - start
+        with open(os.path.join(workDir, shipStation.OUTPUT_FILES['json']), 'r') as f:
+            count = len(json.load(f)['orders'])
+    elif scenario == 'download':
+        import reference
+        sureDone = reference.SureDone('bench', 'token', 30)
+        response = sureDone.apicall('get', 'bulk/exports', {'type': 'items', 'rows': size})
+        downloadPath = os.path.join(workDir, 'SureDone_benchmark.csv')
+        stats = reference.downloadExportedFile(response['export_file'], downloadPath, sureDone)
+        seconds = time.perf_counter() - start
+        count = stats['rows'] if stats else 0
+        if stats:
+            checkConversion(downloadPath)
+
+    report = apiCommon.METRICS.getReport()
+    statuses = {}
+    for endpointStats in report['endpoints'].values():
+        for status, statusCount in endpointStats['statuses'].items():
+            statuses[status] = statuses.get(status, 0) + statusCount
+    result = {
+        'scenario': scenario,
+        'size': size,
+        'count': count,
+        'seconds': round(seconds, 3),
+        'perSecond': round(count / seconds, 1) if seconds > 0 else 0.0,
+        'peakRSS': getPeakRSS(),
+        'requests': report['requests'],
+        'retries': sum(endpointStats['retries'] for endpointStats in report['endpoints'].values()),
+        'throttled': report['throttled'],
+        'statuses': statuses,
+    }
+    print(json.dumps(result))
+    return result
+
+def checkConversion(path, delimiter=';'):
+    """
+    Function that converts a downloaded export to another delimiter the way reference.py does while
+    streaming, and checks that every record reads back the same, line breaks inside quoted fields included.
+
+    Parameters
+    ----------
+        - path : str
+            Path of the comma separated export
+        - delimiter : str
+            Delimiter to convert to
+    Raises
+    ------
+        - ValueError
+            If a converted record differs from the original one
+    """
+    import io
+    import csv
+    import reference
+    output = io.StringIO(newline='')
+    reference.convertDelimiter(reference.readChunks(path), output, delimiter)
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        original = list(csv.reader(f))
+    converted = list(csv.reader(io.StringIO(output.getvalue(), newline=''), delimiter=delimiter))
+    idIndex = original[0].index('id')
+    if len(original) != len(converted):
+        raise ValueError("Converted {} records instead of {}".format(len(converted), len(original)))
+    for number, (row, convertedRow) in enumerate(zip(original, converted)):
+        if [row[idIndex]] + row[:idIndex] + row[idIndex + 1:] != convertedRow:
+            raise ValueError("Record {} changed in the conversion: {!r} became {!r}".format(number, row, convertedRow))
+
+def createRedirectSession(baseURL):
+    """
+    Function that creates a pooled session whose https requests are sent to the mock server instead,
+    keeping their path and query string.
+
+    Parameters
+    ----------
+        - baseURL : str
+            Url of the mock server
+    Returns
+    -------
+        - session : requests.Session
+    """
+    import apiCommon
+    from requests.adapters import HTTPAdapter
+
+    class RedirectAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = baseURL + request.path_url
+            return HTTPAdapter.send(self, request, **kwargs)
+
+    session = apiCommon.createSession()
+    session.mount('https://', RedirectAdapter(pool_connections=apiCommon.POOL_SIZE, pool_maxsize=apiCommon.POOL_SIZE, max_retries=0))
+    return session
+
+def getPeakRSS():
+    """ Function that returns the peak resident memory of this process in MB, None where it can't be read """
+    # On Linux ru_maxrss survives the exec of the child process and would include the benchmark's own memory,
+    # the high water mark of /proc is reset by the exec
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, the others kilobytes
+    return round(peak / (1048576.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+def resultKey(result):
+    return '{}:{}'.format(result['scenario'], result['size'])
+
+def loadBaseline(baselinePath):
+    """ Function that reads the saved baseline, an empty one if there is none """
+    if not os.path.exists(baselinePath):
+        return {}
+    with open(baselinePath, 'r') as f:
+        return json.load(f)
+
+def compareWithBaseline(results, baseline, tolerance):
+    """
+    Function that compares the results with the baseline.
+
+    Returns
+    -------
+        - regressions : list
+            A message for every scenario that is slower, uses more memory or makes more requests than allowed
+    """
+    regressions = []
+    for result in results:
+        previous = baseline.get(resultKey(result))
+        if previous is None:
+            continue
+        if result['perSecond'] < previous['perSecond'] * (1 - tolerance):
+            regressions.append("{} went from {} to {} per second".format(resultKey(result), previous['perSecond'], result['perSecond']))
+        if result['peakRSS'] and previous.get('peakRSS') and result['peakRSS'] > previous['peakRSS'] * (1 + tolerance):
+            regressions.append("{} peak RSS went from {} MB to {} MB".format(resultKey(result), previous['peakRSS'], result['peakRSS']))
+        if result['requests'] > previous['requests'] * (1 + tolerance):
+            regressions.append("{} went from {} to {} requests".format(resultKey(result), previous['requests'], result['requests']))
+    return regressions
+
+def printResult(result):
+    print("{:<10} {:>7} {:>8} received in {:>8.3f} s, {:>10.1f}/s, peak RSS {} MB, {} requests, {} retries, throttled {} s".format(
+        result['scenario'], result['size'], result['count'], result['seconds'], result['perSecond'],
+        result['peakRSS'], result['requests'], result['retries'], result['throttled']))
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--run']:
+        scenario, size, baseURL, workDir = sys.argv[2:6]
+        runScenario(scenario, int(size), baseURL, workDir)
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -69,6 +69,7 @@ Usage:
 
 Parameters/Options:
     -h  | --help            : View usage help and examples
+    -V  | --version         : Show the version and how long the script took to import
     -d  | --delimter        : Delimiter to be used as the separator in the CSV file saved by the script
         |                       - Default is comma ','.
     -f  | --file            : Path to the configuration file containing API keys
@@ -107,6 +108,7 @@ Usage:
 
 Parameters/Options:
     -h  | --help            : View usage help and examples
+    -V  | --version         : Show the version and how long the script took to import
     -d  | --delimter        : Delimiter to be used as the separator in the CSV file saved by the script
         |                       - Default is comma ','.
     -f  | --file            : Path to the configuration file containing API keys
@@ -136,52 +138,75 @@ Example:
 """
 
 # Imports
+import time
+IMPORT_START = time.perf_counter()
 import sys
 import os
 import getopt
-import platform
-import requests
-import yaml
+import apiCommon
 import json
-import pandas as pd
-import re
-import time
-import inspect
-import traceback
+import csv
+import codecs
+import threading
 from os.path import expanduser
 from datetime import datetime
+# Heavier modules (yaml, requests, pandas) are imported where they are used
+# so that the script starts fast and pandas is only loaded for the fallbacks.
 
 currentMilliTime = lambda: int(round(time.time() * 1000))
 
-PYTHON_VERSION = float(sys.version[:sys.version.index(' ')-2])
+PYTHON_VERSION = sys.version_info[:2]
+VERSION = '1.0.7'
+# Milliseconds this module and apiCommon may take to import, reported by --version
+STARTUP_BUDGET = 100
 
 # Time tracking variables
 RUN_TIME = currentMilliTime()
 START_TIME = datetime.now()
 
-def main(argv):
-    localFrame = inspect.currentframe()
+# Download settings. Exports of at least RANGED_DOWNLOAD_MIN_SIZE bytes are fetched
+# as RANGE_PART_SIZE byte ranges over RANGE_WORKERS connections when the server allows it.
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+RANGED_DOWNLOAD_MIN_SIZE = 16 * 1024 * 1024
+RANGE_PART_SIZE = 8 * 1024 * 1024
+RANGE_WORKERS = 4
+# Ranges that still fail are tried again RANGE_ROUNDS times, RANGE_ROUND_DELAY seconds apart (times the round)
+RANGE_ROUNDS = 3
+RANGE_ROUND_DELAY = 5.0
+# An interrupted ranged download is resumed by the next run if its export is at most this many seconds old,
+# older part files are removed by purge
+PART_MAX_AGE = 3600
+
+# Polling of bulk/exports/<file> while the export is prepared. The seconds recent exports
+# took to become ready are kept in EXPORT_HISTORY_PATH to schedule the next polls.
+EXPORT_HISTORY_PATH = os.path.join(expanduser('~'), '.suredone_export_history.json')
+EXPORT_HISTORY_SIZE = 20
+EXPORT_POLL_INTERVAL = 1.0
+EXPORT_POLL_FACTOR = 1.5
+EXPORT_POLL_CAP = 30.0
+EXPORT_POLL_DEADLINE = 600.0
 
+def main(argv):
     # Parse arguments
     # When verbose argument is added, change the verbose of the logger based on the argument as well
     waitTime, configPath, delimiter, outputFilePath, preserveOldFiles, verbose = parseArgs(argv)
 
     # Check if python version is 3.5 or higher
-    if not PYTHON_VERSION >= 3.5:
-        LOGGER.writeLog("Must use Python version 3.5 or higher!", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+    if not PYTHON_VERSION >= (3, 5):
+        LOGGER.writeLog("Must use Python version 3.5 or higher!", severity='code-breaker', data={'code':1})
         exit()
     
-    LOGGER.writeLog("SureDone bulk downloader initalized.", localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Wait time: {} seconds.".format(waitTime), localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Configurations path: {}.".format(configPath), localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Delimiter: {}.".format(delimiter), localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Preserve old files: {}.".format(preserveOldFiles), localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Verbose: {}.\n".format(verbose), localFrame.f_lineno, severity='normal')
+    LOGGER.writeLog("SureDone bulk downloader initalized.", severity='normal')
+    LOGGER.writeLog("Wait time: {} seconds.".format(waitTime), severity='normal')
+    LOGGER.writeLog("Configurations path: {}.".format(configPath), severity='normal')
+    LOGGER.writeLog("Delimiter: {}.".format(delimiter), severity='normal')
+    LOGGER.writeLog("Preserve old files: {}.".format(preserveOldFiles), severity='normal')
+    LOGGER.writeLog("Verbose: {}.\n".format(verbose), severity='normal')
 
     # Parse configuration
     user, apiToken = loadConfig(configPath)
 
-    LOGGER.writeLog("Configuration read.", localFrame.f_lineno, severity='normal')
+    LOGGER.writeLog("Configuration read.", severity='normal')
     
     # Initialize API handler object
     sureDone = SureDone(user, apiToken, waitTime)
@@ -189,10 +214,17 @@ def main(argv):
     # Get data to send to the bulk/exports sub module
     data = getDataForExports()
 
-    # Invoke the GET API call to bulk/exports sub module
-    exportRequestResponse = sureDone.apicall('get', 'bulk/exports', data)
-    
-    LOGGER.writeLog("API response recieved.", localFrame.f_lineno, severity='normal')
+    # An export whose download was interrupted by a previous run is downloaded again instead of a new one
+    pendingExport = getPendingExport(getPartPath(outputFilePath))
+    exportStart = currentMilliTime()
+    if pendingExport is not None:
+        LOGGER.writeLog("Resuming the download of export {}.".format(pendingExport), severity='normal')
+        exportRequestResponse = {'result': 'success', 'export_file': pendingExport}
+    else:
+        # Invoke the GET API call to bulk/exports sub module
+        exportRequestResponse = sureDone.apicall('get', 'bulk/exports', data)
+        LOGGER.writeLog("API response recieved.", severity='normal')
+    exportRequestTime = currentMilliTime() - exportStart
     
     # If the returning json has a 'result' key with 'success' value...
     if exportRequestResponse['result'] == 'success':
@@ -200,15 +232,24 @@ def main(argv):
         fileName = exportRequestResponse['export_file']
 
         # Download and save the file
-        downloadExportedFile(fileName, outputFilePath, sureDone, delimiter=delimiter)
-
-        safeExit(outputFilePath, marker='execution-complete')
+        stats = downloadExportedFile(fileName, outputFilePath, sureDone, delimiter=delimiter)
+        if stats is not None:
+            stats['phases'].insert(0, ('Export request', exportRequestTime))
+
+        # Machine readable summary of every api call, saved next to the download
+        reportPath = os.path.splitext(outputFilePath)[0] + '_report.json'
+        report = apiCommon.METRICS.writeReport(reportPath)
+        LOGGER.writeLog("Run report saved to {}.".format(reportPath), severity='normal')
+        # Nothing was saved if the download failed, there is no file to summarize
+        if stats is not None:
+            stats['report'] = report
+            safeExit(outputFilePath, marker='execution-complete', stats=stats)
 
     # If the returning JSON wasn't successful in the first place, end the code with a generic error.
     else:
-        LOGGER.writeLog("Can not export for some reason.", localFrame.f_lineno, severity='code-breaker', data={'code':2, 'response':exportRequestResponse})
+        LOGGER.writeLog("Can not export for some reason.", severity='code-breaker', data={'code':2, 'response':exportRequestResponse})
 
-def safeExit(downloadPath, marker=''):
+def safeExit(downloadPath, marker='', stats=None):
     """
     Function that will perform a basic print job at the end of the script.
 
@@ -219,9 +260,14 @@ def safeExit(downloadPath, marker=''):
         - marker : str
             An identifier of what initiated the function.
             Currently we only have one initiator of this function, could be more later.
+        - stats : dict
+            Totals counted while the file was downloaded (see downloadExportedFile),
+            with the run report of apiCommon.METRICS under 'report' 
     """
-    # Read the csv's length
-    numRows = len(pd.read_csv(downloadPath))
+    # The row count comes from the download itself. Only read the csv's length if it wasn't counted.
+    if stats is None:
+        import pandas as pd
+        stats = {'rows': len(pd.read_csv(downloadPath)), 'bytes': os.path.getsize(downloadPath), 'phases': []}
 
     # Get ending time
     END_TIME = datetime.now()
@@ -236,7 +282,18 @@ def safeExit(downloadPath, marker=''):
         print("Starting time: {}".format(START_TIME.strftime("%H:%M:%S")))
         print("Ending time: {}".format(END_TIME.strftime("%H:%M:%S")))
         print("Total execution time: {} milliseconds ({} seconds)".format(executionTime, (executionTime/1000)))
-        print("Total records in downloaded file: {}".format(numRows))
+        print("Total records in downloaded file: {}".format(stats['rows']))
+        print("Downloaded size: {:.2f} MB".format(stats['bytes'] / 1048576))
+        for phase, milliseconds in stats['phases']:
+            print("{}: {} milliseconds".format(phase, milliseconds))
+            if phase == 'Download' and milliseconds > 0:
+                print("Download throughput: {:.2f} MB/s, {:.0f} records/s".format(stats['bytes'] / 1048576 / (milliseconds/1000), stats['rows'] / (milliseconds/1000)))
+        if 'report' in stats:
+            report = stats['report']
+            print("API requests: {} ({} per minute), throttled for {} seconds".format(report['requests'], report['requestsPerMinute'], report['throttled']))
+            for endpoint, endpointStats in sorted(report['endpoints'].items()):
+                latency = endpointStats['latency']
+                print("    {}: {} requests, p50 {} ms, p95 {} ms, p99 {} ms".format(endpoint, endpointStats['requests'], latency['p50'], latency['p95'], latency['p99']))
         print("=================================================================")
 
 def loadConfig (configPath):
@@ -255,12 +312,13 @@ def loadConfig (configPath):
         - apiToken : str
             Api authentication token from the configuration file
     """
+    import yaml
     # Loading configurations
     with open(configPath, 'r') as stream:
         try:
             config = yaml.safe_load(stream)
         except yaml.YAMLError as exc:
-            LOGGER.writeLog("Error while loading YAML.", localFrame.f_lineno, severity='code-breaker', data={'code':3, 'error':exc})
+            LOGGER.writeLog("Error while loading YAML.", severity='code-breaker', data={'code':3, 'error':exc})
     
     # Try to read the user and api_token from suredone_api set in the settings
     # Print error that the settings weren't found and exit
@@ -268,7 +326,7 @@ def loadConfig (configPath):
         user = config['user']
         apiToken = config['token']
     except KeyError as exc:
-        LOGGER.writeLog("Not found user or token in config file.", localFrame.f_lineno, severity='code-breaker', data={'code':3, 'error':exc})
+        LOGGER.writeLog("Not found user or token in config file.", severity='code-breaker', data={'code':3, 'error':exc})
         exit()
     return user, apiToken
 
@@ -284,7 +342,6 @@ def getDefaultDownloadPath(preserve):
         - downloadPath : str
             A valid path that points to the diretory where the file should be downloaded
     """
-    localFrame = inspect.currentframe()
     # Generate file name
     suffix = datetime.now().strftime('%Y_%m_%d-%H-%M-%S')
     fileName = 'SureDone_Downloads_' + suffix + '.csv'    
@@ -295,7 +352,7 @@ def getDefaultDownloadPath(preserve):
         downloadPath = os.path.join(downloadPath, 'Downloads')
         if not preserve:
             purge(downloadPath, 'SureDone_')
-            LOGGER.writeLog("Purged existing files.", localFrame.f_lineno, severity='normal')
+            LOGGER.writeLog("Purged existing files.", severity='normal')
         
         downloadPath = os.path.join(downloadPath, fileName)
         return downloadPath
@@ -307,7 +364,7 @@ def getDefaultDownloadPath(preserve):
         if os.path.exists(downloadPath):
             if not preserve:
                 purge(downloadPath, 'SureDone_')
-                LOGGER.writeLog("Purged existing files.", localFrame.f_lineno, severity='normal')
+                LOGGER.writeLog("Purged existing files.", severity='normal')
         else:   # Create the downloads directory
             os.mkdir(downloadPath)
         
@@ -359,48 +416,631 @@ def downloadExportedFile(fileName, downloadFilePath, sureDone, delimiter=','):
             Path to the download directory.
         - sureDone : SureDone object
             Object of the SureDone API handler class
+    Returns
+    -------
+        - stats : dict
+            Counted while downloading, None if the file could not be downloaded:
+                - rows : number of records in the file, not counting the header
+                - bytes : size of the download in bytes
+                - phases : list of (phase, milliseconds) tuples
     """
-    localFrame = inspect.currentframe()
-    errorCount=0
+    exportWait = ExportPoller()
+    waitStart = currentMilliTime()
     while True:
         # Invoke api call to the same module but with a filename and no data 
-        fileDownloadURLResponse = sureDone.apicall('get', 'bulk/exports/' + fileName, {})
+        fileDownloadURLResponse = sureDone.apicall('get', 'bulk/exports/' + fileName, {}, label='bulk/exports/{file}')
 
         # If the result was successfull...
         if fileDownloadURLResponse['result'] == 'success':
             # Set the path, get the download URL of the file requested, and start a stream to download it
-            LOGGER.writeLog("Starting file download.", localFrame.f_lineno, severity='normal')
-            downloadStream = requests.get(fileDownloadURLResponse['url'], stream=True)
-            
-            # Get all the file bytes in the stream and write to the file
-            index = 0
-            with open(downloadFilePath, 'wb') as downloadedFile:
-                for index, chunk in enumerate(downloadStream.iter_content(chunk_size=1024)):
-                    if chunk:  # filter out keep-alive new chunks
-                        downloadedFile.write(chunk)
-            
-            # Re open the saved csv and save it back with the desired delimiter
-            # As long as the delimiter desired is not ',' becasue the default way of delimiting the csv is via ','
-            if delimiter != ',':
+            LOGGER.writeLog("Starting file download.", severity='normal')
+            downloadStart = currentMilliTime()
+            exportWait.record()
+            downloadURL = fileDownloadURLResponse['url']
+            rawPath = None
+            size, acceptsRanges = probeDownload(sureDone, downloadURL)
+            if acceptsRanges and size >= RANGED_DOWNLOAD_MIN_SIZE:
+                # Big files are fetched as byte ranges in parallel into a local part file,
+                # which is then counted (and converted) in a single pass over the disk
+                rawPath = getPartPath(downloadFilePath)
+                try:
+                    downloadRanges(sureDone, downloadURL, rawPath, size, key=fileName)
+                except LoadingError:
+                    # The part file and its manifest are kept so the next run resumes the missing ranges
+                    LOGGER.writeLog("Can not download all ranges of the export, run again to resume.", severity='code-breaker', data={'code':2})
+                    return None
+                counter, converted = saveChunks(readChunks(rawPath), downloadFilePath, delimiter, rawPath=rawPath)
+            else:
+                try:
+                    downloadStream = openDownload(sureDone, downloadURL)
+                except LoadingError:
+                    LOGGER.writeLog("Can not download the export.", severity='code-breaker', data={'code':2})
+                    return None
+                with downloadStream:
+                    # Filter out keep-alive new chunks
+                    chunks = (chunk for chunk in downloadStream.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE) if chunk)
+                    counter, converted = saveChunks(chunks, downloadFilePath, delimiter)
+                apiCommon.METRICS.record('GET download', downloadStream.status_code, (currentMilliTime() - downloadStart) / 1000, size=counter.bytes)
+
+            # Fallback: get the file as it is, then re-open the saved csv and save it back with the desired delimiter
+            if not converted:
+                counter = DownloadCounter()
+                if rawPath is not None:
+                    for chunk in counter.track(readChunks(rawPath)):
+                        pass
+                    os.replace(rawPath, downloadFilePath)
+                else:
+                    try:
+                        downloadStream = openDownload(sureDone, downloadURL)
+                    except LoadingError:
+                        LOGGER.writeLog("Can not download the export.", severity='code-breaker', data={'code':2})
+                        return None
+                    with downloadStream:
+                        with open(downloadFilePath, 'wb') as downloadedFile:
+                            for chunk in counter.track(downloadStream.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)):
+                                if chunk:
+                                    downloadedFile.write(chunk)
+                import pandas as pd
                 temp = pd.read_csv(downloadFilePath, index_col='id')
                 temp.to_csv(downloadFilePath, sep=delimiter)
                 
-            LOGGER.writeLog("Saved to " + downloadFilePath, localFrame.f_lineno, severity='normal')
-            break
+            LOGGER.writeLog("Saved to " + downloadFilePath, severity='normal')
+            stats = {}
+            stats['rows'] = counter.getRowCount()
+            stats['bytes'] = counter.bytes
+            stats['phases'] = [('Waiting for export', downloadStart - waitStart), ('Download', currentMilliTime() - downloadStart)]
+            return stats
         else:
-            # If the api call with the file name in the url wasn't successfull
-            # Increase the error count and check if error count has crossed 10 or not.
-            # More than 10 attempts with errors will end the code
-            errorCount += 1
-            if errorCount > 10:
-                LOGGER.writeLog("Can not download.", localFrame.f_lineno, severity='code-breaker', data={'code':2, 'response':fileDownloadURLResponse})
+            # If the api call with the file name in the url wasn't successfull the export is not ready yet.
+            # Poll again as the poller says, giving up after its deadline.
+            delay = exportWait.nextDelay()
+            if delay is None:
+                LOGGER.writeLog("Can not download.", severity='code-breaker', data={'code':2, 'response':str(fileDownloadURLResponse)})
                 # TODO: exit()
-                break
+                return None
             else:
-                LOGGER.writeLog('Attempt ' + str(errorCount) + ' ' + str(fileDownloadURLResponse), localFrame.f_lineno, severity='warning')
-                time.sleep(30)
+                LOGGER.writeLog('Attempt ' + str(exportWait.attempts) + ' ' + str(fileDownloadURLResponse), severity='warning')
+                time.sleep(delay)
                 continue
 
+def saveChunks(chunks, downloadFilePath, delimiter, rawPath=None):
+    """
+    Function that writes the downloaded csv to its final path, counting it on the way.
+
+    Parameters
+    ----------
+        - chunks : iterable
+            Byte chunks of the csv
+        - downloadFilePath : str
+            Path the csv is saved to
+        - delimiter : str
+            Delimiter for the saved csv
+        - rawPath : str
+            If the chunks are read from a local copy of the download, its path.
+            With the default delimiter the copy is moved into place instead of being written again.
+    Returns
+    -------
+        - counter : DownloadCounter
+            Rows and bytes of the download
+        - converted : bool
+            False if the delimiter could not be converted on the fly, the file then still needs the fallback conversion
+    """
+    counter = DownloadCounter()
+    chunks = counter.track(chunks)
+
+    # The default way of delimiting the csv is via ',' so the bytes can be written as they are.
+    # Any other delimiter is re-encoded on the fly while the stream is written.
+    if delimiter == ',':
+        if rawPath is not None:
+            for chunk in chunks:
+                pass
+            os.replace(rawPath, downloadFilePath)
+        else:
+            with open(downloadFilePath, 'wb') as downloadedFile:
+                for chunk in chunks:
+                    downloadedFile.write(chunk)
+        return counter, True
+
+    try:
+        with open(downloadFilePath, 'w', encoding='utf-8', newline='') as downloadedFile:
+            convertDelimiter(chunks, downloadedFile, delimiter)
+    except (csv.Error, UnicodeDecodeError) as exc:
+        LOGGER.writeLog("Could not convert the delimiter while downloading ({}). Falling back to re-reading the file.".format(exc), severity='warning')
+        return counter, False
+    if rawPath is not None:
+        os.remove(rawPath)
+    return counter, True
+
+def readChunks(path):
+    """
+    Function that reads a local file in download sized chunks.
+
+    Parameters
+    ----------
+        - path : str
+            Path of the file
+    Returns
+    -------
+        - chunks : generator
+            Byte chunks of the file
+    """
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def probeDownload(sureDone, url):
+    """
+    Function that asks the server for the size of the download and whether it can be fetched in byte ranges.
+    A one byte ranged GET is used instead of HEAD because signed download urls are often only valid for GET.
+
+    Parameters
+    ----------
+        - sureDone : SureDone object
+            Object of the SureDone API handler class, its session is used
+        - url : str
+            Download url of the export
+    Returns
+    -------
+        - size : int
+            Size of the file in bytes, 0 if unknown
+        - acceptsRanges : bool
+            True if byte ranges are supported
+    """
+    import requests
+    try:
+        with sureDone.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=sureDone.timeout) as probe:
+            contentRange = probe.headers.get('Content-Range', '')
+            if probe.status_code == 206 and '/' in contentRange:
+                size = apiCommon.toNumber(contentRange.rsplit('/', 1)[1], int)
+                return (size, True) if size else (0, False)
+            return apiCommon.toNumber(probe.headers.get('Content-Length'), int) or 0, False
+    except requests.exceptions.RequestException as e:
+        LOGGER.writeLog("Could not probe the download ({}), downloading in a single stream.".format(e), severity='warning')
+        return 0, False
+
+def downloadRanges(sureDone, url, partPath, size, key, partSize=RANGE_PART_SIZE, maxWorkers=RANGE_WORKERS):
+    """
+    Function that downloads a file as byte ranges in parallel into a preallocated file.
+    Finished ranges are recorded in a sidecar manifest (partPath + '.json') so that an interrupted
+    download of the same export resumes with the ranges that are still missing.
+
+    Parameters
+    ----------
+        - sureDone : SureDone object
+            Object of the SureDone API handler class, its session and retry policy are used
+        - url : str
+            Download url of the export
+        - partPath : str
+            Path of the file the ranges are written to
+        - size : int
+            Size of the file in bytes
+        - key : str
+            Identifies the export, the manifest is only reused for the same export and size
+        - partSize : int
+            Bytes per range
+        - maxWorkers : int
+            Ranges downloaded at the same time
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    manifestPath = partPath + '.json'
+    parts = [(start, min(start + partSize, size) - 1) for start in range(0, size, partSize)]
+
+    # Resume from the manifest if it belongs to this export
+    done = set()
+    if os.path.exists(manifestPath) and os.path.exists(partPath):
+        try:
+            with open(manifestPath, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('key') == key and manifest.get('size') == size and manifest.get('partSize') == partSize:
+                done = set(manifest.get('done', []))
+        except ValueError:
+            pass
+    lock = threading.Lock()
+    def saveManifest():
+        tempPath = manifestPath + '.tmp'
+        with open(tempPath, 'w') as f:
+            json.dump({'key': key, 'size': size, 'partSize': partSize, 'done': sorted(done)}, f)
+        os.replace(tempPath, manifestPath)
+
+    if done:
+        LOGGER.writeLog("Resuming download, {} of {} ranges already saved.".format(len(done), len(parts)), severity='normal')
+    else:
+        # Preallocate the file so every range can be written at its offset
+        with open(partPath, 'wb') as f:
+            f.truncate(size)
+        # The manifest names the export from the start, so a run that breaks off can be resumed
+        saveManifest()
+
+    def fetchPart(index):
+        downloadRange(sureDone, url, partPath, parts[index][0], parts[index][1])
+        with lock:
+            done.add(index)
+            saveManifest()
+
+    # Ranges that fail after their own retries are tried again in the next round
+    with ThreadPoolExecutor(max_workers=max(1, maxWorkers)) as executor:
+        for attempt in range(RANGE_ROUNDS + 1):
+            futures = [executor.submit(fetchPart, index) for index in range(len(parts)) if index not in done]
+            failed = 0
+            for future in futures:
+                try:
+                    future.result()
+                except LoadingError:
+                    failed += 1
+            if not failed:
+                break
+            if attempt == RANGE_ROUNDS:
+                raise LoadingError
+            LOGGER.writeLog("{} of {} ranges failed, trying them again.".format(failed, len(parts)), severity='warning')
+            time.sleep(RANGE_ROUND_DELAY * (attempt + 1))
+    os.remove(manifestPath)
+
+def getPartPath(downloadFilePath):
+    """
+    Function that returns the path a ranged download is written to before it is saved as downloadFilePath.
+    The timestamp of the default file name is left out, so the next run finds the part file of an interrupted download.
+
+    Parameters
+    ----------
+        - downloadFilePath : str
+            Path the csv is saved to
+    Returns
+    -------
+        - partPath : str
+            For example downloads/SureDone_Downloads.csv.part
+    """
+    import re
+    directory, name = os.path.split(downloadFilePath)
+    return os.path.join(directory, re.sub(r'_\d{4}_\d{2}_\d{2}-\d{2}-\d{2}-\d{2}(?=\.csv$)', '', name) + '.part')
+
+def getPendingExport(partPath):
+    """
+    Function that returns the export an earlier run did not finish downloading into partPath.
+
+    Parameters
+    ----------
+        - partPath : str
+            Path of the part file, see getPartPath
+    Returns
+    -------
+        - fileName : str
+            The export file to download again, None if there is nothing to resume or it is older than PART_MAX_AGE
+    """
+    manifestPath = partPath + '.json'
+    if not os.path.exists(manifestPath) or not os.path.exists(partPath):
+        return None
+    if time.time() - os.path.getmtime(manifestPath) > PART_MAX_AGE:
+        return None
+    try:
+        with open(manifestPath, 'r') as f:
+            return json.load(f).get('key')
+    except ValueError:
+        return None
+
+def openDownload(sureDone, url):
+    """
+    Function that starts the download stream of an export, retrying as the retry policy allows
+    when no response comes back or the status is an error.
+
+    Parameters
+    ----------
+        - sureDone : SureDone object
+            Object of the SureDone API handler class
+        - url : str
+            Download url of the export
+    Returns
+    -------
+        - downloadStream : requests.Response
+            The streamed response, its body not read yet
+    Raises
+    ------
+        - LoadingError
+            If the download could not be started
+    """
+    import requests
+    retry = sureDone.retryPolicy.begin('get')
+    started = time.monotonic()
+    while True:
+        status = None
+        try:
+            downloadStream = sureDone.session.get(url, stream=True, timeout=sureDone.timeout)
+        except requests.exceptions.RequestException as e:
+            delay = retry.nextDelay(error=e)
+            LOGGER.writeLog("Download failed: {}. Attempt {}.".format(e, retry.attempts), severity='warning')
+        else:
+            if downloadStream.status_code < 400:
+                return downloadStream
+            # An error page must not be saved as the export
+            status = downloadStream.status_code
+            downloadStream.close()
+            delay = retry.nextDelay(status=status, headers=downloadStream.headers)
+            LOGGER.writeLog("Download failed with status {}. Attempt {}.".format(status, retry.attempts), severity='warning')
+        if delay is None:
+            apiCommon.METRICS.record('GET download', status, time.monotonic() - started, retries=retry.retries)
+            raise LoadingError
+        time.sleep(delay)
+
+def downloadRange(sureDone, url, partPath, start, end):
+    """
+    Function that downloads one byte range into its place in the part file.
+    A range that breaks off is continued from the last byte written, as long as the retry policy allows.
+
+    Parameters
+    ----------
+        - sureDone : SureDone object
+            Object of the SureDone API handler class
+        - url : str
+            Download url of the export
+        - partPath : str
+            Path of the preallocated file
+        - start : int
+            First byte of the range
+        - end : int
+            Last byte of the range (inclusive)
+    """
+    import requests
+    retry = sureDone.retryPolicy.begin('get')
+    started = time.monotonic()
+    position = start
+    with open(partPath, 'r+b') as f:
+        while position <= end:
+            try:
+                with sureDone.session.get(url, headers={'Range': 'bytes={}-{}'.format(position, end)}, stream=True, timeout=sureDone.timeout) as rangeStream:
+                    if rangeStream.status_code != 206:
+                        raise requests.exceptions.RequestException('Status {} for range {}-{}'.format(rangeStream.status_code, position, end))
+                    f.seek(position)
+                    for chunk in rangeStream.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk[:end - position + 1])
+                            position += len(chunk)
+                if position <= end:
+                    raise requests.exceptions.RequestException('Range {}-{} ended at {}'.format(start, end, position))
+            except requests.exceptions.RequestException as e:
+                delay = retry.nextDelay(error=e)
+                LOGGER.writeLog("Download of bytes {}-{} failed: {}. Attempt {}.".format(position, end, e, retry.attempts), severity='warning')
+                if delay is None:
+                    raise LoadingError
+                time.sleep(delay)
+    apiCommon.METRICS.record('GET download (range)', 206, time.monotonic() - started, size=end - start + 1, retries=retry.retries)
+
+class ExportPoller(object):
+    """
+    Class that schedules the polls of an export that is being prepared.
+    Polls start EXPORT_POLL_INTERVAL seconds apart and back off geometrically up to a cap.
+    When recent exports are known, the polls before the typical readiness time are skipped
+    and the short intervals are spent around it instead.
+
+    Parameters
+    ----------
+        - historyPath : str
+            Json file with the seconds recent exports took to become ready
+        - interval : float
+            First interval between polls in seconds
+        - factor : float
+            Growth of the interval after every poll
+        - cap : float
+            Longest interval between polls in seconds
+        - deadline : float
+            Seconds after which the export is given up on
+    """
+    def __init__(self, historyPath=EXPORT_HISTORY_PATH, interval=EXPORT_POLL_INTERVAL, factor=EXPORT_POLL_FACTOR, cap=EXPORT_POLL_CAP, deadline=EXPORT_POLL_DEADLINE):
+        self.historyPath = historyPath
+        self.interval = interval
+        self.factor = factor
+        self.cap = cap
+        self.deadline = deadline
+        self.history = self.loadHistory()
+        self.expected = self.getExpected()
+        self.attempts = 0
+        self.backoff = interval
+        self.started = time.monotonic()
+
+    def loadHistory(self):
+        """
+        Function that reads the readiness times of recent exports, an unreadable file counts as no history.
+        """
+        try:
+            with open(self.historyPath, 'r') as f:
+                history = json.load(f)
+            return [float(seconds) for seconds in history][-EXPORT_HISTORY_SIZE:]
+        except (OSError, ValueError, TypeError):
+            return []
+
+    def getExpected(self):
+        """
+        Function that estimates when this export will be ready: a bit before the median of recent exports.
+
+        Returns
+        -------
+            - expected : float
+                Seconds after which the first poll is worth it, 0 without history
+        """
+        if not self.history:
+            return 0.0
+        ordered = sorted(self.history)
+        return ordered[len(ordered) // 2] * 0.8
+
+    def nextDelay(self):
+        """
+        Function that returns how long to wait before the next poll.
+
+        Returns
+        -------
+            - delay : float
+                Seconds to sleep, None once the deadline has passed
+        """
+        self.attempts += 1
+        elapsed = time.monotonic() - self.started
+        if elapsed >= self.deadline:
+            return None
+
+        # Wait out the time recent exports needed in one sleep, then poll with short intervals again
+        if elapsed < self.expected:
+            delay = self.expected - elapsed
+        else:
+            delay = self.backoff
+            self.backoff = min(self.cap, self.backoff * self.factor)
+        return min(delay, self.deadline - elapsed)
+
+    def record(self):
+        """
+        Function that adds the readiness time of this export to the history, written atomically.
+        """
+        self.history = (self.history + [round(time.monotonic() - self.started, 3)])[-EXPORT_HISTORY_SIZE:]
+        tempPath = self.historyPath + '.tmp'
+        try:
+            with open(tempPath, 'w') as f:
+                json.dump(self.history, f)
+            os.replace(tempPath, self.historyPath)
+        except OSError as e:
+            LOGGER.writeLog("Could not save the export history: {}".format(e), severity='warning')
+
+class DownloadCounter(object):
+    """
+    Counts the bytes and csv records of a download as its chunks go by, so the file never has to be read again.
+    A record ends at a newline that is not inside a quoted field.
+    """
+    def __init__(self):
+        self.bytes = 0
+        self.newlines = 0
+        self.inQuotes = False
+        self.lastByte = b''
+
+    def track(self, chunks):
+        """
+        Function that counts the chunks while passing them through untouched.
+
+        Parameters
+        ----------
+            - chunks : iterable
+                Byte chunks of the csv
+        Returns
+        -------
+            - chunks : generator
+                The same chunks
+        """
+        for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+
+    def feed(self, chunk):
+        """
+        Function that counts a single chunk.
+
+        Parameters
+        ----------
+            - chunk : bytes
+                The next bytes of the csv
+        """
+        if not chunk:
+            return
+        self.bytes += len(chunk)
+        self.lastByte = chunk[-1:]
+        # Fast path, no quotes involved
+        if not self.inQuotes and b'"' not in chunk:
+            self.newlines += chunk.count(b'\n')
+            return
+        # Every quote flips the state, an escaped quote ("") flips it twice
+        parts = chunk.split(b'"')
+        for index, part in enumerate(parts):
+            if not self.inQuotes:
+                self.newlines += part.count(b'\n')
+            if index < len(parts) - 1:
+                self.inQuotes = not self.inQuotes
+
+    def getRowCount(self):
+        """
+        Returns
+        -------
+            - rows : int
+                Number of records seen, not counting the header
+        """
+        records = self.newlines
+        # The last record may not end with a newline
+        if self.bytes and self.lastByte != b'\n':
+            records += 1
+        return max(records - 1, 0)
+
+def convertDelimiter(chunks, outputFile, delimiter):
+    """
+    Function that re-encodes a comma separated csv stream with another delimiter, one record at a time.
+    Quoted fields spanning several lines are handled by the csv module.
+    The 'id' column is moved to the front, the same layout the file had when it was re-saved with pandas.
+
+    Parameters
+    ----------
+        - chunks : iterable
+            Byte chunks of the utf-8 encoded csv, as they are read from the download stream
+        - outputFile : file object
+            Text file opened with newline='' that the converted csv is written to
+        - delimiter : str
+            Delimiter for the output file
+    Returns
+    -------
+        - count : int
+            Number of records written, not counting the header
+    """
+    # Long descriptions can be bigger than the default field size limit
+    csv.field_size_limit(2**31 - 1)
+    # utf-8-sig drops a byte order mark if the export starts with one
+    reader = csv.reader(iterLines(chunks, encoding='utf-8-sig'))
+    writer = csv.writer(outputFile, delimiter=delimiter, lineterminator='\n')
+    # With '\n' as the line terminator the writer would leave a field holding a lone '\r' unquoted
+    quotingWriter = csv.writer(outputFile, delimiter=delimiter, lineterminator='\n', quoting=csv.QUOTE_ALL)
+
+    header = next(reader, None)
+    if header is None:
+        return 0
+    order = list(range(len(header)))
+    if 'id' in header:
+        idIndex = header.index('id')
+        order.remove(idIndex)
+        order.insert(0, idIndex)
+    writer.writerow([header[i] for i in order])
+
+    count = 0
+    for row in reader:
+        if len(row) < len(header):
+            row.extend([''] * (len(header) - len(row)))
+        row = [row[i] for i in order]
+        if any('\r' in field and '\n' not in field for field in row):
+            quotingWriter.writerow(row)
+        else:
+            writer.writerow(row)
+        count += 1
+    return count
+
+def iterLines(chunks, encoding='utf-8'):
+    """
+    Function that decodes byte chunks and yields the text line by line, the same way a file opened with newline='' reads.
+    Only '\n' ends a line and every '\r' is kept, so the csv reader sees '\r\n' inside a quoted field as it was sent.
+
+    Parameters
+    ----------
+        - chunks : iterable
+            Byte chunks
+        - encoding : str
+            Encoding of the bytes
+    Returns
+    -------
+        - lines : generator
+            The decoded lines
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
 def parseArgs(argv):
     """
     Function that parses the arguments sent from the command line 
@@ -427,8 +1067,8 @@ def parseArgs(argv):
             A boolean variable that will tell the script to keep or remove older downloaded files in the download path
     """
     # Defining options in for command line arguments
-    options = "hw:f:d:o:vp"
-    long_options = ["help", "wait=", "file=", 'delimiter=','output=', 'verbose', 'preserve']
+    options = "hVw:f:d:o:vp"
+    long_options = ["help", "version", "wait=", "file=", 'delimiter=','output=', 'verbose', 'preserve']
     
     # Arguments
     waitTime = 15
@@ -450,10 +1090,12 @@ def parseArgs(argv):
         exit()
 
     for option, value in opts:
-        if option == '-h':
-            # Turn on verbose, print help message, and exit
-            LOGGER.verbose = True
-            print (HELP_MESSAGE)
+        if option in ('-h', '--help'):
+            # Print help message straight to the terminal (no log file is created), and exit
+            LOGGER.terminal.write(HELP_MESSAGE)
+            sys.exit()
+        elif option in ('-V', '--version'):
+            LOGGER.terminal.write(getVersionReport())
             sys.exit()
         elif option in ("-w", "--wait"):
             waitTime = float(value)
@@ -482,6 +1124,21 @@ def parseArgs(argv):
 
     return waitTime, configPath, delimiter, outputFilePath, preserveOldFiles, verbose
 
+def getVersionReport():
+    """
+    Function that builds the text printed by --version: the version and how long the script took to import.
+
+    Returns
+    -------
+        - report : str
+            The version and import time report
+    """
+    report = "suredone_download {} (Python {}.{})\n".format(VERSION, *PYTHON_VERSION)
+    report += "Import time: {:.1f} ms (budget {} ms)\n".format(IMPORT_TIME, STARTUP_BUDGET)
+    if IMPORT_TIME > STARTUP_BUDGET:
+        report += "Import time is over budget. Run 'python3 -X importtime reference.py --version' to see which imports are slow.\n"
+    return report
+
 def validateDownloadPath(path):
     """
     Function that will vlidate the custom download path and load defaul if not found.
@@ -495,9 +1152,8 @@ def validateDownloadPath(path):
         - path : str
             The same path as input if validated and a default download path if invalidated
     """
-    localFrame =  inspect.currentframe()
     if not path.endswith('.csv'):
-        LOGGER.writeLog("The download path must define the filename as well with '.csv' extension. Switching to default download location.", localFrame.f_lineno, severity='warning')
+        LOGGER.writeLog("The download path must define the filename as well with '.csv' extension. Switching to default download location.", severity='warning')
         return False
     return True
 
@@ -516,14 +1172,13 @@ def validateDelimiter(delimiter):
         - delimiter : str
             The same delimiter if validated and a ',' as a delimiter if not validated.
     """
-    localFrame = inspect.currentframe()
     # Account for '\\t' and '\t'
     if delimiter == '\\t':
         delimiter = '\t'
     
     # Check for length
     if len(delimiter) > 1:
-        LOGGER.writeLog("Length of the delimiter was greater than one character, switching to default ',' delimiter.", localFrame.f_lineno, severity='warning')
+        LOGGER.writeLog("Length of the delimiter was greater than one character, switching to default ',' delimiter.", severity='warning')
         delimiter = ','
         return delimiter
 
@@ -532,7 +1187,7 @@ def validateDelimiter(delimiter):
 
 
     if delimiter not in acceptableDelimiters:
-        LOGGER.writeLog("Delimiter was not selected from acceptable options, switching to ',' default delimiter.", localFrame.f_lineno, severity='warning')
+        LOGGER.writeLog("Delimiter was not selected from acceptable options, switching to ',' default delimiter.", severity='warning')
         delimiter = ','
         return delimiter
     
@@ -551,15 +1206,14 @@ def validateConfigPath(configPath):
         - validated : bool
             A True or False as a result of the validation of the path
     """
-    localFrame = inspect.currentframe()
     # Check extension, must be YAML
     if not configPath.endswith('yaml'):
-        LOGGER.writeLog("Configuration file must be .yaml extension.\nLooking for configuration file in default locations.", localFrame.f_lineno, severity='error')
+        LOGGER.writeLog("Configuration file must be .yaml extension.\nLooking for configuration file in default locations.", severity='error')
         return False
 
     # Check if file exists
     if not os.path.exists(configPath):
-        LOGGER.writeLog("Specified path to the configuration file is invalid.\nLooking for configuration file in default locations.", localFrame.f_lineno, severity='error')
+        LOGGER.writeLog("Specified path to the configuration file is invalid.\nLooking for configuration file in default locations.", severity='error')
         return False
     else:
         return True
@@ -573,7 +1227,6 @@ def getDefaultConfigPath():
         - configPath : str
             Path to the configuration file if found in the default locations
     """
-    localFrame = inspect.currentframe()
     fileName = 'suredone.yaml'
     # Check in current directory
     directory = os.getcwd()
@@ -593,160 +1246,13 @@ def getDefaultConfigPath():
         if os.path.exists(configPath):
             return configPath
     else:
-        LOGGER.writeLog("Platform couldn't be recognized. Are you sure you are running this script on Windows or Ubuntu Linux?", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+        LOGGER.writeLog("Platform couldn't be recognized. Are you sure you are running this script on Windows or Ubuntu Linux?", severity='code-breaker', data={'code':1})
         exit()
 
-    LOGGER.writeLog("suredone.yaml config file wasn't found in default locations!\nSpecify a path to configuration file using (-f --file) argument.", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("suredone.yaml config file wasn't found in default locations!\nSpecify a path to configuration file using (-f --file) argument.", severity='code-breaker', data={'code':1})
     exit()
 
 """ Custom Exceptions that will be caught by the script """
-class Logger(object):
-    """ The logger class that will handle all outputs, may it be console or log file. """
-    def __init__(self, verbose=False):
-        self.terminal = sys.stdout
-        self.log = open(self.getLogPath(), "a")
-        # Write the header row
-        self.log.write(' Ind. |LineNo.| Time stamp  : Message')
-        self.log.write('\n=====================================\n')
-        self.verbose = verbose
-
-    def getLogPath(self):
-        """
-        Function that will determine the default log file path based on the operating system being used.
-        Will also create appropriate directories they aren't present.
-
-        Returns
-        -------
-            - logFile : fileIO
-                File IO for the whole script to log to.
-        """
-        # Define the file name for logging
-        temp = datetime.now().strftime('%Y_%m_%d-%H-%M-%S')
-        logFileName = "suredone_download_" + temp + ".log"
-
-        # If the platform is windows, set the log file path to the current user's Downloads/log folder
-        if sys.platform == 'win32' or sys.platform == 'win64': # Windows
-            logFilePath = os.path.expandvars(r'%USERPROFILE%')
-            logFilePath = os.path.join(logFilePath, 'Downloads')
-            logFilePath = os.path.join(logFilePath, 'log')
-            if os.path.exists(logFilePath):
-                return os.path.join(logFilePath, logFileName)
-            else:   # Create the log directory
-                os.mkdir(logFilePath)
-                return os.path.join(logFilePath, logFileName)
-
-        # If Linux, set the download path to the $HOME/downloads folder
-        elif sys.platform == 'linux' or sys.platform == 'linux2': # Linux
-            logFilePath = expanduser('~')
-            logFilePath = os.path.join(logFilePath, 'log')
-            if os.path.exists(logFilePath):
-                return os.path.join(logFilePath, logFileName)
-            else:   # Create the log directory
-                os.mkdir(logFilePath)
-                return os.path.join(logFilePath, logFileName)
-
-    def write(self, message):
-        if self.verbose:
-            self.terminal.write(message)
-            self.terminal.flush()
-        self.log.write(message)
-    
-    def writeLog(self, message, lineNumber, severity='normal', data=None):
-        """
-        Function that writes out to the log file and console based on verbose.
-        The function will change behavior slightly based on severity of the message.
-
-        Parameters
-        ----------
-            - message : str
-                Message to write
-            - severity : str
-                Defines what the message is related to. Is the message:
-                    - [N] : A 'normal' notification
-                    - [W] : A 'warning'
-                    - [E] : An 'error'
-                    - [!] : A 'code-breaker error' (errors that are followed by the script exitting)
-            - data : dict
-                A dictionary that will contain additional information when a code-breaker error occurs
-                Attributes:
-                    - code : error code
-                        1 : Generic error, only print the message.
-                        2 : An API call was not successful. Response object attached.
-                        3 : YAML loading error. Error object attached
-                    - response : str
-                        JSON-like str - the response recieved from the request in conern at the point of error.
-                    - error : str
-                        String produced by exception if an exception occured
-        """
-        # Get a timestamp
-        timestamp = self.getCurrentTimestamp()
-
-        # Format the message based on severity
-        lineNumber = str(lineNumber)
-        if severity == 'normal':
-            indicator = '[N]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message
-        elif severity == 'warning':
-            indicator = '[W]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message
-        elif severity == 'error':
-            indicator = '[X]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message        
-        elif severity == 'code-breaker':
-            indicator = '[!]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message
-            
-            if data['code'] == 2: # Response recieved but unsuccessful
-                details = '\n[ErrorDetailsStart]\n' + data['response'] + '\n[ErrorDetailsEnd]'
-                toWrite = toWrite + details
-            elif data['code'] == 3: # YAML loading error
-                details = '\n[ErrorDetailsStart]\n' + data['error'] + '\n[ErrorDetailsEnd]'
-                toWrite = toWrite + details
-        
-        # Write out the message
-        self.log.write(toWrite + '\n')
-        if self.verbose:
-            self.terminal.write(message + '\n')
-            self.terminal.flush()
-
-    def getCurrentTimestamp(self):
-        """
-        Simple function that calculates the current time stamp and simply formats it as a string and returns.
-        Mainly aimed for logging.
-
-        Returns
-        -------
-            - timestamp : str
-                A formatted string of current time
-        """
-        return datetime.now().strftime("%H:%M:%S.%f")[:-3]
-
-    def exceptionLogger(self, exctype, value, traceBack):
-        """
-        A simple printing function that will take place of the sys.excepthook function and print the results to the log instead of the console.
-
-        Parameters
-        ----------
-            - exctype : object
-                Exception type and details
-            - Value : str
-                The error passed while the exception was raised
-            - traceBack : traceback object
-                Contains information about the stack trace.
-        """
-        LOGGER.write('Exception Occured! Details follow below.\n')
-        LOGGER.write('Type:{}\n'.format(exctype))
-        LOGGER.write('Value:{}\n'.format(value))
-        LOGGER.write('Traceback:\n')
-        for i in traceback.format_list(traceback.extract_tb(traceBack)):
-            LOGGER.write(i)
-
-    def flush(self):
-        # This flush method is needed for python 3 compatibility.
-        # This handles the flush command by doing nothing.
-        # You might want to specify some extra behavior here.
-        pass
-
 class LoadingError(Exception):
     pass
 
@@ -755,7 +1261,7 @@ class UnauthorizedError(Exception):
 
 class SureDone:
     """ A driver class to manage connection and make requests to the Suredone API """
-    def __init__(self, user, api_token, timeout):
+    def __init__(self, user, api_token, timeout, connectTimeout=apiCommon.CONNECT_TIMEOUT, session=None, rateLimiter=None, retryPolicy=None):
         """
         Constructor function. Basically creates a header template for api calls.
 
@@ -765,8 +1271,23 @@ class SureDone:
                 User name for API
             - 'api_token' : str
                 Auth token provided by the API
+            - timeout : float
+                Seconds to wait for the API to send a response
+            - connectTimeout : float
+                Seconds to wait for a connection to the API to be established
+            - session : requests.Session
+                Session to make the requests on. The process-wide pooled session is used if not provided.
+            - rateLimiter : apiCommon.RateLimiter
+                Scheduler that paces the requests. The budget is learned from the response headers if not provided.
+            - retryPolicy : apiCommon.RetryPolicy
+                Decides which failed calls are sent again. The shared default policy is used if not provided.
         """
-        self.timeout = timeout
+        self.timeout = (connectTimeout, timeout)
+        self.session = session if session is not None else apiCommon.getSession()
+        if rateLimiter is None:
+            rateLimiter = apiCommon.getRateLimiter('suredone:' + user)
+        self.rateLimiter = rateLimiter
+        self.retryPolicy = retryPolicy if retryPolicy is not None else apiCommon.RETRY_POLICY
         self.api_endpoint = 'https://api.suredone.com/v1/'
         self.headers = {}
         self.headers['Content-Type'] = 'application/x-www-form-urlencoded'
@@ -774,7 +1295,7 @@ class SureDone:
         self.headers['x-auth-user'] = user
         self.headers['x-auth-token'] = api_token
     
-    def apicall(self, typ, endpoint, data=None):
+    def apicall(self, typ, endpoint, data=None, idempotent=None, label=None):
         """
         Function that will concatenate the intended endpoint with the main URL that
         goes to the Suredone API and initiate the request with the provided data.
@@ -792,111 +1313,82 @@ class SureDone:
                 Specific module of the API that needs to be called.
             - data : dict
                 The data that is meant to be sent in the API request in key-value dict format.
+            - idempotent : bool
+                Whether the call may be sent again after a failure. Decided from the type if not given.
+            - label : str
+                Name of the endpoint in the run metrics, for endpoints that carry a name or id.
+                The endpoint itself is used if not given.
         
         Returns
         -------
             - r : str
                 The JSON formatted response data after the request was made
         """
-        localFrame = inspect.currentframe()
+        import requests
         # Build url string by concatenating the main url with the sub module
         url = self.api_endpoint + endpoint
-        errorCount = 0
 
-        # Main loop
-        while True:
-            # 3 or more errors break the loop
-            if errorCount >= 3:
-                break
+        # apiCommon.runRequest paces, retries and records the call, only the sending is done here
+        def send():
+            # Invoke the corresponding api call based on the type
+            if typ == 'get':
+                return self.session.get(url, params=data, headers=self.headers, timeout=self.timeout)
+            elif typ == 'put':
+                return self.session.put(url, data=json.dumps(data), headers=self.headers, timeout=self.timeout)
+            elif typ == 'post':
+                return self.session.post(url, data=json.dumps(data), headers=self.headers, timeout=self.timeout)
+            elif typ == 'delete':
+                return self.session.delete(url, data=json.dumps(data), headers=self.headers, timeout=self.timeout)
+        resp = apiCommon.runRequest(send, typ, url, self.rateLimiter, self.retryPolicy, idempotent=idempotent, label=label or endpoint, logger=LOGGER)
+
+        if resp is None:
+            pass
+        # If the response code is 200 (Which means OK)
+        elif resp.status_code == requests.codes.ok:
+            # Try loading the response in json format
             try:
-                # Invoke the corresponding api call based on the type
-                if typ == 'get':
-                    resp = requests.get(url, params=data, headers=self.headers, timeout=self.timeout)
-                elif typ == 'put':
-                    resp = requests.put(url, data=json.dumps(data), headers=self.headers, timeout=self.timeout)
-                elif typ == 'post':
-                    resp = requests.post(url, data=json.dumps(data), headers=self.headers, timeout=self.timeout)
-                elif typ == 'delete':
-                    resp = requests.delete(url, data=json.dumps(data), headers=self.headers, timeout=self.timeout)
-            except requests.exceptions.RequestException as e:
-                # Error handling. Increment error counter and sleep for
-                # 15 seconds and try again if error was ocurred
-                temp = 'HTTP Error {} {} {} {}.'.format(typ, url, data, e) + '\nAttempt ' + str(errorCount)
-                LOGGER.writeLog(temp, localFrame.f_lineno, severity='error')
-                errorCount += 1
-                time.sleep(15)
-                continue
-
-            # If the response code is 200 (Which means OK)
-            if resp.status_code == requests.codes.ok:
-                # Try loading the response in json format
-                try:
-                    r = json.loads(resp.text)
-                except json.decoder.JSONDecodeError:
-                    # Error handling. Increment error counter and raise LoadingError
-                    # if the response was OK but data couldn't be read in JSON
-                    temp = 'JSONDecodeError Error ' + typ + ' ' + url + ' ' + data + "\n" + resp.text
-                    LOGGER.writeLog(temp, localFrame.f_lineno, severity='error')
-                    errorCount += 1
-                    # TODO: remove custom exceptions probably
-                    raise LoadingError
-                
-                # Return the JSON formatted data
-                return r
-            elif resp.status_code == 401:  # Unauthorized
-                # Error handling. Handle for unauthorized error.
-                LOGGER.writeLog(json.dumps(self.headers, indent=4), localFrame.f_lineno, severity='error')
-                raise UnauthorizedError
-            elif resp.status_code == 403:
-                try:
-                    # Try to load the data in JSON to get more information on error
-                    r = json.loads(resp.text)
-                except json.decoder.JSONDecodeError:
-                    # Error handling. Increment error counter and sleep for 15 seconds 
-                    # and try again if the 403 error couldn't also be decoded to JSON either.
-                    LOGGER.writeLog('API json.decoder 403 ' + resp.text, localFrame.f_lineno, severity='error')
-                    errorCount += 1
-                    time.sleep(15)
-                    continue
-                try:
-                    # If the message tells us that the account has been expired
-                    if r['message'] == 'The requested Account has expired.':
-                        print('The requested Account has expired.')
-                        raise LoadingError
-                except KeyError:
-                    # Error handling. Increment error counter and sleep for 15 seconds
-                    # and try again if r['message'] wasn't present in the response.
-                    LOGGER.writeLog('Api not message: 403 ' + resp.text + ' ' + data, localFrame.f_lineno, severity='error')
-                    errorCount += 1
-                    time.sleep(15)
-                    continue
-            # ?? TODO: Find out more
-            elif resp.status_code == 429:  # X-Rate-Limit-Time-Reset-Ms
-                time.sleep(40)
-                continue
-            # elif resp.status_code == 422:
-            #     error_count += 1
-            #     print(' Error 422', error_count,resp.status_code, typ, url, data)
-            #     print(resp.headers)
-            #
-            #     print(resp.text)
-            #     time.sleep(60)
-            #     continue
-            else:
-                errorCount += 1
-                temp = 'Error' + ' ' + errorCount + ' ' + resp.status_code + ' ' + typ + ' ' + url + ' ' + data + '\n' + resp.text
-                LOGGER.writeLog(temp, localFrame.f_lineno, severity='error')
-                time.sleep(10)
-                continue
-            break
+                r = json.loads(resp.text)
+            except json.decoder.JSONDecodeError:
+                # Error handling. Raise LoadingError
+                # if the response was OK but data couldn't be read in JSON
+                temp = 'JSONDecodeError Error {} {} {}\n{}'.format(typ, url, data, resp.text)
+                LOGGER.writeLog(temp, severity='error')
+                # TODO: remove custom exceptions probably
+                raise LoadingError
+        
+            # Return the JSON formatted data
+            return r
+        elif resp.status_code == 401:  # Unauthorized
+            # Error handling. Handle for unauthorized error.
+            LOGGER.writeLog(json.dumps(self.headers, indent=4), severity='error')
+            raise UnauthorizedError
+        elif resp.status_code == 403:
+            try:
+                # Try to load the data in JSON to get more information on error
+                r = json.loads(resp.text)
+            except json.decoder.JSONDecodeError:
+                LOGGER.writeLog('API json.decoder 403 ' + resp.text, severity='error')
+                r = {}
+            # If the message tells us that the account has been expired
+            if r.get('message') == 'The requested Account has expired.':
+                print('The requested Account has expired.')
+                raise LoadingError
+            # Any other 403 is not temporary either
+            LOGGER.writeLog('Api 403 {} {}'.format(resp.text, data), severity='error')
+        else:
+            # A status that is not retried, or that still failed after the retries
+            temp = 'Error {} {} {} {}\n{}'.format(resp.status_code, typ, url, data, resp.text)
+            LOGGER.writeLog(temp, severity='error')
         # TODO: logxx
-        temp = 'Error ' + str(errorCount) + ' ' + typ + ' ' + url + ' ' + data
-        LOGGER.writeLog(temp, localFrame.f_lineno, severity='error')
+        temp = 'Error {} {} {}'.format(typ, url, data)
+        LOGGER.writeLog(temp, severity='error')
         raise LoadingError
 
 def purge(dir, pattern, inclusive=True):
     """
     A simple function to remove everything within a directory and it's subdirectories if the file name mathces a specific pattern.
+    The run report saved next to each download goes with it.
+    Part files of ranged downloads (and their manifests) are only removed once they are too old to be resumed, see PART_MAX_AGE.
 
     Parameters
     ----------
@@ -912,19 +1404,22 @@ def purge(dir, pattern, inclusive=True):
         - count : int
             The number files that were removed by the function
     """
+    import re
     count = 0
     regexObj = re.compile(pattern)
     for root, dirs, files in os.walk(dir, topdown=False):
         for name in files:
             path = os.path.join(root, name)
             if bool(regexObj.search(path)) == bool(inclusive):
-                if path.endswith('.csv'):
+                if path.endswith(('.csv', '_report.json')) or (path.endswith(('.part', '.part.json')) and time.time() - os.path.getmtime(path) > PART_MAX_AGE):
                     os.remove(path)
                     count += 1
     return count
 
 # Determine log file path
-LOGGER = Logger(verbose=False)
+LOGGER = apiCommon.Logger('suredone_download', verbose=False)
+
+IMPORT_TIME = (time.perf_counter() - IMPORT_START) * 1000
 
 if __name__ == "__main__":
     sys.stdout = LOGGER
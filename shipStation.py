@@ -21,14 +21,43 @@ HELP_MESSAGE = """Usage:
 Parameters/Options:
     - TODO: Update as the file is scripted more
     -h  | --help            : View usage help and examples
+    -V  | --version         : Show the version and how long the script took to import
     -f  | --file            : Path to the configuration file containing API keys
+        |                       - A list of accounts (name, api-key, api-secret) under "accounts:" is downloaded
+        |                         in parallel worker processes, into one directory per account name, with a merged
+        |                         summary in shipstation_accounts.json
         |                       - Default in %APPDATA%/local/shipstation.yaml on Windows
         |                       - Default in $HOME/shipstation.yaml on Linux
     -o  | --output          : Path tothe directory where the output of this script needs to be saved
         |                       - Default in %USERPROFILE%/Downloads/shipstation.json
         |                       - Default in $HOME/downloads//shipstation.json
         |                       - TODO: These defaults are subject to change
+    -t  | --format          : Format the orders are saved in
+        |                       - json (default): shipstation.json
+        |                       - ndjson: shipstation.ndjson, one order per line, written as the pages arrive
+        |                       - sqlite: shipstation.db, indexed on orderStatus, orderDate, storeId, customer email and item SKU
+        |                       - parquet: shipstation_orders.parquet, shipstation_items.parquet and shipstation_addresses.parquet,
+        |                         typed columnar tables written in row groups as the pages arrive (requires pyarrow).
+        |                         Incremental runs download all orders with this format.
+    -i  | --incremental     : Only download the orders modified since the last run and merge them into the previous output
+        |                       - The last seen modifyDate is kept in shipstation_state.json next to the output
     -v  | --verbose         : Show outputs in terminal as well as log file
+        | --async           : Make the api calls from a single asyncio event loop (requires aiohttp)
+    -w  | --watch           : Keep running and poll for modified orders every SECONDS seconds, e.g. -w 30
+        |                       - SECONDS is required, a value that is not a positive number falls back to 30
+        |                       - The client, session and orders stay in memory between polls
+        |                       - New, modified and removed orders are appended to shipstation_changes.ndjson
+        |                       - The output and state are saved after every poll that found changes
+        |                       - Stops cleanly on SIGINT/SIGTERM
+        | --webhook         : Receive ShipStation webhooks (ORDER_NOTIFY, SHIP_NOTIFY) on the given port instead of polling
+        |                       - Listens on 127.0.0.1, put it behind the public https endpoint the webhooks are sent to
+        |                       - Repeats of the same resource_url within a minute are fetched once
+        |                       - The fetched orders and shipments are appended to shipstation_changes.ndjson
+        |                       - Stops cleanly on SIGINT/SIGTERM
+        | --simulate-webhook: Post a sample ORDER_NOTIFY burst to the given receiver url and exit
+        | --invalidate-cache: Drop the cached reference data of the given endpoint (e.g. /carriers) or of all of them (all) and exit
+        |                       - Stores, warehouses and carriers are cached in $HOME/.shipstation_cache.db for hours,
+        |                         then revalidated with the server
 
 Example:
     $ python3 shipstation.py
@@ -41,56 +70,545 @@ Example:
 
     $ python3 shipstation.py -f [shipstation.yaml] -o [Docs/] -v
     $ python3 shipstation.py -file [shipstation.yaml] --output_file [Docs/] --verbose
+
+    $ python3 shipstation.py -f [shipstation.yaml] --async
+
+    $ python3 shipstation.py -f [shipstation.yaml] -o [Docs/] -t sqlite
+    $ python3 shipstation.py -f [shipstation.yaml] -o [Docs/] -i
+    $ python3 shipstation.py -file [shipstation.yaml] --output_file [Docs/] --incremental
 """
+import time
+IMPORT_START = time.perf_counter()
 import sys
 import os
 import getopt
-import platform
-import requests
 import base64
-import yaml
+import apiCommon
 import json
-import pandas as pd
-import re
-import time
-import inspect
 import traceback
+import threading
 from os.path import expanduser
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import deque
+# Heavier modules (yaml, requests, sqlite3, asyncio, aiohttp, concurrent.futures) are
+# imported where they are used so that the cron calls that don't need them start fast.
 
 currentMilliTime = lambda: int(round(time.time() * 1000))
-PYTHON_VERSION = float(sys.version[:sys.version.index(' ')-2])
+PYTHON_VERSION = sys.version_info[:2]
+VERSION = '0.0.5'
+# Milliseconds this module and apiCommon may take to import, reported by --version
+STARTUP_BUDGET = 100
 # Time tracking variables
 RUN_TIME = currentMilliTime()
 START_TIME = datetime.now()
+# ShipStation allows 40 requests per minute per api key
+RATE_LIMIT = 40
+RATE_LIMIT_WINDOW = 60
+# Minutes subtracted from the modifyDate watermark on incremental runs
+SYNC_OVERLAP_MINUTES = 5
+# Output file name for each output format
+OUTPUT_FILES = {'json': 'shipstation.json', 'ndjson': 'shipstation.ndjson', 'sqlite': 'shipstation.db', 'parquet': 'shipstation_orders.parquet'}
+# Tables of the parquet format, the orders table is the one in OUTPUT_FILES
+PARQUET_FILES = {'orders': 'shipstation_orders.parquet', 'items': 'shipstation_items.parquet', 'addresses': 'shipstation_addresses.parquet'}
+# Orders buffered before they are written to the parquet files as one row group
+PARQUET_ROW_GROUP_SIZE = 50000
+# Filters that don't narrow a result beyond its status, so orders missing from it can be dropped from the store
+PRUNE_FILTERS = ('orderStatus', 'pageSize', 'sortBy', 'sortDir')
+# Changes found by the watch mode and the webhook receiver, one json event per line
+CHANGES_FILE = 'shipstation_changes.ndjson'
+CHANGES_LOCK = threading.Lock()
+# Seconds between polls of the watch mode
+WATCH_INTERVAL = 30
+# Longest wait between polls that keep failing
+WATCH_BACKOFF_CAP = 300
+# Label creation: completed and attempted labels are journaled here, in the label directory
+LABEL_JOURNAL_FILE = 'shipstation_labels.journal'
+LABEL_CHUNK_SIZE = 64 * 1024
+# Webhook receiver: address it listens on, resource urls it accepts, api calls made at the same time,
+# and seconds a resource_url is remembered so that repeated notifications are fetched once
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_API_HOST = 'ssapi.shipstation.com'
+WEBHOOK_WORKERS = 4
+WEBHOOK_DEDUPE_SECONDS = 60
+# Run report of the api calls, see apiCommon.RequestMetrics
+REPORT_FILE = 'shipstation_report.json'
+# Reference data changes rarely: seconds its responses are served from the cache, by endpoint
+CACHE_TTLS = {'/stores': 6 * 3600, '/warehouses': 6 * 3600, '/carriers': 24 * 3600}
+CACHE_PATH = os.path.join(expanduser('~'), '.shipstation_cache.db')
+CACHE_MAX_SIZE = 32 * 1024 * 1024
+# Several accounts: most accounts downloaded at the same time, and the merged summary
+ACCOUNT_PROCESSES = 8
+ACCOUNTS_REPORT_FILE = 'shipstation_accounts.json'
 
-def main(argv):
-    localFrame = inspect.currentframe()
+ORDER_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    orderId INTEGER PRIMARY KEY,
+    orderNumber TEXT,
+    orderKey TEXT,
+    orderStatus TEXT,
+    orderDate TEXT,
+    modifyDate TEXT,
+    storeId INTEGER,
+    customerEmail TEXT COLLATE NOCASE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS order_items (
+    orderId INTEGER NOT NULL,
+    orderItemId INTEGER,
+    sku TEXT,
+    name TEXT,
+    quantity INTEGER,
+    unitPrice REAL
+);
+CREATE INDEX IF NOT EXISTS orders_orderStatus ON orders (orderStatus);
+CREATE INDEX IF NOT EXISTS orders_orderDate ON orders (orderDate);
+CREATE INDEX IF NOT EXISTS orders_storeId ON orders (storeId);
+CREATE INDEX IF NOT EXISTS orders_customerEmail ON orders (customerEmail);
+CREATE INDEX IF NOT EXISTS order_items_orderId ON order_items (orderId);
+CREATE INDEX IF NOT EXISTS order_items_sku ON order_items (sku);
+"""
 
+# Columns of the flat order, item and address tables: (column, path of the value in the order/item/address, type).
+# Dates are parsed into timestamps, the type names are mapped to arrow types by getArrowType.
+ORDER_COLUMNS = (
+    ('orderId', ('orderId',), 'int64'),
+    ('orderNumber', ('orderNumber',), 'string'),
+    ('orderKey', ('orderKey',), 'string'),
+    ('orderDate', ('orderDate',), 'timestamp'),
+    ('createDate', ('createDate',), 'timestamp'),
+    ('modifyDate', ('modifyDate',), 'timestamp'),
+    ('paymentDate', ('paymentDate',), 'timestamp'),
+    ('shipByDate', ('shipByDate',), 'timestamp'),
+    ('orderStatus', ('orderStatus',), 'string'),
+    ('customerId', ('customerId',), 'int64'),
+    ('customerUsername', ('customerUsername',), 'string'),
+    ('customerEmail', ('customerEmail',), 'string'),
+    ('orderTotal', ('orderTotal',), 'float64'),
+    ('amountPaid', ('amountPaid',), 'float64'),
+    ('taxAmount', ('taxAmount',), 'float64'),
+    ('shippingAmount', ('shippingAmount',), 'float64'),
+    ('customerNotes', ('customerNotes',), 'string'),
+    ('internalNotes', ('internalNotes',), 'string'),
+    ('gift', ('gift',), 'bool'),
+    ('giftMessage', ('giftMessage',), 'string'),
+    ('paymentMethod', ('paymentMethod',), 'string'),
+    ('requestedShippingService', ('requestedShippingService',), 'string'),
+    ('carrierCode', ('carrierCode',), 'string'),
+    ('serviceCode', ('serviceCode',), 'string'),
+    ('packageCode', ('packageCode',), 'string'),
+    ('confirmation', ('confirmation',), 'string'),
+    ('shipDate', ('shipDate',), 'string'),
+    ('holdUntilDate', ('holdUntilDate',), 'string'),
+    ('weightValue', ('weight', 'value'), 'float64'),
+    ('weightUnits', ('weight', 'units'), 'string'),
+    ('dimensionsLength', ('dimensions', 'length'), 'float64'),
+    ('dimensionsWidth', ('dimensions', 'width'), 'float64'),
+    ('dimensionsHeight', ('dimensions', 'height'), 'float64'),
+    ('dimensionsUnits', ('dimensions', 'units'), 'string'),
+    ('storeId', ('advancedOptions', 'storeId'), 'int64'),
+    ('warehouseId', ('advancedOptions', 'warehouseId'), 'int64'),
+    ('source', ('advancedOptions', 'source'), 'string'),
+    ('userId', ('userId',), 'string'),
+    ('externallyFulfilled', ('externallyFulfilled',), 'bool'),
+)
+# Line items also get the orderId of their order as the first column
+ITEM_COLUMNS = (
+    ('orderItemId', ('orderItemId',), 'int64'),
+    ('lineItemKey', ('lineItemKey',), 'string'),
+    ('sku', ('sku',), 'string'),
+    ('name', ('name',), 'string'),
+    ('imageUrl', ('imageUrl',), 'string'),
+    ('weightValue', ('weight', 'value'), 'float64'),
+    ('weightUnits', ('weight', 'units'), 'string'),
+    ('quantity', ('quantity',), 'int64'),
+    ('unitPrice', ('unitPrice',), 'float64'),
+    ('taxAmount', ('taxAmount',), 'float64'),
+    ('shippingAmount', ('shippingAmount',), 'float64'),
+    ('warehouseLocation', ('warehouseLocation',), 'string'),
+    ('productId', ('productId',), 'int64'),
+    ('fulfillmentSku', ('fulfillmentSku',), 'string'),
+    ('adjustment', ('adjustment',), 'bool'),
+    ('upc', ('upc',), 'string'),
+    ('createDate', ('createDate',), 'timestamp'),
+    ('modifyDate', ('modifyDate',), 'timestamp'),
+)
+# Addresses also get the orderId and the address type (shipTo or billTo) as the first columns
+ADDRESS_TYPES = ('shipTo', 'billTo')
+ADDRESS_COLUMNS = (
+    ('name', ('name',), 'string'),
+    ('company', ('company',), 'string'),
+    ('street1', ('street1',), 'string'),
+    ('street2', ('street2',), 'string'),
+    ('street3', ('street3',), 'string'),
+    ('city', ('city',), 'string'),
+    ('state', ('state',), 'string'),
+    ('postalCode', ('postalCode',), 'string'),
+    ('country', ('country',), 'string'),
+    ('phone', ('phone',), 'string'),
+    ('residential', ('residential',), 'bool'),
+    ('addressVerified', ('addressVerified',), 'string'),
+)
+# Every table with its full list of columns
+TABLE_COLUMNS = {
+    'orders': ORDER_COLUMNS,
+    'items': (('orderId', None, 'int64'),) + ITEM_COLUMNS,
+    'addresses': (('orderId', None, 'int64'), ('type', None, 'string')) + ADDRESS_COLUMNS,
+}
+# pandas dtypes of the type names, nullable so missing values don't change the dtype of a column
+PANDAS_TYPES = {'int64': 'Int64', 'float64': 'float64', 'bool': 'boolean', 'string': 'string'}
+
+def main(argv):
     # Parse arguments
     # When verbose argument is added, change the verbose of the logger based on the argument as well
-    configPath, outputDIRPath, verbose = parseArgs(argv)
+    configPath, outputDIRPath, verbose, useAsync, incremental, outputFormat, watchInterval, webhookPort = parseArgs(argv)
 
     # Check if python version is 3.5 or higher
-    if not PYTHON_VERSION >= 3.5:
-        LOGGER.writeLog("Must use Python version 3.5 or higher!", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+    if not PYTHON_VERSION >= (3, 5):
+        LOGGER.writeLog("Must use Python version 3.5 or higher!", severity='code-breaker', data={'code':1})
         exit()
     
-    LOGGER.writeLog("Shipstation order automation initalized.", localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Configurations path: {}.".format(configPath), localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Download path: {}.".format(outputDIRPath), localFrame.f_lineno, severity='normal')
-    LOGGER.writeLog("Verbose: {}.\n".format(verbose), localFrame.f_lineno, severity='normal')
+    LOGGER.writeLog("Shipstation order automation initalized.", severity='normal')
+    LOGGER.writeLog("Configurations path: {}.".format(configPath), severity='normal')
+    LOGGER.writeLog("Download path: {}.".format(outputDIRPath), severity='normal')
+    LOGGER.writeLog("Output format: {}.".format(outputFormat), severity='normal')
+    LOGGER.writeLog("Async: {}.".format(useAsync), severity='normal')
+    LOGGER.writeLog("Incremental: {}.".format(incremental), severity='normal')
+    LOGGER.writeLog("Watch interval: {}.".format(watchInterval), severity='normal')
+    LOGGER.writeLog("Webhook port: {}.".format(webhookPort), severity='normal')
+    LOGGER.writeLog("Verbose: {}.\n".format(verbose), severity='normal')
+
+    # Get the accounts to download, most configurations have a single one
+    accounts = loadAccounts(configPath)
+    if len(accounts) > 1:
+        if webhookPort is not None or watchInterval is not None:
+            LOGGER.writeLog("The watch and webhook modes handle a single account, configure one account per instance.", severity='code-breaker', data={'code':1})
+            exit()
+        runAccounts(accounts, outputDIRPath, outputFormat, incremental=incremental, useAsync=useAsync, verbose=verbose)
+        return
+    authString = accounts[0][1]
 
-    # Get authentication string
-    authString = loadConfig(configPath)
+    # The webhook receiver and the watch mode keep running until they are stopped by a signal
+    if webhookPort is not None:
+        receiveWebhooks(authString, outputDIRPath, webhookPort)
+        return
+    if watchInterval is not None:
+        watchOrders(authString, outputDIRPath, outputFormat, watchInterval, useAsync=useAsync)
+        return
+    downloadOrders(authString, outputDIRPath, outputFormat, incremental=incremental, useAsync=useAsync)
+
+def downloadOrders(authString, outputDIRPath, outputFormat, incremental=False, useAsync=False):
+    """
+    Function that downloads the orders of an account once, saves them in the given output format
+    and writes the report of the api calls that were made.
 
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - outputDIRPath : str
+            Directory the output is saved in
+        - outputFormat : str
+            One of OUTPUT_FILES
+        - incremental : bool
+            Only download the orders modified since the last run
+        - useAsync : bool
+            Make the api calls with the asyncio client instead of threads
+    Returns
+    -------
+        - orderCount : int
+            Number of orders saved
+        - report : dict
+            Report of the api calls, see apiCommon.RequestMetrics.getReport
+    """
     # Make the api call to list all the orders with "awaiting_shipment" order status
-    ordersList = listOrders(authString)
+    outputPath = os.path.join(outputDIRPath, OUTPUT_FILES[outputFormat])
+    statePath = os.path.join(outputDIRPath, 'shipstation_state.json')
+    writer = None
+    if outputFormat == 'ndjson':
+        writer = NDJSONWriter(outputPath)
+    elif outputFormat == 'parquet':
+        writer = ParquetWriter(outputDIRPath)
+    try:
+        if incremental:
+            state = loadSyncState(statePath)
+            snapshot = loadPreviousOrders(outputPath, outputFormat) if state else None
+            ordersList, state = syncOrders(authString, snapshot, state, useAsync=useAsync)
+        # NDJSON and parquet output is written page by page as the pages arrive
+        elif useAsync:
+            import asyncio
+            ordersList = asyncio.run(listOrdersAsync(authString, onPage=writer.write if writer else None))
+        else:
+            ordersList = listOrders(authString, onPage=writer.write if writer else None)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
     
     # Let's just save for now
-    with open(os.path.join(outputDIRPath, 'shipstation.json'), 'w') as f:
-        json.dump(ordersList, f, indent=3)
-    LOGGER.writeLog("Saved file in {}".format(os.path.join(outputDIRPath, 'shipstation.json'), 'w'), localFrame.f_lineno, severity='normal')
+    if writer is not None:
+        if incremental:
+            writer.write(ordersList['orders'])
+        writer.close()
+    else:
+        saveOrders(ordersList, outputDIRPath, outputFormat)
+    if incremental:
+        saveSyncState(statePath, state)
+    LOGGER.writeLog("Saved file in {}".format(outputPath), severity='normal')
+
+    # Machine readable summary of every api call of the run
+    reportPath = os.path.join(outputDIRPath, REPORT_FILE)
+    report = apiCommon.METRICS.writeReport(reportPath)
+    LOGGER.writeLog("{} api requests ({} per minute), throttled for {} seconds. Run report saved to {}.".format(
+        report['requests'], report['requestsPerMinute'], report['throttled'], reportPath), severity='normal')
+    # The orders written page by page are not kept, their total is
+    return len(ordersList['orders']) or ordersList.get('total') or 0, report
+
+def saveOrders(ordersList, outputDIRPath, outputFormat, filters={'orderStatus':'awaiting_shipment'}):
+    """
+    Function that saves a complete list of orders in the given output format.
+
+    Parameters
+    ----------
+        - ordersList : json
+            Orders in the layout listOrders returns
+        - outputDIRPath : str
+            Directory the output is saved in
+        - outputFormat : str
+            One of OUTPUT_FILES
+        - filters : dict
+            Filters the orders were listed with, the sqlite store drops the saved orders that no longer match them
+    """
+    outputPath = os.path.join(outputDIRPath, OUTPUT_FILES[outputFormat])
+    if outputFormat in ('ndjson', 'parquet'):
+        writer = NDJSONWriter(outputPath) if outputFormat == 'ndjson' else ParquetWriter(outputDIRPath)
+        writer.write(ordersList['orders'])
+        writer.close()
+    elif outputFormat == 'sqlite':
+        store = OrderStore(outputPath)
+        store.upsertOrders(ordersList['orders'])
+        # Orders that left the filtered status are not part of the result anymore.
+        # A result narrowed by any other filter doesn't tell which orders are gone, nothing is dropped then.
+        if not set(filters) - set(PRUNE_FILTERS):
+            store.pruneOrders(filters.get('orderStatus'), [order['orderId'] for order in ordersList['orders']])
+        store.close()
+    else:
+        with open(outputPath, 'w') as f:
+            json.dump(ordersList, f, indent=3)
+
+def watchOrders(authString, outputDIRPath, outputFormat, interval, useAsync=False, filters={'orderStatus':'awaiting_shipment'}):
+    """
+    Function that runs as a daemon: polls for modified orders every interval seconds and
+    appends the orders that changed to CHANGES_FILE. The api client, its session and the orders
+    stay in memory between polls, so a poll only costs the incremental request.
+    Returns once SIGINT or SIGTERM is received, after the poll in progress is saved.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - outputDIRPath : str
+            Directory the output, state and changes are saved in
+        - outputFormat : str
+            One of OUTPUT_FILES
+        - interval : float
+            Seconds from the start of one poll to the start of the next
+        - useAsync : bool
+            Use the asyncio client for the api calls. Its session is not kept between polls.
+        - filters : dict
+            Filters that define which orders are watched
+    """
+    stop = getStopEvent()
+    outputPath = os.path.join(outputDIRPath, OUTPUT_FILES[outputFormat])
+    statePath = os.path.join(outputDIRPath, 'shipstation_state.json')
+    changesPath = os.path.join(outputDIRPath, CHANGES_FILE)
+    client = None if useAsync else ShipStation(authString)
+
+    # Start from the output of the previous run, if there is one
+    state = loadSyncState(statePath)
+    snapshot = loadPreviousOrders(outputPath, outputFormat) if state else None
+    LOGGER.writeLog("Watching orders every {} seconds.".format(interval), severity='normal')
+    failures = 0
+    while not stop.is_set():
+        pollStart = time.monotonic()
+        delay = interval
+        try:
+            ordersList, newState = syncOrders(authString, snapshot, state, filters=filters, useAsync=useAsync, client=client)
+            changed, removed = diffOrders(snapshot or [], ordersList['orders'])
+            if changed or removed or snapshot is None:
+                emitChanges(changesPath, changed, removed)
+                saveOrders(ordersList, outputDIRPath, outputFormat, filters=filters)
+                LOGGER.writeLog("{} orders changed, {} removed, {} orders watched.".format(len(changed), len(removed), len(ordersList['orders'])), severity='normal')
+            saveSyncState(statePath, newState)
+            snapshot, state = ordersList['orders'], newState
+            failures = 0
+        except Exception:
+            # Whatever failed (api, bad response, disk), the daemon keeps running and polls again later.
+            # Polls that keep failing are spaced further apart, up to WATCH_BACKOFF_CAP.
+            failures += 1
+            delay = max(interval, min(interval * 2 ** (failures - 1), WATCH_BACKOFF_CAP))
+            LOGGER.writeLog("Poll failed, trying again in {} seconds.\n{}".format(delay, traceback.format_exc()), severity='error')
+        stop.wait(max(0.0, delay - (time.monotonic() - pollStart)))
+    LOGGER.writeLog("Stop signal received, watch stopped.", severity='normal')
+
+def getStopEvent():
+    """
+    Function that makes SIGINT and SIGTERM set an event instead of interrupting the script,
+    so the long running modes can finish what they are doing and save before they return.
+
+    Returns
+    -------
+        - stop : threading.Event
+            Set once a stop signal is received
+    """
+    import signal
+    stop = threading.Event()
+    def requestStop(signum, frame):
+        # Only the event is set here: logging could deadlock on the queue put the signal interrupted
+        stop.set()
+    for signalName in ('SIGINT', 'SIGTERM'):
+        if hasattr(signal, signalName):
+            signal.signal(getattr(signal, signalName), requestStop)
+    return stop
+
+def diffOrders(previous, current):
+    """
+    Function that compares two lists of orders by orderId and modifyDate.
+
+    Parameters
+    ----------
+        - previous : list
+            Orders of the previous poll
+        - current : list
+            Orders of this poll
+    Returns
+    -------
+        - changed : list
+            Orders that are new or have another modifyDate than before
+        - removed : list
+            orderIds of the orders that are not in current anymore
+    """
+    previousDates = {order['orderId']: order.get('modifyDate') for order in previous}
+    changed = [order for order in current if order['orderId'] not in previousDates or previousDates[order['orderId']] != order.get('modifyDate')]
+    currentIds = set(order['orderId'] for order in current)
+    removed = [orderId for orderId in previousDates if orderId not in currentIds]
+    return changed, removed
+
+def emitChanges(changesPath, changed, removed):
+    """
+    Function that appends the changes of a watch poll to the changes file, one json event per line:
+    {"event": "changed", "order": {...}} or {"event": "removed", "orderId": ...}
+
+    Parameters
+    ----------
+        - changesPath : str
+            Path to the changes file
+        - changed : list
+            Orders that are new or modified
+        - removed : list
+            orderIds of the orders that left the watched filters
+    """
+    events = [{'event': 'changed', 'order': order} for order in changed]
+    events.extend({'event': 'removed', 'orderId': orderId} for orderId in removed)
+    appendEvents(changesPath, events)
+
+def appendEvents(changesPath, events):
+    """
+    Function that appends json events to the changes file, one per line, and syncs it to disk.
+
+    Parameters
+    ----------
+        - changesPath : str
+            Path to the changes file
+        - events : list
+            Events to append
+    """
+    with CHANGES_LOCK:
+        with open(changesPath, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(event, separators=(',', ':')) + '\n' for event in events)
+            f.flush()
+            os.fsync(f.fileno())
+
+def receiveWebhooks(authString, outputDIRPath, port, host=WEBHOOK_HOST):
+    """
+    Function that runs the webhook receiver until SIGINT or SIGTERM is received.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig, used to fetch the resources
+        - outputDIRPath : str
+            Directory the changes file is saved in
+        - port : int
+            Port to listen on
+        - host : str
+            Address to listen on
+    """
+    stop = getStopEvent()
+    receiver = WebhookReceiver(authString, os.path.join(outputDIRPath, CHANGES_FILE))
+    receiver.start(host, port)
+    LOGGER.writeLog("Receiving webhooks on http://{}:{}.".format(host, port), severity='normal')
+    while not stop.wait(1):
+        pass
+    LOGGER.writeLog("Stop signal received, stopping.", severity='normal')
+    receiver.stop()
+    LOGGER.writeLog("Webhook receiver stopped.", severity='normal')
+
+def fetchResource(client, resourceUrl):
+    """
+    Function that fetches the batch a webhook points to, with all its pages.
+
+    Parameters
+    ----------
+        - client : ShipStation object
+            Api handler to make the calls with
+        - resourceUrl : str
+            The resource_url of the webhook, e.g. https://ssapi.shipstation.com/orders?importBatch=...
+    Returns
+    -------
+        - key : str
+            'orders' or 'shipments', depending on the resource
+        - records : list
+            The orders or shipments of the batch
+    """
+    from urllib.parse import urlsplit, urlunsplit, parse_qsl
+    parts = urlsplit(resourceUrl)
+    url = urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+    params = dict(parse_qsl(parts.query))
+    key = 'shipments' if parts.path.rstrip('/').endswith('shipments') else 'orders'
+    records = []
+    page = int(params.get('page', 1))
+    while True:
+        params['page'] = page
+        jsonData = client.apicall('get', url, params=params)
+        records.extend(jsonData.get(key) or [])
+        if page >= (jsonData.get('pages') or 1):
+            break
+        page += 1
+    return key, records
+
+def simulateWebhook(receiverURL, resourceURL='https://ssapi.shipstation.com/orders?importBatch=simulated', resourceType='ORDER_NOTIFY', burst=3):
+    """
+    Function that posts a burst of identical webhooks to a receiver, the way ShipStation may repeat a notification.
+
+    Parameters
+    ----------
+        - receiverURL : str
+            Url of the webhook receiver
+        - resourceURL : str
+            resource_url to send
+        - resourceType : str
+            ORDER_NOTIFY or SHIP_NOTIFY
+        - burst : int
+            Number of times the webhook is posted
+    """
+    import requests
+    payload = {'resource_url': resourceURL, 'resource_type': resourceType}
+    for attempt in range(burst):
+        try:
+            response = apiCommon.getSession().post(receiverURL, json=payload, timeout=(apiCommon.CONNECT_TIMEOUT, apiCommon.READ_TIMEOUT))
+            LOGGER.terminal.write("{} {}: {}\n".format(resourceType, attempt + 1, response.status_code))
+        except requests.exceptions.RequestException as e:
+            LOGGER.terminal.write("{} {}: {}\n".format(resourceType, attempt + 1, e))
 
 def loadConfig (configPath):
     """
@@ -104,77 +622,992 @@ def loadConfig (configPath):
     Returns
     -------
         - authString : str
-            API key and API Secret for shipstation account merged and processed to form the stardardized authentication string that will be used during api calls
+            API key and API Secret for shipstation account merged and processed to form the stardardized authentication string that will be used during api calls.
+            The first account's if the file lists several accounts.
+    """
+    return loadAccounts(configPath)[0][1]
+
+def loadAccounts(configPath):
+    """
+    Function that parses the configuration file and reads the accounts in it.
+    The file either holds a single api-key/api-secret pair, or a list of accounts:
+
+        accounts:
+          - name: store-a
+            api-key: ...
+            api-secret: ...
+
+    Parameters
+    ----------
+        - configPath : str
+            Path to the configuration file
+    
+    Returns
+    -------
+        - accounts : list
+            (name, authString) of every account, the name is 'default' for a single pair
     """
-    localFrame = inspect.currentframe()
+    import yaml
     # Loading configurations
     with open(configPath, 'r') as stream:
         try:
             config = yaml.safe_load(stream)
         except yaml.YAMLError as exc:
-            LOGGER.writeLog("Error while loading YAML.", localFrame.f_lineno, severity='code-breaker', data={'code':3, 'error':exc})
+            LOGGER.writeLog("Error while loading YAML.", severity='code-breaker', data={'code':3, 'error':exc})
+            exit()
     
     # Try to read the user and api_token from suredone_api set in the settings
     # Print error that the settings weren't found and exit
     try:
-        apiKey = config['api-key']
-        apiSecret = config['api-secret']
-    except KeyError as exc:
-        LOGGER.writeLog("Not found user or token in config file.", localFrame.f_lineno, severity='code-breaker', data={'code':3, 'error':exc})
+        if 'accounts' not in config:
+            return [('default', getAuthString(config['api-key'], config['api-secret']))]
+        accounts = [(str(account['name']), getAuthString(account['api-key'], account['api-secret'])) for account in config['accounts']]
+    except (KeyError, TypeError) as exc:
+        LOGGER.writeLog("Not found user or token in config file.", severity='code-breaker', data={'code':3, 'error':exc})
         exit()
     
-    # Pre-process the apiKey and apiSecret to form the authString
+    # The names are used as the output directories of the accounts
+    names = [name for name, _ in accounts]
+    if not accounts or len(set(names)) < len(names) or any(not name or name in ('.', '..') or os.sep in name or '/' in name for name in names):
+        LOGGER.writeLog("The accounts in the config file need unique names that can be used as directory names.", severity='code-breaker', data={'code':3})
+        exit()
+    return accounts
+
+def getAuthString(apiKey, apiSecret):
+    """
+    Function that merges the API key and API secret of an account into the basic authentication
+    string that is sent with the api calls.
+    """
     authString = "{}:{}".format(apiKey, apiSecret)
     authString = base64.b64encode(authString.encode('utf-8'))
     authString = "Basic {}".format(str(authString, 'utf-8'))
     return authString
 
-def listOrders(authString, filters={'orderStatus':'awaiting_shipment'}, url="https://ssapi.shipstation.com/orders"):
+def runAccounts(accounts, outputDIRPath, outputFormat, incremental=False, useAsync=False, verbose=False, maxProcesses=ACCOUNT_PROCESSES):
+    """
+    Function that downloads the orders of several accounts in parallel, one worker process per account.
+    Every account gets its own rate limit budget and its own output directory (outputDIRPath/<name>),
+    so the run takes about as long as the slowest account. A merged summary of all accounts is saved
+    as ACCOUNTS_REPORT_FILE in outputDIRPath.
+
+    Parameters
+    ----------
+        - accounts : list
+            (name, authString) of the accounts, see loadAccounts
+        - outputDIRPath : str
+            Directory the account directories are created in
+        - outputFormat : str
+            One of OUTPUT_FILES
+        - incremental : bool
+            Only download the orders modified since the last run of each account
+        - useAsync : bool
+            Make the api calls with the asyncio client instead of threads
+        - verbose : bool
+            Show the logs of the workers in the terminal as well
+        - maxProcesses : int
+            Most accounts downloaded at the same time
+    Returns
+    -------
+        - summary : dict
+            The merged summary: started, duration, orders, requests, throttled, failed and one entry per account
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    startTime = time.time()
+    results = {}
+    if not os.path.exists(outputDIRPath):
+        os.makedirs(outputDIRPath)
+    # Spawned workers start from a clean interpreter instead of a copy of this one, with its logger thread and open connections
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, min(maxProcesses, len(accounts))), mp_context=context) as executor:
+        futures = {executor.submit(runAccount, name, authString, os.path.join(outputDIRPath, name), outputFormat, incremental, useAsync, verbose): name
+                   for name, authString in accounts}
+        for future in futures:
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                # The worker process itself died
+                results[name] = {'account': name, 'error': repr(e)}
+            result = results[name]
+            if result.get('error'):
+                LOGGER.writeLog("Account {} failed: {}".format(name, result['error']), severity='error')
+            else:
+                LOGGER.writeLog("Account {}: {} orders, {} api requests, throttled for {} seconds, {} seconds.".format(
+                    name, result['orders'], result['requests'], result['throttled'], result['duration']), severity='normal')
+
+    summary = {
+        'started': datetime.fromtimestamp(startTime).isoformat(timespec='seconds'),
+        'duration': round(time.time() - startTime, 3),
+        'orders': sum(result.get('orders', 0) for result in results.values()),
+        'requests': sum(result.get('requests', 0) for result in results.values()),
+        'throttled': round(sum(result.get('throttled', 0) for result in results.values()), 3),
+        'failed': [name for name, result in results.items() if result.get('error')],
+        'accounts': [results[name] for name, _ in accounts],
+    }
+    summaryPath = os.path.join(outputDIRPath, ACCOUNTS_REPORT_FILE)
+    tempPath = summaryPath + '.tmp'
+    with open(tempPath, 'w') as f:
+        json.dump(summary, f, indent=3)
+    os.replace(tempPath, summaryPath)
+    LOGGER.writeLog("{} accounts, {} orders in {} seconds, {} failed. Summary saved to {}.".format(
+        len(accounts), summary['orders'], summary['duration'], len(summary['failed']), summaryPath), severity='normal')
+    return summary
+
+def runAccount(name, authString, outputDIRPath, outputFormat, incremental=False, useAsync=False, verbose=False):
+    """
+    Function that runs in a worker process of runAccounts and downloads the orders of one account.
+
+    Returns
+    -------
+        - result : dict
+            account, outputDIRPath, orders, requests, requestsPerMinute, throttled and duration,
+            or account and error if the download failed
+    """
+    startTime = time.time()
+    LOGGER.verbose = verbose
+    LOGGER.prefix = 'shipstation_{}'.format(name)
+    try:
+        if not os.path.exists(outputDIRPath):
+            os.makedirs(outputDIRPath)
+        orderCount, report = downloadOrders(authString, outputDIRPath, outputFormat, incremental=incremental, useAsync=useAsync)
+        return {'account': name, 'outputDIRPath': outputDIRPath, 'orders': orderCount, 'requests': report['requests'],
+                'requestsPerMinute': report['requestsPerMinute'], 'throttled': report['throttled'], 'duration': round(time.time() - startTime, 3)}
+    except BaseException as e:
+        # Code-breaker errors exit, the other accounts carry on
+        LOGGER.writeLog("Download of account {} failed.".format(name), severity='error', data={'error': repr(e)})
+        return {'account': name, 'error': repr(e) if not isinstance(e, SystemExit) else 'Stopped, see the log of the account', 'duration': round(time.time() - startTime, 3)}
+    finally:
+        LOGGER.flush()
+
+def loadReferenceData(authString, withServices=False, url="https://ssapi.shipstation.com", client=None):
+    """
+    Function that loads the reference data of an account, to look up the storeId, warehouseId
+    and carrierCode of orders locally. The responses come from the response cache while they are
+    fresh, so calling this on every run costs no rate limit budget.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - withServices : bool
+            Also load the services and packages of every carrier
+        - url : str
+            Base url of the api
+        - client : ShipStation object
+            Optional api handler to use. A handler on the shared pooled session is created if not provided.
+    Returns
+    -------
+        - referenceData : dict
+            stores by storeId, warehouses by warehouseId and carriers by code.
+            With withServices, every carrier has its 'services' and 'packages' lists.
+    """
+    if client is None:
+        client = ShipStation(authString)
+    stores = client.apicall('get', url + '/stores', params={'showInactive': 'true'})
+    warehouses = client.apicall('get', url + '/warehouses')
+    carriers = client.apicall('get', url + '/carriers')
+    referenceData = {
+        'stores': {store['storeId']: store for store in stores or []},
+        'warehouses': {warehouse['warehouseId']: warehouse for warehouse in warehouses or []},
+        'carriers': {carrier['code']: carrier for carrier in carriers or []},
+    }
+    if withServices:
+        for code, carrier in referenceData['carriers'].items():
+            carrier['services'] = client.apicall('get', url + '/carriers/listservices', params={'carrierCode': code}) or []
+            carrier['packages'] = client.apicall('get', url + '/carriers/listpackages', params={'carrierCode': code}) or []
+    return referenceData
+
+def getCacheTTL(url):
+    """
+    Function that returns for how long the response of a url is cached.
+
+    Parameters
+    ----------
+        - url : str
+            Full url of the call
+    Returns
+    -------
+        - ttl : int
+            Seconds from CACHE_TTLS of the endpoint (or the endpoint it is under), None if it isn't cached
+    """
+    path = apiCommon.getPath(url).rstrip('/')
+    while path:
+        if path in CACHE_TTLS:
+            return CACHE_TTLS[path]
+        path = path.rpartition('/')[0]
+    return None
+
+def invalidateCache(endpoint=None, cachePath=CACHE_PATH):
+    """
+    Function that drops cached reference data, so it is requested again on next use.
+
+    Parameters
+    ----------
+        - endpoint : str
+            Endpoint to drop, for example '/carriers' (with the services and packages under it). Everything if not given.
+        - cachePath : str
+            Path of the cache file
+    Returns
+    -------
+        - count : int
+            Number of responses dropped
+    """
+    if not os.path.exists(cachePath):
+        return 0
+    return apiCommon.getResponseCache(cachePath, maxSize=CACHE_MAX_SIZE).invalidate(endpoint)
+
+def listOrders(authString, filters={'orderStatus':'awaiting_shipment'}, url="https://ssapi.shipstation.com/orders", maxWorkers=4, pageSize=500, client=None, onPage=None):
     """
     This function will prepare the headers as well as params/data and make the api
     call to the ship station orders url.
+    The first page tells us how many pages the result set has, the remaining pages
+    are then fetched concurrently and merged back in page order.
+
+    Parameters
+    ----------
+        - authString : str
+            The custom download path that needs to be validated
+        - filters : dict
+            A dictionary that will contain all the filters we want to apply.
+        - url
+            The endpoint for the api call
+        - maxWorkers : int
+            Maximum number of pages that are fetched at the same time
+        - pageSize : int
+            Number of orders requested per page (ShipStation allows up to 500)
+        - client : ShipStation object
+            Optional api handler to use. A handler on the shared pooled session is created if not provided.
+        - onPage : callable
+            Optional function that is handed the orders of each page, in page order, as they arrive.
+            The orders are then not kept, so only a few pages are held in memory at a time.
+    Returns
+    -------
+        - jsonData : json
+            A json element containing all the orders it recieved (no orders if onPage is given)
+    """
+    if client is None:
+        client = ShipStation(authString)
+    payload = {}
+
+    # Iterate though filters and add each filter to payload
+    for key, value in filters.items():
+        payload[key] = value
+    payload.setdefault('pageSize', pageSize)
+
+    orders = []
+    if onPage is None:
+        onPage = orders.extend
+    count = 0
+
+    # The first page carries the total and the number of pages
+    jsonData = getOrdersPage(client, url, payload, 1)
+    pages = jsonData.get('pages') or 1
+    pageOrders = jsonData.pop('orders', None) or []
+    count += len(pageOrders)
+    onPage(pageOrders)
+
+    # Fetch the remaining pages concurrently, but hand them over in page order.
+    # Only a window of pages is requested ahead so finished pages don't pile up.
+    if pages > 1:
+        maxWorkers = max(1, maxWorkers)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            pending = deque()
+            nextPage = 2
+            while nextPage <= pages or pending:
+                while nextPage <= pages and len(pending) < maxWorkers * 2:
+                    pending.append(executor.submit(getOrdersPage, client, url, payload, nextPage))
+                    nextPage += 1
+                pageOrders = pending.popleft().result().get('orders') or []
+                count += len(pageOrders)
+                onPage(pageOrders)
+
+    jsonData['orders'] = orders
+    jsonData['page'] = 1
+    LOGGER.writeLog("Fetched {} of {} orders in {} pages.".format(count, jsonData.get('total', count), pages), severity='normal')
+    return jsonData
+
+def iterOrders(authString, filters={'orderStatus':'awaiting_shipment'}, url="https://ssapi.shipstation.com/orders", pageSize=500, prefetch=1, client=None):
+    """
+    Generator that yields the orders one at a time, in page order, while the next pages are
+    requested in the background. Processing of the first page can start while the following
+    pages are still in flight, and only the page being yielded and the prefetched ones are
+    held in memory.
+    Stopping early (break, close) cancels the pages not requested yet.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - filters : dict
+            A dictionary that will contain all the filters we want to apply.
+        - url : str
+            The endpoint for the api call
+        - pageSize : int
+            Number of orders requested per page (ShipStation allows up to 500)
+        - prefetch : int
+            Number of pages requested ahead of the one being yielded
+        - client : ShipStation object
+            Optional api handler to use. A handler on the shared pooled session is created if not provided.
+    Yields
+    ------
+        - order : dict
+    """
+    if client is None:
+        client = ShipStation(authString)
+    payload = dict(filters)
+    payload.setdefault('pageSize', pageSize)
+    prefetch = max(1, prefetch)
+
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    pending = deque()
+    count = 0
+    try:
+        # The first page tells how many pages there are
+        jsonData = getOrdersPage(client, url, payload, 1)
+        pages = jsonData.get('pages') or 1
+        nextPage = 2
+        while True:
+            while nextPage <= pages and len(pending) < prefetch:
+                pending.append(executor.submit(getOrdersPage, client, url, payload, nextPage))
+                nextPage += 1
+            pageOrders = jsonData.get('orders') or []
+            jsonData = None
+            count += len(pageOrders)
+            for order in pageOrders:
+                yield order
+            pageOrders = None
+            if not pending:
+                break
+            jsonData = pending.popleft().result()
+        LOGGER.writeLog("Iterated over {} orders in {} pages.".format(count, pages), severity='normal')
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+def getOrdersPage(client, url, payload, page):
+    """
+    Function that requests a single page of the orders endpoint.
+
+    Parameters
+    ----------
+        - client : ShipStation object
+            Object of the ShipStation API handler class
+        - url : str
+            The endpoint for the api call
+        - payload : dict
+            Filters sent as the query string of the request
+        - page : int
+            Number of the page that is requested (starts from 1)
+    Returns
+    -------
+        - jsonData : json
+            The json response for this page containing 'orders', 'total', 'page' and 'pages'
+    """
+    payload = dict(payload)
+    payload['page'] = page
+    return client.apicall('get', url, payload)
+
+def createOrders(authString, orders, url="https://ssapi.shipstation.com/orders/createorders", batchSize=100, maxWorkers=4, client=None):
+    """
+    This function creates or updates orders in bulk. The orders are packed into batches of up to
+    batchSize (ShipStation takes at most 100 per call) that are sent concurrently under the
+    account's shared rate limit, so one request is spent per batch instead of per order.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - orders : iterable
+            Order payloads as /orders/createorder takes them, a list or any stream of them.
+            Orders with an orderKey update the existing order with that key.
+        - url : str
+            The endpoint for the api call
+        - batchSize : int
+            Orders per request, at most 100
+        - maxWorkers : int
+            Maximum number of batches sent at the same time
+        - client : ShipStation object
+            Optional api handler to use. A handler on the shared pooled session is created if not provided.
+    Returns
+    -------
+        - jsonData : json
+            - hasErrors : True if any order failed
+            - results : one result per order, in the order they were given:
+              orderId, orderNumber, orderKey, success and errorMessage as ShipStation returns them
+            - failed : payloads of the orders that failed, to be passed to createOrders again
+    """
+    if client is None:
+        client = ShipStation(authString)
+    batchSize = max(1, min(batchSize, 100))
+    maxWorkers = max(1, maxWorkers)
+
+    results = []
+    failed = []
+    def collect(batch, future):
+        for order, result in zip(batch, future.result()):
+            results.append(result)
+            if not result.get('success'):
+                failed.append(order)
+
+    # Only a window of batches is packed ahead of the ones in flight, so a long stream
+    # of orders is never held in memory as a whole
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        pending = deque()
+        batch = []
+        for order in orders:
+            batch.append(order)
+            if len(batch) == batchSize:
+                pending.append((batch, executor.submit(createOrdersBatch, client, url, batch)))
+                batch = []
+                if len(pending) >= maxWorkers * 2:
+                    collect(*pending.popleft())
+        if batch:
+            pending.append((batch, executor.submit(createOrdersBatch, client, url, batch)))
+        while pending:
+            collect(*pending.popleft())
+
+    LOGGER.writeLog("Created or updated {} of {} orders.".format(len(results) - len(failed), len(results)), severity='normal')
+    return {'hasErrors': bool(failed), 'results': results, 'failed': failed}
+
+def createOrdersBatch(client, url, batch):
+    """
+    Function that sends one batch to /orders/createorders.
+
+    Parameters
+    ----------
+        - client : ShipStation object
+            Api handler to make the call with
+        - url : str
+            The endpoint for the api call
+        - batch : list
+            Order payloads
+    Returns
+    -------
+        - results : list
+            One result per order of the batch, in the same order.
+            If the whole call failed every order gets a failed result with the reason.
+    """
+    # createorders matches orders on orderKey, so a batch where every order has one can safely be sent again
+    idempotent = all(order.get('orderKey') for order in batch)
+    try:
+        jsonData = client.apicall('post', url, data=batch, idempotent=idempotent)
+    except LoadingError:
+        jsonData = {}
+    returned = jsonData.get('results') or []
+
+    # Match the results back to the payloads by orderKey, or by position where the order had no key
+    byKey = {result.get('orderKey'): result for result in returned if result.get('orderKey')}
+    results = []
+    for index, order in enumerate(batch):
+        result = byKey.get(order.get('orderKey')) if order.get('orderKey') else None
+        if result is None and index < len(returned) and not order.get('orderKey'):
+            result = returned[index]
+        if result is None:
+            result = {'orderId': None, 'orderNumber': order.get('orderNumber'), 'orderKey': order.get('orderKey'),
+                      'success': False, 'errorMessage': 'The batch request failed' if not returned else 'No result returned for this order'}
+        results.append(result)
+    return results
+
+def createLabels(authString, orders, labelDIRPath, journalPath=None, maxWorkers=4, testLabel=False, retryUnknown=False, url="https://ssapi.shipstation.com/orders/createlabelfororder", client=None):
+    """
+    This function buys a shipping label for each of the given orders, with a bounded pool of workers
+    under the account's shared rate limit. The label PDFs are written to labelDIRPath/<orderId>.pdf
+    straight from the response stream.
+    Every label is journaled before it is requested and once it is saved, so an order is never sent twice:
+    orders the journal has as done are skipped, and orders whose request was sent but never answered
+    (a crash, a timeout) are reported as unknown instead of being bought again.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - orders : iterable
+            Orders as listOrders returns them or iterOrders yields them, with carrierCode and serviceCode set
+        - labelDIRPath : str
+            Directory the labels are saved in
+        - journalPath : str
+            Path of the journal, LABEL_JOURNAL_FILE in labelDIRPath if not given
+        - maxWorkers : int
+            Maximum number of labels requested at the same time
+        - testLabel : bool
+            Ask ShipStation for test labels, no postage is bought
+        - retryUnknown : bool
+            Request the orders with an unknown outcome again, once they were checked in ShipStation
+        - url : str
+            The endpoint for the api call
+        - client : ShipStation object
+            Optional api handler to use. A handler on the shared pooled session is created if not provided.
+    Returns
+    -------
+        - results : list
+            One result per order, in the order they were given: orderId, status (created, skipped,
+            unknown or failed), labelPath, trackingNumber, shipmentCost and errorMessage
+    """
+    if client is None:
+        client = ShipStation(authString)
+    if not os.path.exists(labelDIRPath):
+        os.makedirs(labelDIRPath)
+    journal = LabelJournal(journalPath or os.path.join(labelDIRPath, LABEL_JOURNAL_FILE))
+    maxWorkers = max(1, maxWorkers)
+
+    results = []
+    seen = set()
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            # Results that are known right away wait in line with the requests, to keep the order of the results
+            pending = deque()
+            for order in orders:
+                orderId = order['orderId']
+                status = journal.getStatus(orderId)
+                payload = getLabelPayload(order, testLabel)
+                if orderId in seen:
+                    pending.append(getLabelResult(orderId, 'skipped', errorMessage='The order was given more than once'))
+                elif status == 'done':
+                    pending.append(getLabelResult(orderId, 'skipped', **journal.getDetails(orderId)))
+                elif status == 'unknown' and not retryUnknown:
+                    pending.append(getLabelResult(orderId, 'unknown', errorMessage='A previous run sent this request without getting an answer, check the order in ShipStation'))
+                elif payload is None:
+                    pending.append(getLabelResult(orderId, 'failed', errorMessage='No carrier or service selected for the order'))
+                else:
+                    pending.append(executor.submit(createLabel, client, url, payload, os.path.join(labelDIRPath, '{}.pdf'.format(orderId)), journal))
+                seen.add(orderId)
+                while pending and (not hasattr(pending[0], 'result') or len(pending) >= maxWorkers * 2):
+                    item = pending.popleft()
+                    results.append(item.result() if hasattr(item, 'result') else item)
+            while pending:
+                item = pending.popleft()
+                results.append(item.result() if hasattr(item, 'result') else item)
+    finally:
+        journal.close()
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    LOGGER.writeLog("Labels: {}.".format(', '.join('{} {}'.format(count, status) for status, count in sorted(counts.items())) or 'no orders'), severity='normal')
+    return results
+
+def createLabel(client, url, payload, labelPath, journal):
+    """
+    Function that buys the label of one order and saves it.
+
+    Parameters
+    ----------
+        - client : ShipStation object
+            Api handler to make the call with
+        - url : str
+            The endpoint for the api call
+        - payload : dict
+            Body of the request, see getLabelPayload
+        - labelPath : str
+            Path the PDF is saved to
+        - journal : LabelJournal
+            Journal of the run
+    Returns
+    -------
+        - result : dict
+            See createLabels
+    """
+    orderId = payload['orderId']
+    journal.record(orderId, 'started')
+    try:
+        shipment = client.apicall('post', url, data=payload, stream=lambda response: saveLabel(response, labelPath))
+    except LoadingError as e:
+        status = e.args[0] if e.args else None
+        # A client error means the label was refused, anything else may have been bought
+        if status is not None and 400 <= status < 500 and status not in (408, 429):
+            journal.record(orderId, 'failed', statusCode=status)
+            return getLabelResult(orderId, 'failed', errorMessage='Status {}'.format(status))
+        return getLabelResult(orderId, 'unknown', errorMessage='No answer from ShipStation, check the order before retrying')
+    except (OSError, ValueError) as e:
+        # The label was bought but could not be saved, it must not be bought again
+        journal.record(orderId, 'done', labelPath=None)
+        LOGGER.writeLog("Label of order {} was bought but could not be saved: {}".format(orderId, e), severity='error')
+        return getLabelResult(orderId, 'created', errorMessage='The label could not be saved: {}'.format(e))
+
+    details = {'labelPath': labelPath if os.path.exists(labelPath) else None, 'trackingNumber': shipment.get('trackingNumber'),
+               'shipmentId': shipment.get('shipmentId'), 'shipmentCost': shipment.get('shipmentCost')}
+    journal.record(orderId, 'done', **details)
+    return getLabelResult(orderId, 'created', **details)
+
+def getLabelPayload(order, testLabel=False):
+    """
+    Function that builds the body of a createlabelfororder call from an order.
+
+    Parameters
+    ----------
+        - order : dict
+            Order as listOrders returns it
+        - testLabel : bool
+            Ask for a test label
+    Returns
+    -------
+        - payload : dict
+            The body, None if the order has no carrier or service selected
+    """
+    if not order.get('carrierCode') or not order.get('serviceCode'):
+        return None
+    payload = {'orderId': order['orderId'], 'shipDate': datetime.now().strftime('%Y-%m-%d'), 'testLabel': testLabel}
+    for key in ('carrierCode', 'serviceCode', 'packageCode', 'confirmation', 'weight', 'dimensions', 'insuranceOptions', 'internationalOptions', 'advancedOptions'):
+        if order.get(key) is not None:
+            payload[key] = order[key]
+    return payload
+
+def getLabelResult(orderId, status, labelPath=None, trackingNumber=None, shipmentCost=None, errorMessage=None, **details):
+    return {'orderId': orderId, 'status': status, 'labelPath': labelPath, 'trackingNumber': trackingNumber,
+            'shipmentCost': shipmentCost, 'errorMessage': errorMessage}
+
+def saveLabel(response, labelPath):
+    """
+    Function that saves the label of a createlabelfororder response while the body streams in.
+    The base64 labelData is decoded chunk by chunk straight into the PDF, only the other
+    (small) fields of the response are kept in memory.
+
+    Parameters
+    ----------
+        - response : requests.Response
+            The response, with its body unread
+        - labelPath : str
+            Path the PDF is saved to
+    Returns
+    -------
+        - shipment : dict
+            The response without labelData
+    """
+    import re
+    import base64
+    marker = re.compile(rb'"labelData"\s*:\s*"')
+    head = b''
+    tail = []
+    encoded = b''
+    inLabel = False
+    found = False
+    tempPath = labelPath + '.tmp'
+    with open(tempPath, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=LABEL_CHUNK_SIZE):
+            if not found:
+                head += chunk
+                match = marker.search(head)
+                if match is None:
+                    continue
+                chunk = head[match.end():]
+                head = head[:match.start()]
+                found = inLabel = True
+            if inLabel:
+                end = chunk.find(b'"')
+                # JSON may escape the slashes of the base64 alphabet, an escape can be cut in two by the chunks
+                encoded += (chunk if end < 0 else chunk[:end])
+                encoded = encoded.replace(b'\\/', b'/')
+                keep = len(encoded) // 4 * 4
+                if encoded[keep - 1:keep] == b'\\':
+                    keep -= 4
+                f.write(base64.b64decode(encoded[:keep]))
+                encoded = encoded[keep:]
+                if end < 0:
+                    continue
+                inLabel = False
+                chunk = chunk[end + 1:]
+            tail.append(chunk)
+        if encoded:
+            f.write(base64.b64decode(encoded))
+
+    if not found:
+        os.remove(tempPath)
+        return json.loads(head.decode('utf-8'))
+    os.replace(tempPath, labelPath)
+    return json.loads((head + b'"labelData":null' + b''.join(tail)).decode('utf-8'))
+
+async def listOrdersAsync(authString, filters={'orderStatus':'awaiting_shipment'}, url="https://ssapi.shipstation.com/orders", maxConcurrency=8, pageSize=500, client=None, onPage=None):
+    """
+    asyncio counterpart of listOrders. The remaining pages are requested from the
+    running event loop instead of a thread pool and merged back in page order.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - filters : dict
+            A dictionary that will contain all the filters we want to apply.
+        - url
+            The endpoint for the api call
+        - maxConcurrency : int
+            Maximum number of pages that are in flight at the same time
+        - pageSize : int
+            Number of orders requested per page (ShipStation allows up to 500)
+        - client : AsyncShipStation object
+            Optional api handler to use, e.g. one shared with other coroutines. A new one is created and closed if not provided.
+        - onPage : callable
+            Optional function that is handed the orders of each page, in page order, as they arrive (see listOrders)
+    Returns
+    -------
+        - jsonData : json
+            A json element containing all the orders it recieved (no orders if onPage is given)
+    """
+    import asyncio
+    if client is None:
+        async with AsyncShipStation(authString) as client:
+            return await listOrdersAsync(authString, filters=filters, url=url, maxConcurrency=maxConcurrency, pageSize=pageSize, client=client, onPage=onPage)
+
+    payload = dict(filters)
+    payload.setdefault('pageSize', pageSize)
+
+    orders = []
+    if onPage is None:
+        onPage = orders.extend
+    count = 0
+
+    # The first page carries the total and the number of pages
+    jsonData = await getOrdersPageAsync(client, url, payload, 1)
+    pages = jsonData.get('pages') or 1
+    pageOrders = jsonData.pop('orders', None) or []
+    count += len(pageOrders)
+    onPage(pageOrders)
+
+    # Keep up to maxConcurrency pages in flight and hand them over in page order
+    pending = deque()
+    nextPage = 2
+    try:
+        while nextPage <= pages or pending:
+            while nextPage <= pages and len(pending) < max(1, maxConcurrency):
+                pending.append(asyncio.ensure_future(getOrdersPageAsync(client, url, payload, nextPage)))
+                nextPage += 1
+            pageOrders = (await pending.popleft()).get('orders') or []
+            count += len(pageOrders)
+            onPage(pageOrders)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    jsonData['orders'] = orders
+    jsonData['page'] = 1
+    LOGGER.writeLog("Fetched {} of {} orders in {} pages.".format(count, jsonData.get('total', count), pages), severity='normal')
+    return jsonData
+
+async def getOrdersPageAsync(client, url, payload, page):
+    """
+    asyncio counterpart of getOrdersPage.
+
+    Parameters
+    ----------
+        - client : AsyncShipStation object
+            Object of the async ShipStation API handler class
+        - url : str
+            The endpoint for the api call
+        - payload : dict
+            Filters sent as the query string of the request
+        - page : int
+            Number of the page that is requested (starts from 1)
+    Returns
+    -------
+        - jsonData : json
+            The json response for this page
+    """
+    payload = dict(payload)
+    payload['page'] = page
+    return await client.apicall('get', url, payload)
+
+async def getOrderAsync(client, orderId, url="https://ssapi.shipstation.com/orders"):
+    """
+    Function that requests a single order by its id.
+
+    Parameters
+    ----------
+        - client : AsyncShipStation object
+            Object of the async ShipStation API handler class
+        - orderId : int
+            ShipStation's id of the order
+        - url : str
+            The orders endpoint
+    Returns
+    -------
+        - order : json
+            The order
+    """
+    return await client.apicall('get', "{}/{}".format(url, orderId))
+
+def syncOrders(authString, snapshot, state, filters={'orderStatus':'awaiting_shipment'}, overlapMinutes=SYNC_OVERLAP_MINUTES, useAsync=False, client=None):
+    """
+    Function that brings the orders saved by a previous run up to date.
+    Only the orders modified after the stored modifyDate watermark (minus a safety overlap)
+    are requested and merged into the previous snapshot by orderId.
+    A full download is made when there is no previous snapshot or watermark.
+
+    Parameters
+    ----------
+        - authString : str
+            Authentication string produced by loadConfig
+        - snapshot : list
+            Orders saved by the previous run, None if there are none
+        - state : dict
+            State saved by the previous run, see loadSyncState
+        - filters : dict
+            Filters that define which orders the snapshot holds
+        - overlapMinutes : int
+            Minutes subtracted from the watermark so that orders saved around the last run are not missed
+        - useAsync : bool
+            Use the asyncio client for the api calls
+        - client : ShipStation object
+            Optional api handler for the synchronous calls
+    Returns
+    -------
+        - jsonData : json
+            All orders matching the filters, in the same layout listOrders returns
+        - state : dict
+            The updated state, to be saved with saveSyncState once the output is written
+    """
+    watermark = state.get('modifyDate') if state.get('filters') == filters else None
+    if watermark is None:
+        snapshot = None
+
+    # Nothing to build on, download everything
+    if snapshot is None:
+        LOGGER.writeLog("No previous snapshot or watermark found, downloading all orders.", severity='normal')
+        if useAsync:
+            import asyncio
+            jsonData = asyncio.run(listOrdersAsync(authString, filters=filters))
+        else:
+            jsonData = listOrders(authString, filters=filters, client=client)
+        state = {'filters': filters, 'modifyDate': getMaxModifyDate(jsonData['orders'], None)}
+        return jsonData, state
+
+    # Ask for everything modified since the watermark. The status filter is left out
+    # so that orders that moved out of the filtered status are dropped from the snapshot too.
+    since = datetime.strptime(watermark[:19], '%Y-%m-%dT%H:%M:%S') - timedelta(minutes=overlapMinutes)
+    deltaFilters = {key: value for key, value in filters.items() if key != 'orderStatus'}
+    deltaFilters['modifyDateStart'] = since.strftime('%Y-%m-%d %H:%M:%S')
+    LOGGER.writeLog("Requesting orders modified since {}.".format(deltaFilters['modifyDateStart']), severity='normal')
+    if useAsync:
+        import asyncio
+        delta = asyncio.run(listOrdersAsync(authString, filters=deltaFilters))
+    else:
+        delta = listOrders(authString, filters=deltaFilters, client=client)
+
+    orders = mergeOrders(snapshot, delta['orders'], filters.get('orderStatus'))
+    LOGGER.writeLog("Merged {} modified orders, {} orders in snapshot.".format(len(delta['orders']), len(orders)), severity='normal')
+
+    jsonData = {'orders': orders, 'total': len(orders), 'page': 1, 'pages': 1}
+    state = {'filters': filters, 'modifyDate': getMaxModifyDate(delta['orders'], watermark)}
+    return jsonData, state
+
+def mergeOrders(orders, delta, orderStatus=None):
+    """
+    Function that merges modified orders into a list of orders by orderId.
+
+    Parameters
+    ----------
+        - orders : list
+            Previously saved orders
+        - delta : list
+            Orders that were modified since, these replace the saved ones with the same orderId
+        - orderStatus : str
+            If given, orders that are no longer in this status are removed
+    Returns
+    -------
+        - merged : list
+            The merged orders, previously saved orders keep their position
+    """
+    merged = {order['orderId']: order for order in orders}
+    for order in delta:
+        merged[order['orderId']] = order
+    if orderStatus is None:
+        return list(merged.values())
+    return [order for order in merged.values() if order.get('orderStatus') == orderStatus]
+
+def getMaxModifyDate(orders, watermark):
+    """
+    Function that finds the latest modifyDate in a list of orders.
+    ShipStation dates share a fixed format so comparing the strings is enough.
+
+    Parameters
+    ----------
+        - orders : list
+            Orders to look through
+        - watermark : str
+            The current watermark, returned if no order is newer
+    Returns
+    -------
+        - watermark : str
+            The latest modifyDate
+    """
+    for order in orders:
+        modifyDate = order.get('modifyDate')
+        if modifyDate and (watermark is None or modifyDate > watermark):
+            watermark = modifyDate
+    return watermark
+
+def loadPreviousOrders(outputPath, outputFormat):
+    """
+    Function that loads the orders saved by a previous run.
+
+    Parameters
+    ----------
+        - outputPath : str
+            Path to the output of the previous run
+        - outputFormat : str
+            Format the output was saved in, one of OUTPUT_FILES
+    Returns
+    -------
+        - orders : list
+            The saved orders, None if there is no previous output
+    """
+    if not os.path.exists(outputPath):
+        return None
+    if outputFormat == 'sqlite':
+        store = OrderStore(outputPath)
+        orders = store.loadOrders()
+        store.close()
+        return orders
+    if outputFormat == 'ndjson':
+        with open(outputPath, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if outputFormat == 'parquet':
+        # The flat tables can't be turned back into orders, so the next run downloads everything
+        return None
+    with open(outputPath, 'r') as f:
+        return json.load(f).get('orders') or []
+
+def loadSyncState(statePath):
+    """
+    Function that reads the incremental sync state saved by a previous run.
 
     Parameters
     ----------
-        - authString : str
-            The custom download path that needs to be validated
-        - filters : dict
-            A dictionary that will contain all the filters we want to apply.
-        - url
-            The endpoint for the api call
+        - statePath : str
+            Path to the state file
     Returns
     -------
-        - jsonData : json
-            A json element containing all the orders it recieved
+        - state : dict
+            The saved state, empty if there was none or it could not be read
     """
-    localFrame = inspect.currentframe()
-    # Prepare the header
-    headers = {
-        'Host': 'ssapi.shipstation.com',
-        'Authorization': authString
-    }
-    payload = {}
-
-    # Iterate though filters and add each filter to payload
-    for key, value in filters.items():
-        payload[key] = value
-    
-    # Note: Don't delete: data is for posts and params is for gets
-    orderRequest = requests.request("GET", url, headers=headers, params=payload)
+    if not os.path.exists(statePath):
+        return {}
+    try:
+        with open(statePath, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        LOGGER.writeLog("Sync state file could not be read, starting over.", severity='warning')
+        return {}
 
-    # Successful response codes
-    if orderRequest.status_code in (200, 201, 204):
-        jsonData = json.loads(orderRequest.text)
-    else:
-        LOGGER.writeLog("The api request produced an unsuccessful status code. Details follow below.", localFrame.f_lineno, severity='code-breaker', data={'code':1})
-        LOGGER.writeLog("Status code from the reuqest: {}.".format(orderRequest.status_code), localFrame.f_lineno, severity='code-breaker', data={'code':1})
-        LOGGER.writeLog("Response text: .".format(orderRequest.text), localFrame.f_lineno, severity='code-breaker', data={'code':1})
-        LOGGER.writeLog("Url: {}.".format(url), localFrame.f_lineno, severity='code-breaker', data={'code':1})
-        LOGGER.writeLog("Headers: {}.".format(headers), localFrame.f_lineno, severity='code-breaker', data={'code':1})
-        LOGGER.writeLog("Payload: {}.".format(payload), localFrame.f_lineno, severity='code-breaker', data={'code':1})
-        LOGGER.writeLog("*RESPONSE DETAILS END*", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+def saveSyncState(statePath, state):
+    """
+    Function that saves the incremental sync state. The file is replaced atomically.
 
-    return jsonData
+    Parameters
+    ----------
+        - statePath : str
+            Path to the state file
+        - state : dict
+            State to save
+    """
+    tempPath = statePath + '.tmp'
+    with open(tempPath, 'w') as f:
+        json.dump(state, f, indent=3)
+    os.replace(tempPath, statePath)
 
 def parseArgs(argv):
     """
@@ -193,10 +1626,20 @@ def parseArgs(argv):
         - verbose : bool
         - outputDIRPath : str
             Path to the directory where output files are to be saved by this script
+        - useAsync : bool
+            Make the api calls with the asyncio client instead of threads
+        - incremental : bool
+            Only download the orders modified since the last run
+        - outputFormat : str
+            Format of the output, one of OUTPUT_FILES
+        - watchInterval : float
+            Seconds between polls of the watch mode, None to run once
+        - webhookPort : int
+            Port of the webhook receiver, None to not receive webhooks
     """
     # Defining options in for command line arguments
-    options = "hf:o:v"
-    long_options = ['help', 'file=', 'output=', 'verbose']
+    options = "hVf:o:vit:w:"
+    long_options = ['help', 'version', 'file=', 'output=', 'verbose', 'async', 'incremental', 'format=', 'watch=', 'webhook=', 'simulate-webhook=', 'invalidate-cache=']
     
     # Arguments
     configPath = 'shipstation.yaml'
@@ -204,6 +1647,11 @@ def parseArgs(argv):
     outputDIRPath = ''
     customOutputPathFoundAndValidated = False
     verbose = False
+    useAsync = False
+    incremental = False
+    outputFormat = 'json'
+    watchInterval = None
+    webhookPort = None
 
     # Extracting arguments
     try:
@@ -215,10 +1663,12 @@ def parseArgs(argv):
         exit()
 
     for option, value in opts:
-        if option == '-h':
-            # Turn on verbose, print help message, and exit
-            LOGGER.verbose = True
-            print (HELP_MESSAGE)
+        if option in ('-h', '--help'):
+            # Print help message straight to the terminal (no log file is created), and exit
+            LOGGER.terminal.write(HELP_MESSAGE)
+            sys.exit()
+        elif option in ('-V', '--version'):
+            LOGGER.terminal.write(getVersionReport())
             sys.exit()
         elif option in ("-f", "--file"):
             configPath = value
@@ -230,6 +1680,25 @@ def parseArgs(argv):
             verbose = True
             # Updating logger's behavior based on verbose
             LOGGER.verbose = verbose
+        elif option == "--async":
+            useAsync = True
+        elif option in ("-i", "--incremental"):
+            incremental = True
+        elif option in ("-t", "--format"):
+            outputFormat = validateOutputFormat(value)
+        elif option in ("-w", "--watch"):
+            watchInterval = validateWatchInterval(value)
+        elif option == "--webhook":
+            webhookPort = validateWebhookPort(value)
+        elif option == "--simulate-webhook":
+            # Needs no configuration, post the burst and exit
+            simulateWebhook(value)
+            sys.exit()
+        elif option == "--invalidate-cache":
+            # Needs no configuration either, the cache is shared by all accounts
+            count = invalidateCache(None if value == 'all' else value)
+            LOGGER.terminal.write("Dropped {} cached responses.\n".format(count))
+            sys.exit()
 
     # If custom path to config file wasn't found, search in default locations
     if not customConfigPathFoundAndValidated:
@@ -237,7 +1706,22 @@ def parseArgs(argv):
     if not customOutputPathFoundAndValidated:
         outputDIRPath = getDefaultDownloadPath()
 
-    return configPath, outputDIRPath, verbose
+    return configPath, outputDIRPath, verbose, useAsync, incremental, outputFormat, watchInterval, webhookPort
+
+def getVersionReport():
+    """
+    Function that builds the text printed by --version: the version and how long the script took to import.
+
+    Returns
+    -------
+        - report : str
+            The version and import time report
+    """
+    report = "shipStation {} (Python {}.{})\n".format(VERSION, *PYTHON_VERSION)
+    report += "Import time: {:.1f} ms (budget {} ms)\n".format(IMPORT_TIME, STARTUP_BUDGET)
+    if IMPORT_TIME > STARTUP_BUDGET:
+        report += "Import time is over budget. Run 'python3 -X importtime shipStation.py --version' to see which imports are slow.\n"
+    return report
 
 def validateConfigPath(configPath):
     """
@@ -252,19 +1736,77 @@ def validateConfigPath(configPath):
         - validated : bool
             A True or False as a result of the validation of the path
     """
-    localFrame = inspect.currentframe()
     # Check extension, must be YAML
     if not configPath.endswith('yaml'):
-        LOGGER.writeLog("Configuration file must be .yaml extension.\nLooking for configuration file in default locations.", localFrame.f_lineno, severity='error')
+        LOGGER.writeLog("Configuration file must be .yaml extension.\nLooking for configuration file in default locations.", severity='error')
         return False
 
     # Check if file exists
     if not os.path.exists(configPath):
-        LOGGER.writeLog("Specified path to the configuration file is invalid.\nLooking for configuration file in default locations.", localFrame.f_lineno, severity='error')
+        LOGGER.writeLog("Specified path to the configuration file is invalid.\nLooking for configuration file in default locations.", severity='error')
         return False
     else:
         return True
 
+def validateOutputFormat(outputFormat):
+    """
+    Function to validate the output format chosen by the user.
+
+    Parameters
+    ----------
+        - outputFormat : str
+            The user-specified output format
+    Returns
+    -------
+        - outputFormat : str
+            The same format if validated and 'json' if not
+    """
+    outputFormat = outputFormat.lower()
+    if outputFormat not in OUTPUT_FILES:
+        LOGGER.writeLog("Output format must be one of {}, switching to default 'json' format.".format(', '.join(OUTPUT_FILES)), severity='warning')
+        return 'json'
+    return outputFormat
+
+def validateWatchInterval(watchInterval):
+    """
+    Function to validate the interval of the watch mode chosen by the user.
+
+    Parameters
+    ----------
+        - watchInterval : str
+            The user-specified number of seconds
+    Returns
+    -------
+        - watchInterval : float
+            The interval if validated and WATCH_INTERVAL if not
+    """
+    try:
+        interval = float(watchInterval)
+    except ValueError:
+        interval = 0
+    if interval <= 0:
+        LOGGER.writeLog("Watch interval must be a positive number of seconds, switching to default {} seconds.".format(WATCH_INTERVAL), severity='warning')
+        return float(WATCH_INTERVAL)
+    return interval
+
+def validateWebhookPort(webhookPort):
+    """
+    Function to validate the port of the webhook receiver chosen by the user.
+
+    Parameters
+    ----------
+        - webhookPort : str
+            The user-specified port
+    Returns
+    -------
+        - webhookPort : int
+            The port if validated, the script exits if not
+    """
+    if not webhookPort.isdigit() or not 0 < int(webhookPort) < 65536:
+        LOGGER.writeLog("Webhook port must be a number between 1 and 65535.", severity='code-breaker', data={'code':1})
+        exit()
+    return int(webhookPort)
+
 def getDefaultConfigPath():
     """
     Function to get the degault config file path.
@@ -276,7 +1818,6 @@ def getDefaultConfigPath():
         - configPath : str
             Path to the configuration file if found in the default locations
     """
-    localFrame = inspect.currentframe()
     fileName = 'shipstation.yaml'
     # Check in current directory
     directory = os.getcwd()
@@ -296,10 +1837,10 @@ def getDefaultConfigPath():
         if os.path.exists(configPath):
             return configPath
     else:
-        LOGGER.writeLog("Platform couldn't be recognized. Are you sure you are running this script on Windows or Ubuntu Linux?", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+        LOGGER.writeLog("Platform couldn't be recognized. Are you sure you are running this script on Windows or Ubuntu Linux?", severity='code-breaker', data={'code':1})
         exit()
 
-    LOGGER.writeLog("shipstation.yaml config file wasn't found in default locations!\nSpecify a path to configuration file using (-f --file) argument.", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("shipstation.yaml config file wasn't found in default locations!\nSpecify a path to configuration file using (-f --file) argument.", severity='code-breaker', data={'code':1})
     exit()
 
 def validateDownloadPath(path):
@@ -315,12 +1856,11 @@ def validateDownloadPath(path):
         - validated : bool
             True of False based on validation of the provided downloadDIRPath
     """
-    localFrame =  inspect.currentframe()
     if not os.path.exists(path):
-        LOGGER.writeLog("The download path defined does not exist. Make sure that the path is reachable. Switching to default download paths...", localFrame.f_lineno, severity='warning')
+        LOGGER.writeLog("The download path defined does not exist. Make sure that the path is reachable. Switching to default download paths...", severity='warning')
         return False
     if not os.path.isdir(path):
-        LOGGER.writeLog("The specified download path is a file. Make sure that a directory is specified. Switching to default download paths...", localFrame.f_lineno, severity='warning')
+        LOGGER.writeLog("The specified download path is a file. Make sure that a directory is specified. Switching to default download paths...", severity='warning')
         return False
     return True
 
@@ -334,7 +1874,6 @@ def getDefaultDownloadPath():
         - downloadPath : str
             A valid path that points to the diretory where the file should be downloaded
     """
-    localFrame = inspect.currentframe()
     # No file name in this one for now
     # suffix = datetime.now().strftime('%Y_%m_%d-%H-%M-%S')
     # fileName = 'SureDone_Downloads_' + suffix + '.csv'    
@@ -350,163 +1889,909 @@ def getDefaultDownloadPath():
         return downloadPath
     # Unrecognized operating system    
     else:
-        LOGGER.writeLog("Platform couldn't be recognized. Are you sure you are running this script on Windows or Ubuntu Linux?", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+        LOGGER.writeLog("Platform couldn't be recognized. Are you sure you are running this script on Windows or Ubuntu Linux?", severity='code-breaker', data={'code':1})
         exit()
 
-    LOGGER.writeLog("A download directory could not be specified in default locations!\nSpecify a path to the directory using (-o --output) argument.", localFrame.f_lineno, severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("A download directory could not be specified in default locations!\nSpecify a path to the directory using (-o --output) argument.", severity='code-breaker', data={'code':1})
     exit()
 
-""" Custom logging class """
-class Logger(object):
-    """ The logger class that will handle all outputs, may it be console or log file. """
-    def __init__(self, verbose=False):
-        self.terminal = sys.stdout
-        self.log = open(self.getLogPath(), "a")
-        # Write the header row
-        self.log.write(' Ind. |LineNo.| Time stamp  : Message')
-        self.log.write('\n=====================================\n')
-        self.verbose = verbose
+class NDJSONWriter:
+    """ A writer that streams orders to a newline delimited JSON file, one order per line """
+    def __init__(self, path):
+        """
+        Constructor function. The orders are written to a temporary file next to path
+        that only replaces path once close is called, so readers never see a half written file.
+
+        Parameters
+        ----------
+            - path : str
+                Path of the final file
+        """
+        self.path = path
+        self.tempPath = path + '.tmp'
+        self.file = open(self.tempPath, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, orders):
+        """
+        Function that appends orders to the file. Can be passed to listOrders as onPage.
+
+        Parameters
+        ----------
+            - orders : list
+                Orders to append
+        """
+        self.file.writelines(json.dumps(order, separators=(',', ':')) + '\n' for order in orders)
+        self.count += len(orders)
+
+    def close(self):
+        """ Flushes the file to disk and moves it into place """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tempPath, self.path)
+
+    def abort(self):
+        """ Drops the temporary file, leaving the previous output untouched """
+        self.file.close()
+        if os.path.exists(self.tempPath):
+            os.remove(self.tempPath)
+
+class OrderStore:
+    """ A SQLite backed store for orders, keyed on orderId and indexed for the lookups the pick/pack tools make """
+    def __init__(self, path):
+        """
+        Constructor function. Opens (or creates) the database and makes sure the tables and indexes exist.
+
+        Parameters
+        ----------
+            - path : str
+                Path to the database file
+        """
+        import sqlite3
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(ORDER_STORE_SCHEMA)
+        self.connection.commit()
 
-    def getLogPath(self):
+    def upsertOrders(self, orders):
         """
-        Function that will determine the default log file path based on the operating system being used.
-        Will also create appropriate directories they aren't present.
+        Function that inserts the given orders or replaces the saved ones with the same orderId, in a single transaction.
 
+        Parameters
+        ----------
+            - orders : list
+                Orders as returned by the api
         Returns
         -------
-            - logFile : fileIO
-                File IO for the whole script to log to.
-        """
-        # Define the file name for logging
-        temp = datetime.now().strftime('%Y_%m_%d-%H-%M-%S')
-        logFileName = "shipstation_" + temp + ".log"
-
-        # If the platform is windows, set the log file path to the current user's Downloads/log folder
-        if sys.platform == 'win32' or sys.platform == 'win64': # Windows
-            logFilePath = os.path.expandvars(r'%USERPROFILE%')
-            logFilePath = os.path.join(logFilePath, 'Downloads')
-            logFilePath = os.path.join(logFilePath, 'log')
-            if os.path.exists(logFilePath):
-                return os.path.join(logFilePath, logFileName)
-            else:   # Create the log directory
-                os.mkdir(logFilePath)
-                return os.path.join(logFilePath, logFileName)
-
-        # If Linux, set the download path to the $HOME/downloads folder
-        elif sys.platform == 'linux' or sys.platform == 'linux2': # Linux
-            logFilePath = expanduser('~')
-            logFilePath = os.path.join(logFilePath, 'log')
-            if os.path.exists(logFilePath):
-                return os.path.join(logFilePath, logFileName)
-            else:   # Create the log directory
-                os.mkdir(logFilePath)
-                return os.path.join(logFilePath, logFileName)
-
-    def write(self, message):
-        if self.verbose:
-            self.terminal.write(message)
-            self.terminal.flush()
-        self.log.write(message)
-    
-    def writeLog(self, message, lineNumber, severity='normal', data=None):
+            - count : int
+                Number of orders written
+        """
+        orderRows = []
+        itemRows = []
+        for order in orders:
+            advancedOptions = order.get('advancedOptions') or {}
+            orderRows.append((order['orderId'], order.get('orderNumber'), order.get('orderKey'), order.get('orderStatus'),
+                              order.get('orderDate'), order.get('modifyDate'), advancedOptions.get('storeId'),
+                              order.get('customerEmail'), json.dumps(order)))
+            for item in order.get('items') or []:
+                itemRows.append((order['orderId'], item.get('orderItemId'), item.get('sku'), item.get('name'),
+                                 item.get('quantity'), item.get('unitPrice')))
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', orderRows)
+            self.connection.executemany('DELETE FROM order_items WHERE orderId = ?', [(row[0],) for row in orderRows])
+            self.connection.executemany('INSERT INTO order_items VALUES (?, ?, ?, ?, ?, ?)', itemRows)
+        return len(orderRows)
+
+    def pruneOrders(self, orderStatus, keepIds):
         """
-        Function that writes out to the log file and console based on verbose.
-        The function will change behavior slightly based on severity of the message.
+        Function that removes saved orders of the given status that are not among keepIds.
+        Used after a full download, when any order missing from the result has left that status.
 
         Parameters
         ----------
-            - message : str
-                Message to write
-            - severity : str
-                Defines what the message is related to. Is the message:
-                    - [N] : A 'normal' notification
-                    - [W] : A 'warning'
-                    - [E] : An 'error'
-                    - [!] : A 'code-breaker error' (errors that are followed by the script exitting)
-            - data : dict
-                A dictionary that will contain additional information when a code-breaker error occurs
-                Attributes:
-                    - code : error code
-                        1 : Generic error, only print the message.
-                        2 : An API call was not successful. Response object attached.
-                        3 : YAML loading error. Error object attached
-                    - response : str
-                        JSON-like str - the response recieved from the request in conern at the point of error.
-                    - error : str
-                        String produced by exception if an exception occured
-        """
-        # Get a timestamp
-        timestamp = self.getCurrentTimestamp()
-
-        # Format the message based on severity
-        lineNumber = str(lineNumber)
-        if severity == 'normal':
-            indicator = '[N]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message
-        elif severity == 'warning':
-            indicator = '[W]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message
-        elif severity == 'error':
-            indicator = '[X]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message        
-        elif severity == 'code-breaker':
-            indicator = '[!]'
-            toWrite = ' ' + indicator + '  |  ' + lineNumber + '  | ' + timestamp + ': ' + message
-            
-            if data['code'] == 2: # Response recieved but unsuccessful
-                details = '\n[ErrorDetailsStart]\n' + str(data['response']) + '\n[ErrorDetailsEnd]'
-                toWrite = toWrite + details
-            elif data['code'] == 3: # YAML loading error
-                details = '\n[ErrorDetailsStart]\n' + str(data['error']) + '\n[ErrorDetailsEnd]'
-                toWrite = toWrite + details
-        
-        # Write out the message
-        self.log.write(toWrite + '\n')
-        if self.verbose:
-            self.terminal.write(message + '\n')
-            self.terminal.flush()
-
-    def getCurrentTimestamp(self):
-        """
-        Simple function that calculates the current time stamp and simply formats it as a string and returns.
-        Mainly aimed for logging.
+            - orderStatus : str
+                Status the result was filtered on, None if it wasn't filtered on a status
+            - keepIds : list
+                orderIds of the orders in the result
+        Returns
+        -------
+            - count : int
+                Number of orders removed
+        """
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS keep_ids (orderId INTEGER PRIMARY KEY)')
+            self.connection.execute('DELETE FROM keep_ids')
+            self.connection.executemany('INSERT OR IGNORE INTO keep_ids VALUES (?)', [(orderId,) for orderId in keepIds])
+            condition = 'orderId NOT IN (SELECT orderId FROM keep_ids)'
+            params = ()
+            if orderStatus is not None:
+                condition = 'orderStatus = ? AND ' + condition
+                params = (orderStatus,)
+            self.connection.execute('DELETE FROM order_items WHERE orderId IN (SELECT orderId FROM orders WHERE ' + condition + ')', params)
+            count = self.connection.execute('DELETE FROM orders WHERE ' + condition, params).rowcount
+        return count
+
+    def getOrder(self, orderId):
+        """
+        Function that returns a single order by its id.
+
+        Parameters
+        ----------
+            - orderId : int
+                ShipStation's id of the order
+        Returns
+        -------
+            - order : dict
+                The order, None if it is not in the store
+        """
+        row = self.connection.execute('SELECT data FROM orders WHERE orderId = ?', (orderId,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def findOrders(self, orderStatus=None, storeId=None, customerEmail=None, sku=None, orderDateStart=None, orderDateEnd=None):
+        """
+        Function that looks orders up through the indexed columns. Filters that are not given are not applied.
+
+        Parameters
+        ----------
+            - orderStatus : str
+            - storeId : int
+            - customerEmail : str
+                Matched case-insensitively
+            - sku : str
+                Orders that have at least one item with this SKU
+            - orderDateStart : str
+                Earliest orderDate, in the format the api uses
+            - orderDateEnd : str
+                Latest orderDate, in the format the api uses
+        Returns
+        -------
+            - orders : list
+                The matching orders, ordered by orderDate
+        """
+        conditions = []
+        values = []
+        for column, value in (('orderStatus', orderStatus), ('storeId', storeId), ('customerEmail', customerEmail)):
+            if value is not None:
+                conditions.append(column + ' = ?')
+                values.append(value)
+        if orderDateStart is not None:
+            conditions.append('orderDate >= ?')
+            values.append(orderDateStart)
+        if orderDateEnd is not None:
+            conditions.append('orderDate <= ?')
+            values.append(orderDateEnd)
+        if sku is not None:
+            conditions.append('orderId IN (SELECT orderId FROM order_items WHERE sku = ?)')
+            values.append(sku)
+        query = 'SELECT data FROM orders'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY orderDate'
+        return [json.loads(row[0]) for row in self.connection.execute(query, values)]
+
+    def loadOrders(self):
+        """
+        Function that returns every saved order.
 
         Returns
         -------
-            - timestamp : str
-                A formatted string of current time
+            - orders : list
+                All orders in the store
         """
-        return datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        return [json.loads(row[0]) for row in self.connection.execute('SELECT data FROM orders ORDER BY orderId')]
+
+    def close(self):
+        self.connection.close()
+
+class ParquetWriter:
+    """ A writer that streams orders into typed columnar Parquet files: orders, line items and addresses """
+    def __init__(self, directory, rowGroupSize=PARQUET_ROW_GROUP_SIZE, compression='zstd'):
+        """
+        Constructor function. Like NDJSONWriter, every table is written to a temporary file
+        that only replaces the previous output once close is called.
+
+        Parameters
+        ----------
+            - directory : str
+                Directory the PARQUET_FILES are saved in
+            - rowGroupSize : int
+                Orders buffered before a row group is written
+            - compression : str
+                Parquet compression codec
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            LOGGER.writeLog("pyarrow is required for the parquet format. Install it with 'pip install pyarrow'.", severity='code-breaker', data={'code':1})
+            exit()
+        self.pa = pyarrow
+        self.rowGroupSize = rowGroupSize
+        self.count = 0
+        self.buffered = 0
+        self.tables = {}
+        for table, columns in TABLE_COLUMNS.items():
+            path = os.path.join(directory, PARQUET_FILES[table])
+            schema = pyarrow.schema([(name, getArrowType(pyarrow, typ)) for name, valuePath, typ in columns])
+            self.tables[table] = {
+                'path': path,
+                'tempPath': path + '.tmp',
+                'columns': columns,
+                'schema': schema,
+                'buffer': {name: [] for name, valuePath, typ in columns},
+                'writer': pyarrow.parquet.ParquetWriter(path + '.tmp', schema, compression=compression),
+            }
 
-    def exceptionLogger(self, exctype, value, traceBack):
+    def write(self, orders):
         """
-        A simple printing function that will take place of the sys.excepthook function and print the results to the log instead of the console.
+        Function that adds orders to the tables. Can be passed to listOrders as onPage.
 
         Parameters
         ----------
-            - exctype : object
-                Exception type and details
-            - Value : str
-                The error passed while the exception was raised
-            - traceBack : traceback object
-                Contains information about the stack trace.
-        """
-        LOGGER.write('Exception Occured! Details follow below.\n')
-        LOGGER.write('Type:{}\n'.format(exctype))
-        LOGGER.write('Value:{}\n'.format(value))
-        LOGGER.write('Traceback:\n')
-        for i in traceback.format_list(traceback.extract_tb(traceBack)):
-            LOGGER.write(i)
+            - orders : list
+                Orders to add
+        """
+        for table, columns in flattenColumns(orders).items():
+            buffer = self.tables[table]['buffer']
+            for name, values in columns.items():
+                buffer[name].extend(values)
+        self.count += len(orders)
+        self.buffered += len(orders)
+        if self.buffered >= self.rowGroupSize:
+            self.flush()
 
     def flush(self):
-        # This flush method is needed for python 3 compatibility.
-        # This handles the flush command by doing nothing.
-        # You might want to specify some extra behavior here.
-        pass
+        """ Writes the buffered rows of every table as one row group """
+        for table in self.tables.values():
+            if not table['buffer']['orderId']:
+                continue
+            arrays = [toArrowArray(self.pa, table['buffer'][name], typ) for name, valuePath, typ in table['columns']]
+            table['writer'].write_table(self.pa.Table.from_arrays(arrays, schema=table['schema']))
+            table['buffer'] = {name: [] for name, valuePath, typ in table['columns']}
+        self.buffered = 0
+
+    def close(self):
+        """ Writes what is left and moves the files into place """
+        self.flush()
+        for table in self.tables.values():
+            table['writer'].close()
+        for table in self.tables.values():
+            os.replace(table['tempPath'], table['path'])
+
+    def abort(self):
+        """ Drops the temporary files, leaving the previous output untouched """
+        for table in self.tables.values():
+            table['writer'].close()
+            if os.path.exists(table['tempPath']):
+                os.remove(table['tempPath'])
+
+def flattenColumns(orders):
+    """
+    Function that flattens orders into the columns of the order, item and address tables (see TABLE_COLUMNS).
+    Works column by column instead of order by order: every nested object (items, shipTo, weight...)
+    is gathered once for all orders and every column is then read in a single pass over them.
+
+    Parameters
+    ----------
+        - orders : iterable
+            Orders as returned by the api, a list or any stream of orders
+    Returns
+    -------
+        - columns : dict
+            {table: {column: list of values}}, missing values are None
+    """
+    orders = orders if isinstance(orders, list) else list(orders)
+
+    # Rows of the child tables, with the keys they get from their order
+    items = []
+    itemOrderIds = []
+    addresses = []
+    addressOrderIds = []
+    addressTypes = []
+    for order in orders:
+        orderItems = order.get('items')
+        if orderItems:
+            items.extend(orderItems)
+            itemOrderIds.extend([order['orderId']] * len(orderItems))
+        for addressType in ADDRESS_TYPES:
+            address = order.get(addressType)
+            if address:
+                addresses.append(address)
+                addressOrderIds.append(order['orderId'])
+                addressTypes.append(addressType)
+
+    columns = {
+        'orders': getColumns(orders, ORDER_COLUMNS),
+        'items': {'orderId': itemOrderIds},
+        'addresses': {'orderId': addressOrderIds, 'type': addressTypes},
+    }
+    columns['items'].update(getColumns(items, ITEM_COLUMNS))
+    columns['addresses'].update(getColumns(addresses, ADDRESS_COLUMNS))
+    return columns
+
+def getColumns(rows, columns):
+    """
+    Function that reads the columns of a table out of a list of (nested) dicts.
+
+    Parameters
+    ----------
+        - rows : list
+            Orders, items or addresses
+        - columns : tuple
+            (column, path of the value, type) of every column
+    Returns
+    -------
+        - values : dict
+            {column: list of values}
+    """
+    # Nested objects shared by several columns (weight, dimensions, advancedOptions) are gathered once
+    nested = {(): rows}
+    values = {}
+    for name, valuePath, typ in columns:
+        parents = nested.get(valuePath[:-1])
+        if parents is None:
+            parents = rows
+            for depth in range(1, len(valuePath)):
+                prefix = valuePath[:depth]
+                if prefix not in nested:
+                    nested[prefix] = [parent.get(valuePath[depth - 1]) or {} for parent in parents]
+                parents = nested[prefix]
+        key = valuePath[-1]
+        values[name] = [parent.get(key) for parent in parents]
+    return values
+
+def flattenOrders(orders):
+    """
+    Function that turns orders into flat pandas frames with a stable schema:
+    the columns of TABLE_COLUMNS, in that order, with the dtypes of PANDAS_TYPES and dates as datetime64[ms].
+
+    Parameters
+    ----------
+        - orders : iterable
+            Orders as returned by the api, a list or any stream of orders
+    Returns
+    -------
+        - orders : pandas.DataFrame
+            One row per order
+        - items : pandas.DataFrame
+            One row per line item, with the orderId of its order
+        - addresses : pandas.DataFrame
+            One row per shipTo and billTo address, with the orderId of its order and the address type
+    """
+    import pandas as pd
+    columns = flattenColumns(orders)
+    frames = []
+    for table in ('orders', 'items', 'addresses'):
+        data = {}
+        for name, valuePath, typ in TABLE_COLUMNS[table]:
+            values = columns[table][name]
+            if typ == 'timestamp':
+                # ShipStation dates look like 2024-01-01T10:00:00.0000000, the fraction is dropped
+                strings = pd.Series(coerceValues(values, 'string'), dtype='string')
+                data[name] = pd.to_datetime(strings.str.slice(0, 19), format='%Y-%m-%dT%H:%M:%S', errors='coerce').astype('datetime64[ms]')
+                continue
+            try:
+                data[name] = pd.Series(values, dtype=PANDAS_TYPES[typ])
+            except (TypeError, ValueError):
+                # A value came with another type than usual, e.g. a number sent as a string
+                data[name] = pd.Series(coerceValues(values, typ), dtype=PANDAS_TYPES[typ])
+        frames.append(pd.DataFrame(data, columns=[name for name, valuePath, typ in TABLE_COLUMNS[table]]))
+    return tuple(frames)
+
+def getArrowType(pyarrow, typ):
+    """
+    Function that maps the type names used in TABLE_COLUMNS to arrow types.
+    """
+    return {'int64': pyarrow.int64(), 'float64': pyarrow.float64(), 'bool': pyarrow.bool_(),
+            'string': pyarrow.string(), 'timestamp': pyarrow.timestamp('ms')}[typ]
+
+def toArrowArray(pyarrow, values, typ):
+    """
+    Function that builds a typed arrow array of a column.
+
+    Parameters
+    ----------
+        - pyarrow : module
+        - values : list
+            Values of the column as the api returned them
+        - typ : str
+            Type name of the column
+    Returns
+    -------
+        - array : pyarrow.Array
+    """
+    import pyarrow.compute as pc
+    if typ == 'timestamp':
+        # ShipStation dates look like 2024-01-01T10:00:00.0000000, the fraction is dropped
+        strings = pc.utf8_slice_codeunits(toArrowArray(pyarrow, values, 'string'), 0, 19)
+        return pc.strptime(strings, format='%Y-%m-%dT%H:%M:%S', unit='ms', error_is_null=True)
+    try:
+        return pyarrow.array(values, type=getArrowType(pyarrow, typ))
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OverflowError):
+        # A value came with another type than usual, e.g. a number sent as a string
+        return pyarrow.array(coerceValues(values, typ), type=getArrowType(pyarrow, typ))
+
+# Strings read as booleans by coerceValues
+BOOL_STRINGS = {'true': True, 'yes': True, 'y': True, '1': True, 'false': False, 'no': False, 'n': False, '0': False, '': False}
+
+def coerceValues(values, typ):
+    """
+    Function that converts the values of a column one by one to its type, for columns where the api
+    sent a value of another type than usual. Values that can't be converted become None, so one odd
+    value doesn't fail the whole column.
+
+    Parameters
+    ----------
+        - values : list
+            Values of the column as the api returned them
+        - typ : str
+            Type name of the column: int64, float64, bool or string
+    Returns
+    -------
+        - values : list
+            Values of the type, or None
+    """
+    coerced = []
+    for value in values:
+        try:
+            if value is None:
+                pass
+            elif typ == 'string':
+                value = value if isinstance(value, str) else json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+            elif typ == 'bool':
+                value = BOOL_STRINGS.get(value.strip().lower()) if isinstance(value, str) else bool(value) if isinstance(value, (bool, int, float)) else None
+            elif typ == 'float64':
+                value = float(value) if isinstance(value, (bool, int, float, str)) else None
+            elif typ == 'int64':
+                number = float(value) if isinstance(value, (bool, int, float, str)) else None
+                value = int(value) if isinstance(value, int) else int(number) if number is not None and number.is_integer() and abs(number) < 2 ** 63 else None
+                if value is not None and not -2 ** 63 <= value < 2 ** 63:
+                    value = None
+        except (TypeError, ValueError):
+            value = None
+        coerced.append(value)
+    return coerced
+
+class LabelJournal:
+    """ Append-only journal of label requests, one json line per event, so a crashed run never buys a label twice """
+    def __init__(self, path):
+        """
+        Constructor function. Reads what previous runs journaled and opens the journal for appending.
+
+        Parameters
+        ----------
+            - path : str
+                Path to the journal
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        # orderId: last journaled entry
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut off by a crash
+                        continue
+                    self.entries[entry['orderId']] = entry
+        self.file = open(path, 'a', encoding='utf-8')
+        if self.file.tell() > 0:
+            # Ends a line a crash may have cut off
+            self.file.write('\n')
+
+    def getStatus(self, orderId):
+        """
+        Function that returns what is known about the label of an order.
+
+        Returns
+        -------
+            - status : str
+                'done' if the label was bought, 'unknown' if it was requested without an answer,
+                None if it was never requested or was refused
+        """
+        with self.lock:
+            entry = self.entries.get(orderId)
+        if entry is None or entry['status'] == 'failed':
+            return None
+        return 'done' if entry['status'] == 'done' else 'unknown'
+
+    def getDetails(self, orderId):
+        """ Function that returns the journaled details of a bought label (labelPath, trackingNumber...) """
+        with self.lock:
+            entry = dict(self.entries.get(orderId) or {})
+        entry.pop('orderId', None)
+        entry.pop('status', None)
+        return entry
+
+    def record(self, orderId, status, **details):
+        """
+        Function that journals an event and syncs it to disk before returning.
+
+        Parameters
+        ----------
+            - orderId : int
+            - status : str
+                'started' before the request is sent, 'done' once the label is bought, 'failed' if it was refused
+            - details : dict
+                Anything else to journal with it
+        """
+        entry = dict(details, orderId=orderId, status=status)
+        with self.lock:
+            self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.entries[orderId] = entry
+
+    def close(self):
+        self.file.close()
+
+class WebhookReceiver:
+    """ A small HTTP server for ShipStation webhooks that fetches the batches they point to in the background """
+    def __init__(self, authString, changesPath, maxWorkers=WEBHOOK_WORKERS, dedupeSeconds=WEBHOOK_DEDUPE_SECONDS, client=None):
+        """
+        Constructor function.
+
+        Parameters
+        ----------
+            - authString : str
+                Authentication string produced by loadConfig
+            - changesPath : str
+                File the fetched orders and shipments are appended to
+            - maxWorkers : int
+                Batches fetched at the same time
+            - dedupeSeconds : float
+                Seconds a resource_url is remembered, repeats within that time are ignored
+            - client : ShipStation object
+                Optional api handler, shares the pooled session and rate limiter of the account if not given
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        self.client = client if client is not None else ShipStation(authString)
+        self.changesPath = changesPath
+        self.dedupeSeconds = dedupeSeconds
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self.lock = threading.Lock()
+        # resource_url: time it was accepted
+        self.seen = {}
+        self.server = None
+
+    def submit(self, resourceType, resourceUrl):
+        """
+        Function that queues the fetch of a webhook's batch.
+
+        Parameters
+        ----------
+            - resourceType : str
+                resource_type of the webhook
+            - resourceUrl : str
+                resource_url of the webhook
+        Returns
+        -------
+            - status : int
+                202 if the fetch was queued, 200 if it repeats a recent webhook, 400 if the url is not a ShipStation api url
+        """
+        from urllib.parse import urlsplit
+        # The receiver's credentials are only ever sent to the ShipStation api
+        parts = urlsplit(resourceUrl or '')
+        if parts.scheme != 'https' or parts.netloc != WEBHOOK_API_HOST:
+            LOGGER.writeLog("Rejected webhook with resource_url {}.".format(resourceUrl), severity='warning')
+            return 400
+        with self.lock:
+            now = time.monotonic()
+            for url in [url for url, accepted in self.seen.items() if now - accepted > self.dedupeSeconds]:
+                del self.seen[url]
+            if resourceUrl in self.seen:
+                return 200
+            self.seen[resourceUrl] = now
+        self.executor.submit(self.fetch, resourceType, resourceUrl)
+        return 202
+
+    def fetch(self, resourceType, resourceUrl):
+        """ Fetches a batch and appends it to the changes file. Runs on the executor. """
+        try:
+            key, records = fetchResource(self.client, resourceUrl)
+        except (LoadingError, ValueError) as e:
+            LOGGER.writeLog("Could not fetch {} ({}).".format(resourceUrl, e), severity='error')
+            # Forget the url so the next notification for it is fetched again
+            with self.lock:
+                self.seen.pop(resourceUrl, None)
+            return
+        event = 'changed' if key == 'orders' else 'shipped'
+        record = 'order' if key == 'orders' else 'shipment'
+        appendEvents(self.changesPath, [{'event': event, 'resourceType': resourceType, record: item} for item in records])
+        LOGGER.writeLog("{}: {} {} from {}.".format(resourceType, len(records), key, resourceUrl), severity='normal')
+
+    def start(self, host, port):
+        """ Starts serving in a background thread """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        receiver = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                try:
+                    body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                    payload = json.loads(body.decode('utf-8'))
+                    status = receiver.submit(payload.get('resource_type'), payload.get('resource_url'))
+                except (ValueError, AttributeError):
+                    status = 400
+                # Answer right away, the batch is fetched in the background
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer((host, port), WebhookHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='webhook-receiver', daemon=True).start()
+
+    def stop(self):
+        """ Stops accepting webhooks and waits for the fetches in progress """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.executor.shutdown(wait=True)
+
+class LoadingError(Exception):
+    pass
+
+class ShipStation:
+    """ A driver class to manage connection and make requests to the ShipStation API """
+    def __init__(self, authString, connectTimeout=apiCommon.CONNECT_TIMEOUT, readTimeout=apiCommon.READ_TIMEOUT, session=None, rateLimiter=None, retryPolicy=None, cache=None):
+        """
+        Constructor function. Creates a header template for api calls and picks the session to send them on.
+
+        Parameters
+        ----------
+            - authString : str
+                Authentication string produced by loadConfig
+            - connectTimeout : float
+                Seconds to wait for a connection to the API to be established
+            - readTimeout : float
+                Seconds to wait for the API to send a response
+            - session : requests.Session
+                Session to make the requests on. The process-wide pooled session is used if not provided.
+            - rateLimiter : apiCommon.RateLimiter
+                Scheduler that paces the requests. Shared by all handlers of the same account if not provided.
+            - retryPolicy : apiCommon.RetryPolicy
+                Decides which failed calls are sent again. The shared default policy is used if not provided.
+            - cache : apiCommon.ResponseCache
+                Cache of the endpoints in CACHE_TTLS. The shared cache in CACHE_PATH is used if not provided, False to not cache.
+        """
+        self.timeout = (connectTimeout, readTimeout)
+        if cache is None:
+            cache = apiCommon.getResponseCache(CACHE_PATH, maxSize=CACHE_MAX_SIZE)
+        self.cache = cache
+        self.session = session if session is not None else apiCommon.getSession()
+        if rateLimiter is None:
+            rateLimiter = apiCommon.getRateLimiter('shipstation:' + authString, limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW)
+        self.rateLimiter = rateLimiter
+        self.retryPolicy = retryPolicy if retryPolicy is not None else apiCommon.RETRY_POLICY
+        self.headers = {}
+        self.headers['Host'] = 'ssapi.shipstation.com'
+        self.headers['Authorization'] = authString
+
+    def apicall(self, typ, url, params=None, data=None, idempotent=None, stream=None):
+        """
+        Function that makes a request to the given ShipStation url and returns the decoded response.
+
+        Parameters
+        ----------
+            - typ : str
+                Defines the type of request. (REST functionality)
+                Available types:
+                    - get
+                    - put
+                    - post
+                    - delete
+            - url : str
+                Full url of the endpoint
+            - params : dict
+                Filters sent as the query string of the request
+            - data : dict
+                Body of the request, sent as JSON
+            - idempotent : bool
+                Whether the call may be sent again after a failure. Decided from the type if not given.
+            - stream : callable
+                Optional function that is handed the successful response with its body still unread,
+                for responses too big to hold in memory. Its return value is returned instead of the decoded json.
+        Returns
+        -------
+            - jsonData : json
+                The JSON formatted response data after the request was made
+        """
+        # Note: Don't delete: data is for posts and params is for gets
+        headers = self.headers
+        if data is not None:
+            headers = dict(self.headers)
+            headers['Content-Type'] = 'application/json'
+            data = json.dumps(data)
+
+        # Reference data is served from the cache while it is fresh, then revalidated with the server
+        ttl = getCacheTTL(url) if self.cache and typ.lower() == 'get' and stream is None else None
+        cacheKey = cached = None
+        if ttl:
+            cacheKey = self.cache.getKey(self.headers['Authorization'], url, params)
+            cached = self.cache.get(cacheKey)
+            if cached is not None:
+                if cached['fresh']:
+                    return json.loads(cached['body']) if cached['body'] else {}
+                headers = dict(self.headers)
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['lastModified']:
+                    headers['If-Modified-Since'] = cached['lastModified']
+
+        # apiCommon.runRequest paces, retries and records the call, only the sending is done here
+        def send():
+            return self.session.request(typ.upper(), url, headers=headers, params=params, data=data, timeout=self.timeout, stream=stream is not None)
+        # A streamed body is not read yet, its size is taken from the headers
+        getSize = (lambda response: apiCommon.toNumber(response.headers.get('Content-Length'), int) or 0) if stream is not None else None
+        response = apiCommon.runRequest(send, typ, url, self.rateLimiter, self.retryPolicy, idempotent=idempotent, logger=LOGGER, getSize=getSize)
+        if response is None:
+            raise LoadingError
+
+        # The cached response is still current
+        if response.status_code == 304 and cached is not None:
+            self.cache.refresh(cacheKey, ttl)
+            return json.loads(cached['body']) if cached['body'] else {}
+
+        # Successful response codes
+        if response.status_code in (200, 201, 204):
+            if stream is not None:
+                with response:
+                    return stream(response)
+            if cacheKey is not None:
+                self.cache.put(cacheKey, url, response.content, ttl, etag=response.headers.get('ETag'), lastModified=response.headers.get('Last-Modified'))
+            return json.loads(response.text) if response.text else {}
+
+        logUnsuccessfulResponse(response.status_code, response.text, url, self.headers, params if data is None else data)
+        # The status code tells callers that the request was answered, see createLabel
+        raise LoadingError(response.status_code)
+
+class AsyncShipStation:
+    """ asyncio counterpart of the ShipStation driver class. Requests are made with aiohttp so one event loop can keep many of them in flight. """
+    def __init__(self, authString, connectTimeout=apiCommon.CONNECT_TIMEOUT, readTimeout=apiCommon.READ_TIMEOUT, poolSize=apiCommon.POOL_SIZE, session=None, rateLimiter=None, retryPolicy=None):
+        """
+        Constructor function. Creates a header template for api calls.
+        The aiohttp session is created on first use since it has to belong to the running event loop.
+
+        Parameters
+        ----------
+            - authString : str
+                Authentication string produced by loadConfig
+            - connectTimeout : float
+                Seconds to wait for a connection to the API to be established
+            - readTimeout : float
+                Seconds to wait for the API to send a response
+            - poolSize : int
+                Maximum number of connections kept open at the same time
+            - session : aiohttp.ClientSession
+                Session to make the requests on. Not closed by this object.
+            - rateLimiter : apiCommon.RateLimiter
+                Scheduler that paces the requests. Shared with the synchronous handlers of the same account if not provided.
+            - retryPolicy : apiCommon.RetryPolicy
+                Decides which failed calls are sent again. The shared default policy is used if not provided.
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            LOGGER.writeLog("aiohttp is required for the async mode. Install it with 'pip install aiohttp'.", severity='code-breaker', data={'code':1})
+            exit()
+        self.aiohttp = aiohttp
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connectTimeout, sock_read=readTimeout)
+        self.poolSize = poolSize
+        self.session = session
+        self.ownsSession = session is None
+        if rateLimiter is None:
+            rateLimiter = apiCommon.getRateLimiter('shipstation:' + authString, limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW)
+        self.rateLimiter = rateLimiter
+        self.retryPolicy = retryPolicy if retryPolicy is not None else apiCommon.RETRY_POLICY
+        self.headers = {}
+        self.headers['Host'] = 'ssapi.shipstation.com'
+        self.headers['Authorization'] = authString
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exctype, value, traceBack):
+        await self.close()
+
+    async def close(self):
+        """ Closes the aiohttp session if this object created it """
+        if self.ownsSession and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def apicall(self, typ, url, params=None, data=None, idempotent=None):
+        """
+        Function that makes a request to the given ShipStation url and returns the decoded response.
+
+        Parameters
+        ----------
+            - typ : str
+                Defines the type of request. (get, put, post or delete)
+            - url : str
+                Full url of the endpoint
+            - params : dict
+                Filters sent as the query string of the request
+            - data : dict
+                Body of the request, sent as JSON
+            - idempotent : bool
+                Whether the call may be sent again after a failure. Decided from the type if not given.
+        Returns
+        -------
+            - jsonData : json
+                The JSON formatted response data after the request was made
+        """
+        import asyncio
+        from types import SimpleNamespace
+        if self.session is None:
+            connector = self.aiohttp.TCPConnector(limit=self.poolSize)
+            self.session = self.aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        headers = self.headers
+        if data is not None:
+            headers = dict(self.headers)
+            headers['Content-Type'] = 'application/json'
+            data = json.dumps(data)
+        # aiohttp only accepts strings and numbers in the query string
+        if params is not None:
+            params = {key: (str(value).lower() if isinstance(value, bool) else value) for key, value in params.items()}
+
+        # apiCommon.runRequestAsync paces, retries and records the call, only the sending is done here
+        async def send():
+            async with self.session.request(typ.upper(), url, headers=headers, params=params, data=data) as response:
+                body = await response.read()
+                return SimpleNamespace(status_code=response.status, headers=response.headers, content=body, text=await response.text())
+        response = await apiCommon.runRequestAsync(send, typ, url, self.rateLimiter, self.retryPolicy, idempotent=idempotent, logger=LOGGER,
+                                                   errors=(self.aiohttp.ClientError, asyncio.TimeoutError))
+        if response is None:
+            raise LoadingError
+
+        # Successful response codes
+        if response.status_code in (200, 201, 204):
+            return json.loads(response.text) if response.text else {}
+
+        logUnsuccessfulResponse(response.status_code, response.text, url, self.headers, params if data is None else data)
+        # Same as ShipStation.apicall: the status code tells callers that the request was answered
+        raise LoadingError(response.status_code)
+
+def logUnsuccessfulResponse(statusCode, text, url, headers, payload):
+    """
+    Function that logs the details of an api call that came back with an unsuccessful status code.
+
+    Parameters
+    ----------
+        - statusCode : int
+            Status code of the response
+        - text : str
+            Body of the response
+        - url : str
+            The endpoint of the api call
+        - headers : dict
+            Headers that were sent
+        - payload : dict
+            Query string or body that was sent
+    """
+    LOGGER.writeLog("The api request produced an unsuccessful status code. Details follow below.", severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("Status code from the reuqest: {}.".format(statusCode), severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("Response text: {}.".format(text), severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("Url: {}.".format(url), severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("Headers: {}.".format(headers), severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("Payload: {}.".format(payload), severity='code-breaker', data={'code':1})
+    LOGGER.writeLog("*RESPONSE DETAILS END*", severity='code-breaker', data={'code':1})
 
 # Determine log file path
 # TODO: Switch to false
-LOGGER = Logger(verbose=False)
+LOGGER = apiCommon.Logger('shipstation', verbose=False)
+
+IMPORT_TIME = (time.perf_counter() - IMPORT_START) * 1000
 
 if __name__ == "__main__":
     sys.stdout = LOGGER